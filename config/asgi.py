@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# After setup: the store's modules need the settings.
+from store.asgi import LifespanApplication  # noqa: E402
+
+application = LifespanApplication(django_application)
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from datetime import timedelta
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,13 +48,14 @@ INSTALLED_APPS = [
     'django_filters',
     'rest_framework',
     'djoser',
-    'debug_toolbar',
     'store',
     'core',
 ]
 
 MIDDLEWARE = [
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    'store.metrics.MetricsMiddleware',
+    'store.queries.QueryBudgetMiddleware',
+    'store.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,6 +69,16 @@ INTERNAL_IPS = [
     "127.0.0.1",
 ]
 
+# The debug toolbar refuses to run under the test runner.
+TESTING = 'test' in sys.argv
+
+# Its middleware is sync only, so turn it off (DEBUG_TOOLBAR=0) when serving with ASGI.
+DEBUG_TOOLBAR = not TESTING and os.environ.get('DEBUG_TOOLBAR', '1') == '1'
+
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS += ['debug_toolbar']
+    MIDDLEWARE.insert(0, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 
 
 ROOT_URLCONF = 'config.urls'
@@ -93,13 +105,199 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# DATABASE_ENGINE picks the profile: 'sqlite' or 'postgresql' (needs psycopg).
+# Connections are reused for DATABASE_CONN_MAX_AGE seconds instead of being
+# opened for every request; PostgreSQL ones are health-checked before reuse.
+# Set DATABASE_PGBOUNCER=1 when connecting through PgBouncer in transaction mode.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+
+DATABASE_PROFILES = {
+    'sqlite': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        # A file (not in-memory) test database, so concurrency tests see real locking.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    'postgresql': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DATABASE_NAME', 'mystore'),
+        'USER': os.environ.get('DATABASE_USER', 'postgres'),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', '127.0.0.1'),
+        'PORT': os.environ.get('DATABASE_PORT', '5432'),
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DATABASE_PGBOUNCER') == '1',
+        'OPTIONS': {'connect_timeout': 5},
+    },
+}
+
+DATABASES = {
+    'default': DATABASE_PROFILES[DATABASE_ENGINE],
+}
+
+# Read replicas: DATABASE_REPLICAS lists copies of the primary, as database
+# files (sqlite) or hosts (postgresql). GET/HEAD/OPTIONS requests read from
+# them, except for users and carts that wrote in the last
+# DATABASE_REPLICA_STICKY_SECONDS (store/routers.py), remembered in the
+# 'sticky' cache. 'locmem' is private to each worker, so with several workers
+# set DATABASE_STICKY_CACHE_BACKEND to 'file' (one host) or 'redis' (needs the
+# redis package) for users to read their own writes. Locally,
+# `manage.py replicate_sqlite --interval 2` stands in for replication.
+
+for index, replica in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'NAME' if DATABASE_ENGINE == 'sqlite' else 'HOST': replica.strip(),
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+if TESTING and DATABASE_ENGINE == 'sqlite':
+    # Second SQLite file for the replica routing tests (store.testing.SQLiteReplicaTestMixin),
+    # which put it in DATABASE_REPLICAS themselves.
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'NAME': BASE_DIR / 'test_db.replica.sqlite3'}}
+
+DATABASE_ROUTERS = ['store.routers.ReplicaRouter']
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS', 5))
+DATABASE_STICKY_CACHE = os.environ.get('DATABASE_STICKY_CACHE', 'sticky')
+DATABASE_STICKY_CACHE_BACKEND = os.environ.get('DATABASE_STICKY_CACHE_BACKEND', 'locmem')
+
+DATABASE_STICKY_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sticky',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DATABASE_STICKY_CACHE_LOCATION', BASE_DIR / 'cache' / 'sticky'),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('DATABASE_STICKY_CACHE_LOCATION', 'redis://127.0.0.1:6379/2'),
+    },
 }
 
+# Applied to every new SQLite connection (store/database.py). WAL lets readers
+# run while a write is in progress, and NORMAL sync is durable enough with it.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
+}
+
+
+# Query budgets
+# Requests running more queries than their budget (by method and URL name)
+# are logged, as are requests repeating one query shape QUERY_REPEAT_THRESHOLD
+# times. The budgets are the measured counts plus a little headroom; checkout
+# is mostly writes (order, inventory, items, cart, outbox event).
+
+QUERY_BUDGET_DEFAULT = 20
+QUERY_BUDGETS = {
+    'GET store:product-list': 5,
+    'GET store:product-detail': 5,
+    'PATCH store:product-detail': 8,
+    'GET store:cart-detail': 4,
+    'GET store:order-list': 5,
+    'POST store:order-list': 18,
+}
+QUERY_REPEAT_THRESHOLD = 5
+QUERY_BUDGET_HEADERS = DEBUG
+
+
+# Cache
+# The catalog cache holds rendered product and banner responses. 'locmem' is
+# private to each worker; 'file' and 'db' let all workers share one warm cache
+# ('db' needs `python manage.py createcachetable`).
+
+CATALOG_CACHE_BACKEND = os.environ.get('CATALOG_CACHE_BACKEND', 'locmem')
+CATALOG_CACHE_TIMEOUT = 60 * 15
+CATALOG_CACHE_LOCK_TIMEOUT = 10
+
+CATALOG_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+    },
+    'file': {
+        'BACKEND': 'store.cache.LRUFileBasedCache',
+        'LOCATION': os.environ.get('CATALOG_CACHE_LOCATION', BASE_DIR / 'cache' / 'catalog'),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'store_catalog_cache',
+    },
+}
+
+# Carts
+# 'store.carts.DatabaseCartStore' keeps carts in store_cart/store_cartitem.
+# 'store.carts.CacheCartStore' keeps them in the 'carts' cache until
+# CART_STORE_TIMEOUT seconds after their last change and only writes the order
+# at checkout. 'locmem' is private to each worker; use 'file' for several
+# workers on one host and 'redis' (needs the redis package) across hosts.
+
+CART_STORE = os.environ.get('CART_STORE', 'store.carts.DatabaseCartStore')
+CART_CACHE_BACKEND = os.environ.get('CART_CACHE_BACKEND', 'locmem')
+CART_STORE_TIMEOUT = 60 * 60 * 24 * 7
+CART_STORE_LOCK_TIMEOUT = 5
+
+# Database carts older than this are removed by `python manage.py purge_abandoned_carts`.
+ABANDONED_CART_DAYS = 30
+
+CART_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carts',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CART_CACHE_LOCATION', BASE_DIR / 'cache' / 'carts'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CART_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        **CATALOG_CACHE_BACKENDS[CATALOG_CACHE_BACKEND],
+        'TIMEOUT': CATALOG_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'carts': {
+        **CART_CACHE_BACKENDS[CART_CACHE_BACKEND],
+        'TIMEOUT': CART_STORE_TIMEOUT,
+    },
+    'sticky': DATABASE_STICKY_CACHE_BACKENDS[DATABASE_STICKY_CACHE_BACKEND],
+}
+
+
+# Product search
+# SQLite FTS5 index; use 'store.search.NullSearchBackend' on databases without one.
+
+PRODUCT_SEARCH_BACKEND = os.environ.get(
+    'PRODUCT_SEARCH_BACKEND',
+    'store.search.SQLiteFTSSearchBackend' if DATABASE_ENGINE == 'sqlite' else 'store.search.NullSearchBackend',
+)
+
+# Serve the product list and cart detail from tuple rows instead of model
+# instances and serializers (see store/fastpath.py). The output is identical.
+READ_FAST_PATH = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -161,7 +359,7 @@ REST_FRAMEWORK = {
     ),
 
     'DEFAULT_RENDERER_CLASSES':[
-        'store.renders.CustomRenderer',
+        'store.renders.FastCustomRenderer',
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ]
@@ -187,6 +385,9 @@ AUTH_USER_MODEL = 'core.CustomUser'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Processes rendering thumbnail/medium/large variants of uploaded images.
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', 2))
+
 
 
 CKEDITOR_UPLOAD_PATH = 'uploads/'
@@ -206,6 +407,36 @@ CKEDITOR_CONFIGS = {
 }
 
 
+# Metrics
+# Served at /metrics to requests with an "Authorization: Bearer <METRICS_TOKEN>"
+# header (Prometheus' `authorization` scrape option), and not at all while
+# METRICS_TOKEN is empty. Set PROMETHEUS_MULTIPROC_DIR in the environment to
+# aggregate the metrics of several worker processes.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+# Outbox
+# Events such as order_created are dispatched by `manage.py drain_outbox`.
+# A failed event is retried after OUTBOX_RETRY_BACKOFF seconds, doubling on
+# every attempt, and given up after OUTBOX_MAX_ATTEMPTS. A claimed event is
+# picked up again if its worker hasn't finished it in OUTBOX_LEASE_SECONDS.
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BACKOFF = 2
+OUTBOX_LEASE_SECONDS = 60
+
+
 # ZarinPal
+# Set ZARINPAL_BASE_URL to use another host than the (sandbox) gateway, such as
+# the local simulator: `manage.py zarinpal_simulator --port 8001` and
+# ZARINPAL_BASE_URL=http://127.0.0.1:8001.
 SANDBOX = True
-ZARINPALL_MERCHANT_ID = 'aaabbbaaabbbaaabbbaaabbbaaabbbaaabbb'
\ No newline at end of file
+ZARINPAL_BASE_URL = os.environ.get('ZARINPAL_BASE_URL', '')
+# Serve the async pay/verify views (with `uvicorn config.asgi:application`).
+ASYNC_PAYMENT_VIEWS = os.environ.get('ASYNC_PAYMENT_VIEWS') == '1'
+ZARINPAL_ASYNC_MAX_CONNECTIONS = 500
+ZARINPALL_MERCHANT_ID = 'aaabbbaaabbbaaabbbaaabbbaaabbbaaabbb'
+ZARINPAL_CONNECT_TIMEOUT = 3.05
+ZARINPAL_READ_TIMEOUT = 10
+ZARINPAL_VERIFY_RETRIES = 2
+ZARINPAL_RETRY_BACKOFF = 0.5
+ZARINPAL_POOL_SIZE = 10
@@ -1,7 +1,13 @@
+import logging
+
 from django.dispatch import receiver
+
 from store.signals import order_created
 
 
+logger = logging.getLogger(__name__)
+
+
 @receiver(order_created)
 def after_order_created(sender, **kwargs):
-    print(f'New order is created {kwargs["order"].id}')
\ No newline at end of file
+    logger.info('New order is created %s', kwargs['order'].id)
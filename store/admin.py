@@ -1,8 +1,7 @@
 from typing import Any
 from django.contrib import admin, messages
 from django.db.models.query import QuerySet
-from django.http import HttpRequest
-from django.db.models import Count
+from django.http import HttpRequest, HttpResponseRedirect
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.http import urlencode
@@ -10,7 +9,12 @@ from jalali_date.admin import ModelAdminJalaliMixin
 
 
 
-from .models import BannerImage, Cart, CartItem, Customer, Order, OrderItem, Product, ProductImages
+from . import inventory, sales
+from .cache import catalog_cache
+from .models import (
+    BannerImage, Cart, CartItem, Customer, DailyProductSales, DailySales, Order, OrderItem, OutboxEvent, Product,
+    ProductImages,
+)
 
 class InventoryFilter(admin.SimpleListFilter):
 
@@ -71,6 +75,7 @@ class ProductAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
         update_count = queryset.update(inventory=0)
+        catalog_cache.invalidate('product')
         self.message_user(
             request,
             f'{update_count} of products inventories cleared to zero',
@@ -86,7 +91,7 @@ class OrderItemInline(admin.TabularInline):
 
 
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'customer', 'status','datetime_created', 'num_of_items']
+    list_display = ['id', 'customer', 'status','datetime_created', 'num_of_items', 'total_price']
     list_editable = ['status']
     list_per_page = 5
     ordering = ['-datetime_created',]
@@ -94,8 +99,42 @@ class OrderAdmin(admin.ModelAdmin):
 
 
     def get_queryset(self, request: HttpRequest):
-        return super().get_queryset(request).prefetch_related('items').annotate(items_count=Count('items'))
-
+        return super().get_queryset(request).select_related('customer__user')
+
+
+    def changeform_view(self, request, *args, **kwargs):
+        return self._report_status_errors(super().changeform_view, request, *args, **kwargs)
+
+    def changelist_view(self, request, *args, **kwargs):
+        return self._report_status_errors(super().changelist_view, request, *args, **kwargs)
+
+    def _report_status_errors(self, view, request, *args, **kwargs):
+        # Both views save in one transaction, which the error rolls back
+        # (items and other orders of a list_editable save included).
+        try:
+            return view(request, *args, **kwargs)
+        except (inventory.InsufficientInventory, inventory.StaleOrderStatus):
+            self.message_user(request, 'Could not change the order status: not enough inventory or it was '
+                                       'changed by someone else. Nothing was saved.', messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
+    def save_model(self, request, obj, form, change):
+        if change and 'status' in form.changed_data:
+            status = obj.status
+            obj.status = form.initial['status']
+            inventory.update_order_status(obj, status)
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        # The items of a paid order are counted in the sales rollups: move them
+        # from the old items to the edited ones.
+        paid = form.instance.status == Order.ORDER_STATUS_PAID
+        items_changed = change and any(formset.has_changed() for formset in formsets)
+        if paid and items_changed:
+            sales.remove_orders([form.instance.pk])
+        super().save_related(request, form, formsets, change)
+        if paid and (items_changed or not change):
+            sales.add_orders([form.instance.pk])
 
     @admin.display(ordering='items_count', description='# items')
     def num_of_items(self, order):
@@ -139,3 +178,38 @@ class CartItemInline(admin.TabularInline):
 class CartAdmin(admin.ModelAdmin):
     list_display = ['id', 'created_at']
     inlines = [CartItemInline]
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event_type', 'status', 'attempts', 'created_at', 'processed_at']
+    list_filter = ['status', 'event_type']
+    list_per_page = 20
+    readonly_fields = ['created_at', 'processed_at', 'claim', 'last_error']
+
+
+class SalesRollupAdmin(admin.ModelAdmin):
+    """Read-only: the rollups are maintained by store/sales.py."""
+    date_hierarchy = 'date'
+    list_per_page = 31
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DailySales)
+class DailySalesAdmin(SalesRollupAdmin):
+    list_display = ['date', 'orders_count', 'items_sold', 'revenue']
+
+
+@admin.register(DailyProductSales)
+class DailyProductSalesAdmin(SalesRollupAdmin):
+    list_display = ['date', 'product', 'orders_count', 'quantity', 'revenue']
+    list_select_related = ['product']
+    search_fields = ['product__name']
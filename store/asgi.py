@@ -0,0 +1,36 @@
+"""
+ASGI lifespan for the store.
+
+Django's ASGI handler only speaks HTTP. `LifespanApplication` answers the
+server's lifespan events around it and, on shutdown, closes the aiohttp
+session the async gateway client keeps for the server's event loop (see
+`zarinpal.AsyncZarinpalClient`).
+"""
+import logging
+
+from store import zarinpal
+
+
+logger = logging.getLogger(__name__)
+
+
+class LifespanApplication:
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await self.application(scope, receive, send)
+
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    await zarinpal.async_client.aclose()
+                except Exception:
+                    logger.exception('Could not close the gateway client session')
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,99 @@
+"""
+Helpers shared by the `bench_*` management commands.
+"""
+import math
+import random
+import statistics
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.test.utils import setup_databases, teardown_databases
+from django.utils.text import slugify
+
+from store.carts import OPERATION_SET, get_cart_store
+from store.models import BannerImage, Product, ProductImages
+from store.search import get_search_backend
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(timings, queries=None, elapsed=None):
+    """Latency percentiles in milliseconds, mean queries per request and throughput."""
+    summary = {
+        'requests': len(timings),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 3) if timings else 0.0,
+    }
+    if queries is not None:
+        summary['queries_per_request'] = round(statistics.fmean(queries), 2) if queries else 0.0
+    total = elapsed if elapsed is not None else sum(timings)
+    summary['throughput_rps'] = round(len(timings) / total, 2) if total else 0.0
+    return summary
+
+
+def create_test_databases():
+    """
+    Point every database alias at a throwaway test database, like the test
+    runner: the primary gets a new one and the replicas (TEST MIRROR) read
+    from it, so no benchmark touches the real files or servers. Pass the
+    result to `destroy_test_databases`.
+    """
+    connections.close_all()
+    return setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+
+
+def destroy_test_databases(old_config):
+    connections.close_all()
+    teardown_databases(old_config, verbosity=0)
+
+
+WORDS = ['گوشی', 'کیف', 'کفش', 'لباس', 'کتاب', 'ساعت', 'عینک', 'phone', 'case', 'cable', 'charger', 'lamp']
+
+
+@transaction.atomic
+def seed_catalog(products=2000, images_per_product=2, banners=10, seed=0):
+    """Create a deterministic catalog of `products` products with images and banners."""
+    rng = random.Random(seed)
+    names = [
+        f'{" ".join(rng.choice(WORDS) for _ in range(3))} {index}'
+        for index in range(products)
+    ]
+    created = Product.objects.bulk_create([
+        Product(
+            name=name,
+            slug=slugify(name, allow_unicode=True),
+            description=f'<p>{" ".join(rng.choice(WORDS) for _ in range(30))}</p>',
+            unit_price=Decimal(rng.randint(100, 99999)) / 100,
+            inventory=10 ** 6,
+            cover=f'cover/{index}.jpeg',
+        )
+        for index, name in enumerate(names)
+    ], batch_size=500)
+    ProductImages.objects.bulk_create([
+        ProductImages(product=product, images=f'product-images/{product.id}-{image}.png')
+        for product in created for image in range(images_per_product)
+    ], batch_size=500)
+    BannerImage.objects.bulk_create([
+        BannerImage(title=f'Banner {index}', banner=f'banner/{index}.jpeg') for index in range(banners)
+    ])
+    # bulk_create skips the save signals that keep the search index up to date.
+    get_search_backend().rebuild()
+    return created
+
+
+def make_cart(products, lines=3, quantity=1):
+    """Create a cart through the configured cart store and return its id."""
+    cart_store = get_cart_store()
+    cart_id = cart_store.create()
+    cart_store.apply(cart_id, [
+        {'product': product.id, 'quantity': quantity, 'op': OPERATION_SET} for product in products[:lines]
+    ])
+    return cart_id
@@ -0,0 +1,196 @@
+import hashlib
+import os
+import threading
+import time
+import weakref
+from contextlib import nullcontext
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from store.routers import get_sticky_seconds, primary_reads
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """
+    File cache shared by every worker on the host. Hits refresh the file's
+    mtime and culling drops the least recently used files first.
+    """
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, default, version)
+        if value is not default:
+            try:
+                os.utime(self._key_to_file(key, version))
+            except OSError:
+                pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+
+        def last_used(fname):
+            try:
+                return os.path.getmtime(fname)
+            except OSError:
+                return 0
+
+        filelist.sort(key=last_used)
+        for fname in filelist[:num_entries // self._cull_frequency]:
+            self._delete(fname)
+
+
+class CatalogCache:
+    """
+    Rendered-response cache for the read-only catalog endpoints.
+
+    Entries are grouped in namespaces ('product', 'banner'). Every namespace has
+    a generation token stored next to the entries; bumping it on a model change
+    orphans all entries of that namespace at once, and they age out by LRU.
+
+    For `DATABASE_REPLICA_STICKY_SECONDS` after an invalidation a namespace is
+    `recently_invalidated`: the replicas may not have the change yet, so its
+    entries are rendered from the primary. Otherwise they come from a replica.
+    """
+    def __init__(self, alias='catalog'):
+        self.alias = alias
+        self._locks = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 15)
+
+    @property
+    def lock_timeout(self):
+        return getattr(settings, 'CATALOG_CACHE_LOCK_TIMEOUT', 10)
+
+    def get_generation(self, namespace):
+        key = f'catalog:{namespace}:generation'
+        generation = self.cache.get(key)
+        if generation is None:
+            generation = uuid4().hex
+            if not self.cache.add(key, generation, None):
+                generation = self.cache.get(key, generation)
+        return generation
+
+    def invalidate(self, namespace):
+        self.cache.set(f'catalog:{namespace}:generation', uuid4().hex, None)
+        self.cache.set(f'catalog:{namespace}:invalidated', True, get_sticky_seconds())
+
+    def recently_invalidated(self, namespace):
+        return self.cache.get(f'catalog:{namespace}:invalidated') is not None
+
+    def make_key(self, namespace, request):
+        query = sorted(request.query_params.lists())
+        parts = [
+            request.method,
+            request.build_absolute_uri(request.path),
+            repr(query),
+            request.META.get('HTTP_ACCEPT_LANGUAGE', ''),
+            request.accepted_media_type or '',
+        ]
+        digest = hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+        return f'catalog:{namespace}:{self.get_generation(namespace)}:{digest}'
+
+    def _get_local_lock(self, key):
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._locks[key] = lock
+            return lock
+
+    def get_or_render(self, key, render):
+        """
+        Return the cached `(status, content, content_type)` for `key`, calling
+        `render` at most once per key across threads (local lock) and worker
+        processes (a short-lived `add` lock in the shared backend).
+        """
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, True
+
+        with self._get_local_lock(key):
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, True
+
+            lock_key = f'{key}:lock'
+            if not self.cache.add(lock_key, 1, self.lock_timeout):
+                cached = self._wait_for(key)
+                if cached is not None:
+                    return cached, True
+
+            try:
+                rendered = render()
+                if rendered[0] == 200:
+                    self.cache.set(key, rendered, self.timeout)
+            finally:
+                self.cache.delete(lock_key)
+            return rendered, False
+
+    def _wait_for(self, key):
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.01
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            delay = min(delay * 2, 0.2)
+        return None
+
+
+catalog_cache = CatalogCache()
+
+
+class CatalogCacheMixin:
+    """
+    Serve `list` and `retrieve` of a catalog viewset from `catalog_cache`.
+    Browsable API pages are user specific and always bypass the cache.
+    """
+    catalog_cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(super().retrieve, request, *args, **kwargs)
+
+    def _cached(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format == 'api':
+            return handler(request, *args, **kwargs)
+
+        namespace = self.catalog_cache_namespace
+
+        def render():
+            # The entry is kept for the whole timeout: right after a change, a
+            # lagging replica may not have the write that started this generation yet.
+            with primary_reads() if catalog_cache.recently_invalidated(namespace) else nullcontext():
+                response = handler(request, *args, **kwargs)
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+            return response.status_code, response.content, response['Content-Type']
+
+        key = catalog_cache.make_key(namespace, request)
+        (status_code, content, content_type), hit = catalog_cache.get_or_render(key, render)
+        response = HttpResponse(content, status=status_code, content_type=content_type)
+        response['X-Catalog-Cache'] = 'hit' if hit else 'miss'
+        patch_vary_headers(response, ['Accept-Language'])
+        return response
@@ -0,0 +1,368 @@
+"""
+Cart storage.
+
+`DatabaseCartStore` keeps carts in `store_cart`/`store_cartitem`.
+`CacheCartStore` keeps them in a cache alias instead, expiring
+`CART_STORE_TIMEOUT` seconds after their last change, so anonymous carts
+never touch the database: their content is only written at checkout, as the
+order. Both hand out unsaved-looking `CartItem` instances so the cart
+serializers work unchanged.
+"""
+import time
+from abc import ABC, abstractmethod
+from functools import partial
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from store.models import Cart, CartItem, Product
+
+
+OPERATION_SET = 'set'
+OPERATION_ADD = 'add'
+OPERATION_REMOVE = 'remove'
+
+
+class CartNotFound(Exception):
+    pass
+
+
+def apply_operations(quantities, operations):
+    """Final quantity per product after applying bulk set/add/remove operations to `quantities`."""
+    quantities = dict(quantities)
+    for operation in operations:
+        product_id = operation['product']
+        if operation['op'] == OPERATION_ADD:
+            quantities[product_id] = quantities.get(product_id, 0) + operation['quantity']
+        elif operation['op'] == OPERATION_SET:
+            quantities[product_id] = operation['quantity']
+        else:
+            quantities[product_id] = 0
+    return quantities
+
+
+def parse_item_id(item_id):
+    """A cart item id from the URL as an int, None if it isn't one."""
+    try:
+        return int(item_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def with_products(items):
+    """
+    Attach `product` (id, name and unit price only) to cart items with one
+    query, dropping lines whose product has been deleted since.
+    """
+    products = Product.objects.only('id', 'name', 'unit_price').in_bulk({item.product_id for item in items})
+    attached = []
+    for item in items:
+        product = products.get(item.product_id)
+        if product is not None:
+            item.product = product
+            attached.append(item)
+    return attached
+
+
+class BaseCartStore(ABC):
+    # True when carts are `Cart`/`CartItem` rows that querysets can read directly.
+    models = False
+
+    @abstractmethod
+    def create(self):
+        """Create an empty cart and return its id."""
+
+    def exists(self, cart_id):
+        return self.items(cart_id) is not None
+
+    @abstractmethod
+    def items(self, cart_id):
+        """The cart's items ordered by id, or None if there is no such cart."""
+
+    @abstractmethod
+    def add(self, cart_id, product_id, quantity):
+        """Add `quantity` to the product's line, creating it if needed. None if there is no such cart."""
+
+    @abstractmethod
+    def update(self, cart_id, item_id, quantity):
+        """Set the quantity of the item. None if there is no such cart or item (`item_id` may be any string)."""
+
+    @abstractmethod
+    def remove(self, cart_id, item_id):
+        """Remove the item. False if there is no such cart or item (`item_id` may be any string)."""
+
+    @abstractmethod
+    def apply(self, cart_id, operations):
+        """Apply bulk operations atomically. False if there is no such cart."""
+
+    @abstractmethod
+    def delete(self, cart_id):
+        """Delete the cart. False if there is no such cart."""
+
+    @abstractmethod
+    def checkout(self, cart_id):
+        """
+        Called inside the order transaction: remove the cart once the order is
+        saved. Raises CartNotFound if the cart is gone or already checked out.
+        """
+
+    def release_checkout(self, cart_id):
+        """
+        Called when the order transaction fails after `checkout`, so the cart
+        can be checked out again. Nothing to do when `checkout` only wrote in
+        that transaction.
+        """
+
+
+class DatabaseCartStore(BaseCartStore):
+    models = True
+
+    def create(self):
+        return Cart.objects.create().id
+
+    def exists(self, cart_id):
+        return Cart.objects.filter(id=cart_id).exists()
+
+    def items(self, cart_id):
+        items = list(CartItem.objects.filter(cart_id=cart_id))
+        if not items and not self.exists(cart_id):
+            return None
+        return items
+
+    def add(self, cart_id, product_id, quantity):
+        return CartItem.objects.add_quantity(cart_id, product_id, quantity)
+
+    def update(self, cart_id, item_id, quantity):
+        item_id = parse_item_id(item_id)
+        if item_id is None:
+            return None
+        item = CartItem.objects.filter(cart_id=cart_id, id=item_id).first()
+        if item is not None:
+            item.quantity = quantity
+            item.save(update_fields=['quantity'])
+        return item
+
+    def remove(self, cart_id, item_id):
+        item_id = parse_item_id(item_id)
+        if item_id is None:
+            return False
+        deleted, _ = CartItem.objects.filter(cart_id=cart_id, id=item_id).delete()
+        return bool(deleted)
+
+    def apply(self, cart_id, operations):
+        if not self.exists(cart_id):
+            return False
+
+        # Lines that are only added to are incremented by the database, so
+        # concurrent additions add up. Set and remove make the quantity
+        # absolute: those lines are read, then written.
+        absolute_ids = {item['product'] for item in operations if item['op'] != OPERATION_ADD}
+        added = {}
+        for item in operations:
+            if item['product'] not in absolute_ids and item['quantity'] > 0:
+                added[item['product']] = added.get(item['product'], 0) + item['quantity']
+        operations = [item for item in operations if item['product'] in absolute_ids]
+
+        with transaction.atomic():
+            existing = {
+                cart_item.product_id: cart_item
+                for cart_item in CartItem.objects.filter(cart_id=cart_id, product_id__in=absolute_ids)
+            }
+            quantities = apply_operations(
+                {product_id: cart_item.quantity for product_id, cart_item in existing.items()}, operations,
+            )
+
+            to_create, to_update, to_delete = [], [], []
+            for product_id, quantity in quantities.items():
+                cart_item = existing.get(product_id)
+                if quantity <= 0:
+                    if cart_item is not None:
+                        to_delete.append(cart_item.id)
+                elif cart_item is None:
+                    to_create.append(CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity))
+                elif cart_item.quantity != quantity:
+                    cart_item.quantity = quantity
+                    to_update.append(cart_item)
+
+            if to_create:
+                CartItem.objects.bulk_create(
+                    to_create, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'],
+                )
+            if to_update:
+                CartItem.objects.bulk_update(to_update, ['quantity'])
+            if to_delete:
+                CartItem.objects.filter(id__in=to_delete).delete()
+            CartItem.objects.add_quantities(cart_id, added)
+        return True
+
+    def delete(self, cart_id):
+        deleted, _ = Cart.objects.filter(id=cart_id).delete()
+        return bool(deleted)
+
+    def checkout(self, cart_id):
+        if not self.delete(cart_id):
+            raise CartNotFound(cart_id)
+
+
+class CacheCartStore(BaseCartStore):
+    """
+    Carts as `{'created_at', 'next_id', 'items': [[id, product_id, quantity], ...]}`
+    entries of the `CART_STORE_CACHE` alias. Every change runs under a short
+    `add` lock per cart so concurrent requests don't lose updates; use a shared
+    backend (file on one host, Redis across hosts) when running several workers.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias or getattr(settings, 'CART_STORE_CACHE', 'carts')
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'CART_STORE_TIMEOUT', 60 * 60 * 24 * 7)
+
+    @property
+    def lock_timeout(self):
+        return getattr(settings, 'CART_STORE_LOCK_TIMEOUT', 5)
+
+    def make_key(self, cart_id):
+        return f'cart:{UUID(str(cart_id)).hex}'
+
+    def _to_items(self, cart_id, cart):
+        return [
+            CartItem(id=item_id, cart_id=UUID(str(cart_id)), product_id=product_id, quantity=quantity)
+            for item_id, product_id, quantity in cart['items']
+        ]
+
+    def _lock(self, key):
+        lock_key = f'{key}:lock'
+        token = uuid4().hex
+        # The lock expires after `lock_timeout`, so waiting twice as long always gets it.
+        deadline = time.monotonic() + 2 * self.lock_timeout
+        delay = 0.002
+        while not self.cache.add(lock_key, token, self.lock_timeout):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Could not lock {key}')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return lock_key, token
+
+    def _unlock(self, lock_key, token):
+        if self.cache.get(lock_key) == token:
+            self.cache.delete(lock_key)
+
+    def _change(self, cart_id, change):
+        """Run `change(cart)` under the cart's lock and save the cart. None if there is no such cart."""
+        key = self.make_key(cart_id)
+        lock = self._lock(key)
+        try:
+            cart = self.cache.get(key)
+            if cart is None:
+                return None
+            result = change(cart)
+            self.cache.set(key, cart, self.timeout)
+            return result
+        finally:
+            self._unlock(*lock)
+
+    def create(self):
+        cart_id = uuid4()
+        self.cache.set(self.make_key(cart_id), {'created_at': time.time(), 'next_id': 1, 'items': []}, self.timeout)
+        return cart_id
+
+    def exists(self, cart_id):
+        return self.cache.has_key(self.make_key(cart_id))
+
+    def items(self, cart_id):
+        cart = self.cache.get(self.make_key(cart_id))
+        if cart is None:
+            return None
+        return self._to_items(cart_id, cart)
+
+    def add(self, cart_id, product_id, quantity):
+        def change(cart):
+            for item in cart['items']:
+                if item[1] == product_id:
+                    item[2] += quantity
+                    return item
+            item = [cart['next_id'], product_id, quantity]
+            cart['next_id'] += 1
+            cart['items'].append(item)
+            return item
+
+        item = self._change(cart_id, change)
+        if item is None:
+            return None
+        return CartItem(id=item[0], cart_id=UUID(str(cart_id)), product_id=item[1], quantity=item[2])
+
+    def update(self, cart_id, item_id, quantity):
+        item_id = parse_item_id(item_id)
+        if item_id is None:
+            return None
+
+        def change(cart):
+            for item in cart['items']:
+                if item[0] == item_id:
+                    item[2] = quantity
+                    return item
+
+        item = self._change(cart_id, change)
+        if item is None:
+            return None
+        return CartItem(id=item[0], cart_id=UUID(str(cart_id)), product_id=item[1], quantity=item[2])
+
+    def remove(self, cart_id, item_id):
+        item_id = parse_item_id(item_id)
+        if item_id is None:
+            return False
+
+        def change(cart):
+            items = [item for item in cart['items'] if item[0] != item_id]
+            removed = len(items) != len(cart['items'])
+            cart['items'] = items
+            return removed
+
+        return bool(self._change(cart_id, change))
+
+    def apply(self, cart_id, operations):
+        def change(cart):
+            lines = {product_id: [item_id, product_id, quantity] for item_id, product_id, quantity in cart['items']}
+            quantities = apply_operations(
+                {product_id: line[2] for product_id, line in lines.items()}, operations,
+            )
+            for product_id, quantity in quantities.items():
+                if product_id in lines:
+                    lines[product_id][2] = quantity
+                elif quantity > 0:
+                    lines[product_id] = [cart['next_id'], product_id, quantity]
+                    cart['next_id'] += 1
+            cart['items'] = sorted((line for line in lines.values() if line[2] > 0), key=lambda line: line[0])
+            return True
+
+        return bool(self._change(cart_id, change))
+
+    def delete(self, cart_id):
+        key = self.make_key(cart_id)
+        existed = self.cache.has_key(key)
+        self.cache.delete(key)
+        return existed
+
+    def checkout(self, cart_id):
+        key = self.make_key(cart_id)
+        # Claim the cart so a concurrent checkout of the same cart fails.
+        if not self.exists(cart_id) or not self.cache.add(f'{key}:checkout', 1, self.lock_timeout):
+            raise CartNotFound(cart_id)
+        transaction.on_commit(partial(self.delete, cart_id))
+
+    def release_checkout(self, cart_id):
+        self.cache.delete(f'{self.make_key(cart_id)}:checkout')
+
+
+def get_cart_store():
+    store_path = getattr(settings, 'CART_STORE', 'store.carts.DatabaseCartStore')
+    return import_string(store_path)()
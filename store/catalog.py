@@ -0,0 +1,229 @@
+"""
+Bulk catalog import and export, as CSV or JSON Lines with the columns of
+`FIELDS`.
+
+`export_lines` streams the products from a server-side iterator, one line at
+a time. `import_products` reads rows as they are parsed and handles them in
+chunks: each chunk is validated with `ProductImportSerializer` and written
+with one `bulk_create` and one batched `UPDATE` in its own transaction. Rows
+with an id update that product (only the columns they have), the others create
+a product, with a slug made from its name unless they have one. Invalid rows
+(including JSON Lines that don't parse) are skipped and reported. A file that
+can't be read any further (bytes that aren't UTF-8, broken CSV quoting) stops
+the import: the rows before are imported and the result is marked incomplete
+with the row it stopped at.
+
+The bulk queries don't send `post_save`, so the import indexes the products
+for search and invalidates the product catalog cache itself.
+"""
+import codecs
+import csv
+
+import orjson
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework.exceptions import ValidationError
+
+from store.cache import catalog_cache
+from store.models import Product
+from store.search import get_search_backend
+from store.serializers import ProductImportSerializer
+
+
+FIELDS = ['id', 'name', 'slug', 'description', 'unit_price', 'inventory']
+CSV = 'csv'
+JSONL = 'jsonl'
+FORMATS = [CSV, JSONL]
+CONTENT_TYPES = {CSV: 'text/csv', JSONL: 'application/jsonl'}
+
+UPDATE_FIELDS = ['name', 'slug', 'description', 'unit_price', 'inventory', 'datetime_modified']
+
+
+def get_format(path):
+    """The format of a file from its extension, CSV by default."""
+    return JSONL if path.lower().endswith(('.jsonl', '.ndjson')) else CSV
+
+
+def make_slug(name):
+    # Like `ProductSerializer.create`; the slug field only takes ASCII.
+    return slugify(name)[:Product._meta.get_field('slug').max_length]
+
+
+class UnreadableRow:
+    """A JSON line that doesn't parse, reported as an invalid row."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def read_rows(lines, file_format):
+    """
+    Parse `lines` (an iterable of text lines, e.g. a file; JSON Lines may also
+    be bytes) into row dicts as they are read.
+    """
+    if file_format == CSV:
+        for row in csv.DictReader(lines):
+            # Empty cells of the id column and cells missing from short lines are left out.
+            yield {
+                field: value for field, value in row.items()
+                if field is not None and value is not None and not (field == 'id' and value == '')
+            }
+    else:
+        for line in lines:
+            if line.strip():
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError as error:
+                    yield UnreadableRow(error)
+
+
+class ImportResult:
+
+    def __init__(self, max_errors=100):
+        self.created = 0
+        self.updated = 0
+        self.invalid = 0
+        self.complete = True
+        self.max_errors = max_errors
+        self.errors = []
+
+    def add_error(self, number, errors):
+        self.invalid += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def stop(self, number, error):
+        """Record that the file could not be read from row `number` on."""
+        self.complete = False
+        self.errors.append({'row': number, 'errors': {'non_field_errors': [f'Cannot read the file: {error}']}})
+
+    def as_dict(self):
+        return {
+            'created': self.created, 'updated': self.updated, 'invalid': self.invalid,
+            'complete': self.complete, 'errors': self.errors,
+        }
+
+
+def _update(products):
+    """
+    Save `UPDATE_FIELDS` of `products` with one `UPDATE` statement executed for
+    each of them, which is much cheaper than the `CASE WHEN` expressions of
+    `bulk_update` for hundreds of rows.
+    """
+    if not products:
+        return
+    connection = connections[router.db_for_write(Product)]
+    qn = connection.ops.quote_name
+    fields = [Product._meta.get_field(name) for name in UPDATE_FIELDS]
+    columns = ', '.join(f'{qn(field.column)} = %s' for field in fields)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {qn(Product._meta.db_table)} SET {columns} WHERE {qn(Product._meta.pk.column)} = %s',
+            [[field.get_db_prep_save(getattr(product, field.attname), connection) for field in fields] + [product.pk]
+             for product in products],
+        )
+
+
+def _import_chunk(chunk, result):
+    new, partial = ProductImportSerializer(), ProductImportSerializer(partial=True)
+    ids = [row['id'] for _, row in chunk if isinstance(row, dict) and row.get('id') not in (None, '')]
+    existing = Product.objects.in_bulk([pk for pk in ids if str(pk).isdigit()])
+    creates, updates = [], {}
+    now = timezone.now()
+
+    for number, row in chunk:
+        if isinstance(row, UnreadableRow):
+            result.add_error(number, {'non_field_errors': [f'Invalid JSON: {row.error}']})
+            continue
+        if not isinstance(row, dict):
+            result.add_error(number, {'non_field_errors': ['Expected an object']})
+            continue
+        updating = row.get('id') not in (None, '')
+        try:
+            data = (partial if updating else new).run_validation(row)
+        except ValidationError as error:
+            result.add_error(number, error.detail)
+            continue
+
+        if not updating:
+            product = Product(**data)
+            product.slug = product.slug or make_slug(product.name)
+            creates.append(product)
+            continue
+        product = existing.get(data['id'])
+        if product is None:
+            result.add_error(number, {'id': ['There is no product with this id']})
+            continue
+        for field, value in data.items():
+            setattr(product, field, value)
+        product.slug = product.slug or make_slug(product.name)
+        product.datetime_modified = now
+        updates[product.pk] = product
+
+    with transaction.atomic():
+        Product.objects.bulk_create(creates)
+        _update(list(updates.values()))
+        get_search_backend().index(creates + list(updates.values()))
+    if creates or updates:
+        catalog_cache.invalidate('product')
+    result.created += len(creates)
+    result.updated += len(updates)
+
+
+def import_products(rows, chunk_size=500, max_errors=100):
+    """
+    Create or update products from `rows` (see `read_rows`), `chunk_size` rows
+    at a time. Stops, keeping the rows before, if reading `rows` fails.
+    """
+    result = ImportResult(max_errors)
+    chunk = []
+    rows = iter(rows)
+    number = 0
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            break
+        except (ValueError, csv.Error) as error:
+            result.stop(number + 1, error)
+            break
+        number += 1
+        chunk.append((number, row))
+        if len(chunk) >= chunk_size:
+            _import_chunk(chunk, result)
+            chunk = []
+    if chunk:
+        _import_chunk(chunk, result)
+    return result
+
+
+class _Line:
+    """A file-like object whose write returns what was written, so csv.writer makes lines."""
+
+    def write(self, value):
+        return value
+
+
+def export_lines(file_format, queryset=None, chunk_size=2000):
+    """The products as lines of CSV (with a header) or JSON Lines (bytes), read with a server-side iterator."""
+    queryset = (queryset if queryset is not None else Product.objects.all()).order_by('id').values_list(*FIELDS)
+    rows = queryset.iterator(chunk_size=chunk_size)
+    if file_format == CSV:
+        writer = csv.writer(_Line())
+        yield writer.writerow(FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield orjson.dumps(dict(zip(FIELDS, row)), default=str) + b'\n'
+
+
+def decode_lines(lines, file_format):
+    """
+    The lines of a binary file or request body, decoded for `read_rows` as
+    they are read (JSON Lines are parsed from bytes).
+    """
+    if file_format == CSV:
+        return codecs.iterdecode(lines, 'utf-8-sig')
+    return lines
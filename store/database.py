@@ -0,0 +1,41 @@
+"""
+Per-connection database tuning.
+
+`configure_connection` runs for every new connection (see the
+`connection_created` handler) and applies `SQLITE_PRAGMAS` on SQLite.
+`replicate_sqlite` is a local stand-in for replication, for trying the
+replica router (store/routers.py) with two SQLite files.
+"""
+import sqlite3
+
+from django.conf import settings
+from django.db import connections
+
+
+def get_sqlite_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', {})
+
+
+def configure_connection(connection):
+    if connection.vendor != 'sqlite':
+        return
+    # On the raw connection, so the setup is not counted against whichever
+    # request happens to open the connection (see store/queries.py).
+    for name, value in get_sqlite_pragmas().items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def replicate_sqlite(source_alias, replica_alias):
+    """
+    Copy the SQLite database of `source_alias` over the file of
+    `replica_alias` with SQLite's online backup, so the replica is as stale as
+    its last copy.
+    """
+    source, replica = connections[source_alias], connections[replica_alias]
+    replica.close()
+    source.ensure_connection()
+    target = sqlite3.connect(replica.settings_dict['NAME'])
+    try:
+        source.connection.backup(target)
+    finally:
+        target.close()
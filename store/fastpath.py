@@ -0,0 +1,132 @@
+"""
+Read-only fast paths for product listing and cart retrieval.
+
+They fetch only the columns the serializers output, as tuple rows, and build
+exactly what `ProductSerializer` and `CartSerializer` would return without
+creating model instances or dispatching field by field. A change to either
+serializer must be mirrored here; the tests compare both byte for byte.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+
+from store.models import CartItem, Product, ProductImages
+from store.serializers import image_variant_urls
+
+
+PRODUCT_COLUMNS = ('id', 'name', 'unit_price', 'inventory', 'description', 'cover', 'cover_variants', 'datetime_created')
+PRODUCT_IMAGE_COLUMNS = ('product_id', 'id', 'images', 'variants')
+CART_ITEM_COLUMNS = ('id', 'quantity', 'product_id', 'product__name', 'product__unit_price')
+
+# Same field arguments as the serializers, so prices are quantized identically.
+PRODUCT_PRICE = serializers.DecimalField(max_digits=255, decimal_places=2)
+CART_PRODUCT_PRICE = serializers.DecimalField(max_digits=6, decimal_places=2)
+
+
+def enabled():
+    return getattr(settings, 'READ_FAST_PATH', True)
+
+
+def product_rows(queryset):
+    """
+    Narrow a product queryset to named tuple rows. Keeps annotations used for
+    ordering (`search_rank`) so keyset pagination can read them from the rows.
+    """
+    columns = PRODUCT_COLUMNS
+    if 'search_rank' in queryset.query.annotations:
+        columns += ('search_rank',)
+    return queryset.prefetch_related(None).values_list(*columns, named=True)
+
+
+class FileUrls:
+    """
+    Absolute file URLs exactly as `FileField` builds them (`storage.url` then
+    `request.build_absolute_uri`), memoized across requests by scheme, host
+    and path since the same images appear on every page view.
+    """
+    cache = {}
+    max_size = 10000
+
+    def __init__(self, storage, request=None):
+        self.storage = storage
+        self.request = request
+        self.base = request.build_absolute_uri('') if request is not None else None
+
+    def __call__(self, name):
+        if not name:
+            return None
+        key = (self.storage, self.base, name)
+        url = self.cache.get(key)
+        if url is None:
+            url = self.storage.url(name)
+            if self.request is not None:
+                url = self.request.build_absolute_uri(url)
+            if len(self.cache) >= self.max_size:
+                self.cache.clear()
+            self.cache[key] = url
+        return url
+
+
+def serialize_products(rows, request=None):
+    """`ProductSerializer(many=True)` output for `product_rows` rows, images loaded in one query."""
+    images = defaultdict(list)
+    if rows:
+        image_rows = ProductImages.objects.filter(product_id__in=[row.id for row in rows]) \
+                                          .values_list(*PRODUCT_IMAGE_COLUMNS)
+        for product_id, *image in image_rows:
+            images[product_id].append(image)
+
+    cover_url = FileUrls(Product._meta.get_field('cover').storage, request)
+    image_url = FileUrls(ProductImages._meta.get_field('images').storage, request)
+    variant_url = FileUrls(default_storage, request)
+    return [
+        {
+            'id': row.id,
+            'title': str(row.name),
+            'price': PRODUCT_PRICE.to_representation(row.unit_price),
+            'inventory': int(row.inventory),
+            'description': str(row.description),
+            'cover': cover_url(row.cover),
+            'cover_variants': image_variant_urls(row.cover, row.cover_variants, file_url=variant_url),
+            'images': [
+                {
+                    'id': image_id,
+                    'images': image_url(name),
+                    'variants': image_variant_urls(name, variants, file_url=variant_url),
+                }
+                for image_id, name, variants in images[row.id]
+            ],
+        }
+        for row in rows
+    ]
+
+
+def serialize_cart(cart_id, items=None):
+    """
+    `CartSerializer` output for the cart `cart_id`: read from the database in a
+    single joined query, or built from cart store `items` with products attached.
+    """
+    if items is None:
+        rows = CartItem.objects.filter(cart_id=cart_id).values_list(*CART_ITEM_COLUMNS)
+    else:
+        rows = [(item.id, item.quantity, item.product_id, item.product.name, item.product.unit_price) for item in items]
+
+    items = []
+    for item_id, quantity, product_id, name, unit_price in rows:
+        items.append({
+            'id': item_id,
+            'product': {
+                'id': product_id,
+                'name': str(name),
+                'unit_price': CART_PRODUCT_PRICE.to_representation(unit_price),
+            },
+            'quantity': int(quantity),
+            'item_total': quantity * unit_price,
+        })
+    return {
+        'id': str(cart_id),
+        'items': items,
+        'total_price': sum([item['item_total'] for item in items]),
+    }
@@ -1,10 +1,52 @@
 from django_filters.rest_framework import FilterSet
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+from rest_framework.settings import api_settings
 
-from .models import Product
+from .models import Order, Product
+from .search import get_search_backend
 
 class ProductFilter(FilterSet):
     class Meta:
         model = Product
         fields = {
             'inventory': ['lt', 'gt'],
-        }
\ No newline at end of file
+        }
+
+
+class OrderFilter(FilterSet):
+    class Meta:
+        model = Order
+        fields = {
+            'status': ['exact'],
+            'total_price': ['lt', 'gt'],
+            'items_count': ['lt', 'gt'],
+        }
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    Full-text search through the configured search backend. Matches are
+    annotated with `search_rank` (lower is better).
+    """
+    search_param = api_settings.SEARCH_PARAM
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        return get_search_backend().search(queryset, term)
+
+
+class RankedOrderingFilter(OrderingFilter):
+    """
+    Order search results by relevance unless the client asked for an explicit ordering.
+    """
+    search_param = api_settings.SEARCH_PARAM
+
+    def get_ordering(self, request, queryset, view):
+        if (
+            not request.query_params.get(self.ordering_param)
+            and request.query_params.get(self.search_param, '').strip()
+        ):
+            return ['search_rank']
+        return super().get_ordering(request, queryset, view)
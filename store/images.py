@@ -0,0 +1,175 @@
+"""
+Resized WebP/JPEG variants of uploaded images.
+
+`render_variants` runs in worker processes started with 'spawn', so this
+module only imports models inside functions that run in the web process.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = {
+    'thumbnail': (200, 200),
+    'medium': (600, 600),
+    'large': (1200, 1200),
+}
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+
+def variant_name(name, variant, extension):
+    # Keyed on the whole file name: photo.jpg and photo.png get their own variants.
+    directory, filename = os.path.split(name)
+    return os.path.join(directory, 'variants', filename, f'{variant}.{extension}')
+
+
+def _flatten(image):
+    # JPEG has no alpha channel: put transparent images on a white background.
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(media_root, name):
+    """
+    Write every variant of `media_root/name` and return the variants map that
+    is stored on the model: `{'source': name, variant: {'webp': ..., 'jpeg': ...}}`.
+    """
+    variants = {'source': name}
+    with Image.open(os.path.join(media_root, name)) as original:
+        image = ImageOps.exif_transpose(original)
+        for variant, size in VARIANT_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.Resampling.LANCZOS)
+            variants[variant] = {}
+            for extension, save in (('webp', _save_webp), ('jpeg', _save_jpeg)):
+                relative_name = variant_name(name, variant, extension)
+                path = os.path.join(media_root, relative_name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                save(resized, path)
+                variants[variant][extension] = relative_name
+    return variants
+
+
+def delete_variants(media_root, variants, keep=()):
+    """Delete the files of a variants map from `render_variants`, except those in `keep`."""
+    directories = set()
+    for variant, files in variants.items():
+        if variant == 'source':
+            continue
+        for relative_name in files.values():
+            if relative_name in keep:
+                continue
+            path = os.path.join(media_root, relative_name)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            directories.add(os.path.dirname(path))
+    for directory in directories:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+
+def _save_webp(image, path):
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode == 'LA' else 'RGB')
+    image.save(path, 'WEBP', quality=WEBP_QUALITY, method=4)
+
+
+def _save_jpeg(image, path):
+    _flatten(image).save(path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None or _executor._broken:
+        _executor = ProcessPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_VARIANT_WORKERS', 2),
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def submit(name, on_done):
+    """Render the variants of `name` in the process pool and call `on_done(variants)` when ready."""
+    future = get_executor().submit(render_variants, str(settings.MEDIA_ROOT), name)
+    caller = threading.current_thread()
+
+    def done(future):
+        try:
+            variants = future.result()
+        except Exception:
+            logger.exception('Could not render image variants for %s', name)
+            return
+        try:
+            on_done(variants)
+        finally:
+            # Done callbacks run on the pool's management thread, which lives as
+            # long as the pool: don't leave a connection open in it.
+            if threading.current_thread() is not caller:
+                connections.close_all()
+
+    future.add_done_callback(done)
+    return future
+
+
+def get_image_fields():
+    """Map each model with an image to `(image field, variants field, catalog cache namespace)`."""
+    from store.models import BannerImage, Product, ProductImages
+    return {
+        Product: ('cover', 'cover_variants', 'product'),
+        ProductImages: ('images', 'variants', 'product'),
+        BannerImage: ('banner', 'banner_variants', 'banner'),
+    }
+
+
+def needs_variants(instance):
+    image_field, variants_field, _ = get_image_fields()[type(instance)]
+    name = getattr(instance, image_field).name
+    return bool(name) and getattr(instance, variants_field).get('source') != name
+
+
+def save_variants(model, pk, variants):
+    from store.cache import catalog_cache
+
+    image_field, variants_field, namespace = get_image_fields()[model]
+    with transaction.atomic():
+        previous = model.objects.filter(pk=pk).values_list(variants_field, flat=True).first()
+        # Skip the update if the image was replaced while the variants were rendering.
+        updated = model.objects.filter(pk=pk, **{image_field: variants['source']}) \
+                               .update(**{variants_field: variants})
+    if not updated:
+        return
+    catalog_cache.invalidate(namespace)
+    if previous and previous.get('source') != variants['source']:
+        # The variants of the image this one replaced.
+        keep = {name for variant, files in variants.items() if variant != 'source' for name in files.values()}
+        delete_variants(str(settings.MEDIA_ROOT), previous, keep)
+
+
+def generate_variants(instance):
+    """Queue variant rendering for `instance` once the current transaction commits."""
+    image_field = get_image_fields()[type(instance)][0]
+    name = getattr(instance, image_field).name
+    on_done = partial(save_variants, type(instance), instance.pk)
+    transaction.on_commit(lambda: submit(name, on_done))
@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from store import sales
+from store.cache import catalog_cache
+from store.models import Order, Product
+
+
+class InsufficientInventory(Exception):
+    pass
+
+
+class StaleOrderStatus(Exception):
+    pass
+
+
+def _quantity_per_product(quantities):
+    return Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _invalidate_catalog():
+    # Queryset updates don't send post_save, so the cached product pages
+    # (which show the inventory) are invalidated here, once the change commits.
+    transaction.on_commit(lambda: catalog_cache.invalidate('product'))
+
+
+def reserve(quantities):
+    """
+    Take `quantities` ({product_id: quantity}) out of stock with a single
+    conditional UPDATE. Raises `InsufficientInventory` if any product is short;
+    call it inside `transaction.atomic()` so the partial update is rolled back.
+    """
+    if not quantities:
+        return
+    quantity = _quantity_per_product(quantities)
+    updated = Product.objects.filter(id__in=quantities, inventory__gte=quantity) \
+                             .update(inventory=F('inventory') - quantity)
+    if updated != len(quantities):
+        raise InsufficientInventory()
+    _invalidate_catalog()
+
+
+def release(quantities):
+    """Put `quantities` ({product_id: quantity}) back in stock with a single UPDATE."""
+    if not quantities:
+        return
+    quantity = _quantity_per_product(quantities)
+    Product.objects.filter(id__in=quantities).update(inventory=F('inventory') + quantity)
+    _invalidate_catalog()
+
+
+def describe_shortages(quantities):
+    """Per-product error messages for the products that cannot cover `quantities`."""
+    short_products = Product.objects.filter(id__in=quantities, inventory__lt=_quantity_per_product(quantities)) \
+                                    .values_list('id', 'name', 'inventory')
+    return {
+        str(product_id): f'Only {inventory} of "{name}" left in stock'
+        for product_id, name, inventory in short_products
+    }
+
+
+def update_order_status(order, status):
+    """
+    Move `order` to `status`, releasing its stock when it gets canceled and
+    reserving it again when a canceled order is reopened, and updating the
+    sales rollups when it gets paid or stops being paid. The status change is
+    a compare-and-set on the previous status, so concurrent cancels release once.
+    """
+    previous_status = order.status
+    if status == previous_status:
+        return order
+
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order.pk, status=previous_status).update(status=status):
+            raise StaleOrderStatus()
+        quantities = dict(order.items.values_list('product_id', 'quantity'))
+        if status == Order.ORDER_STATUS_CANCELED:
+            release(quantities)
+        elif previous_status == Order.ORDER_STATUS_CANCELED:
+            reserve(quantities)
+        if status == Order.ORDER_STATUS_PAID:
+            sales.add_orders([order.pk])
+        elif previous_status == Order.ORDER_STATUS_PAID:
+            sales.remove_orders([order.pk])
+
+    order.status = status
+    return order
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Max
+
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored item count and total price of every order from its items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        last_id = Order.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        updated = 0
+        for start in range(0, last_id + 1, batch_size):
+            batch = Order.objects.filter(id__gte=start, id__lt=start + batch_size).annotate_totals()
+            updated += batch.exclude(
+                items_count=F('computed_items_count'), total_price=F('computed_total_price'),
+            ).update(
+                items_count=F('computed_items_count'), total_price=F('computed_total_price'),
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated {updated} orders in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,161 @@
+import json
+import platform
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import CustomUser
+from store.benchmarking import create_test_databases, destroy_test_databases, make_cart, seed_catalog, summarize
+from store.cache import catalog_cache
+from store.queries import QueryTracker
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database and benchmark the store endpoints through the real URL routes. '
+        'Reports p50/p95/p99 latency, queries per request and throughput, and can flag regressions '
+        'against a previous JSON report.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='Invalidate the catalog cache before every request.')
+        parser.add_argument('--output', default=None,
+                            help='Where to write the JSON report (default: bench_results/api-<timestamp>.json).')
+        parser.add_argument('--compare', default=None, help='A previous JSON report to compare against.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p95 slowdown that counts as a regression (default: 0.2).')
+
+    def handle(self, *args, **options):
+        old_config = create_test_databases()
+        try:
+            middleware = [name for name in settings.MIDDLEWARE if not name.startswith('debug_toolbar.')]
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['*'], MIDDLEWARE=middleware):
+                results = self.run_benchmarks(options)
+        finally:
+            destroy_test_databases(old_config)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'products': options['products'],
+            'iterations': options['iterations'],
+            'cold_cache': options['cold_cache'],
+            'endpoints': results,
+        }
+        output = Path(options['output'] or Path('bench_results') / f'api-{time.strftime("%Y%m%d-%H%M%S")}.json')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+
+        self.print_table(results)
+        self.stdout.write(f'Report written to {output}')
+
+        if options['compare']:
+            self.compare(results, json.loads(Path(options['compare']).read_text())['endpoints'], options['threshold'])
+
+    def run_benchmarks(self, options):
+        self.stdout.write(f'Seeding {options["products"]} products...')
+        products = seed_catalog(products=options['products'])
+        catalog_cache.invalidate('product')
+        catalog_cache.invalidate('banner')
+
+        CustomUser.objects.create_user('bench', password='bench-password')
+        client = APIClient(HTTP_ACCEPT='application/json')
+        token = client.post('/auth/jwt/create/', {'username': 'bench', 'password': 'bench-password'},
+                            format='json').json()['data']['access']
+        client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+
+        product = products[len(products) // 2]
+        cart_id = make_cart(products)
+        deep_page = self.find_deep_page(client, pages=20)
+
+        endpoints = [
+            ('products-list', lambda: client.get('/store/products/')),
+            ('products-list-deep-page', lambda: client.get(deep_page)),
+            ('products-search', lambda: client.get('/store/products/', {'search': 'گوشی کیف'})),
+            ('products-retrieve', lambda: client.get(f'/store/products/{product.id}/')),
+            ('banners-list', lambda: client.get('/store/banners/')),
+            ('carts-create', lambda: client.post('/store/carts/')),
+            ('carts-retrieve', lambda: client.get(f'/store/carts/{cart_id}/')),
+            ('cart-items-add', lambda: client.post(f'/store/carts/{cart_id}/items/',
+                                                   {'product': product.id, 'quantity': 1}, format='json')),
+            ('orders-list', lambda: client.get('/store/orders/')),
+            ('orders-create', lambda cart_id: client.post('/store/orders/', {'cart_id': str(cart_id)}, format='json'),
+             lambda: make_cart(products)),
+        ]
+
+        results = {}
+        for name, request, *prepare in endpoints:
+            self.stdout.write(f'  {name}')
+            results[name] = self.measure(request, prepare[0] if prepare else None, options)
+        return results
+
+    def find_deep_page(self, client, pages):
+        url = '/store/products/?count=0'
+        for _ in range(pages):
+            next_url = client.get(url).json()['data']['next']
+            if next_url is None:
+                break
+            url = next_url
+        return url
+
+    def measure(self, request, prepare, options):
+        timings, queries = [], []
+        statuses = set()
+        elapsed = 0.0
+        for iteration in range(options['warmup'] + options['iterations']):
+            args = (prepare(),) if prepare else ()
+            if options['cold_cache']:
+                catalog_cache.invalidate('product')
+                catalog_cache.invalidate('banner')
+
+            # Every alias: reads go to the replicas when there are some.
+            with QueryTracker() as tracker:
+                started = time.perf_counter()
+                response = request(*args)
+                duration = time.perf_counter() - started
+
+            if iteration >= options['warmup']:
+                timings.append(duration)
+                queries.append(tracker.count)
+                statuses.add(response.status_code)
+                elapsed += duration
+
+        summary = summarize(timings, queries, elapsed)
+        summary['status_codes'] = sorted(statuses)
+        return summary
+
+    def print_table(self, results):
+        self.stdout.write(
+            f'{"endpoint":<26} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"req/s":>9} status'
+        )
+        for name, summary in results.items():
+            self.stdout.write(
+                f'{name:<26} {summary["p50_ms"]:>9.2f} {summary["p95_ms"]:>9.2f} {summary["p99_ms"]:>9.2f} '
+                f'{summary["queries_per_request"]:>8.1f} {summary["throughput_rps"]:>9.1f} {summary["status_codes"]}'
+            )
+
+    def compare(self, results, baseline, threshold):
+        regressions = []
+        for name, summary in results.items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            if summary['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+                regressions.append(f'{name}: p95 {previous["p95_ms"]:.2f}ms -> {summary["p95_ms"]:.2f}ms')
+            if summary['queries_per_request'] > previous['queries_per_request']:
+                regressions.append(
+                    f'{name}: queries {previous["queries_per_request"]} -> {summary["queries_per_request"]}'
+                )
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
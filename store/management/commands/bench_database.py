@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, connections
+from django.db.utils import OperationalError
+from django.test.utils import override_settings
+
+from store.benchmarking import create_test_databases, destroy_test_databases, seed_catalog, summarize
+from store.models import Cart, CartItem, Product
+
+
+SQLITE_DEFAULT_PRAGMAS = {'journal_mode': 'delete', 'synchronous': 'full'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database and measure concurrent read/write throughput for each '
+        'database profile: per-request connections with default settings against the tuned profile '
+        '(SQLITE_PRAGMAS and persistent connections on SQLite, persistent health-checked connections '
+        'on PostgreSQL).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per profile.')
+
+    def get_profiles(self):
+        from django.conf import settings
+
+        if connection.vendor == 'sqlite':
+            return [
+                ('sqlite default, per-request connections', {'SQLITE_PRAGMAS': SQLITE_DEFAULT_PRAGMAS}, 0),
+                ('sqlite tuned, persistent connections', {'SQLITE_PRAGMAS': settings.SQLITE_PRAGMAS}, 600),
+            ]
+        return [
+            (f'{connection.vendor}, per-request connections', {}, 0),
+            (f'{connection.vendor}, persistent connections', {}, 600),
+        ]
+
+    def handle(self, *args, **options):
+        old_config = create_test_databases()
+        try:
+            self.stdout.write(f'Seeding {options["products"]} products...')
+            products = seed_catalog(products=options['products'])
+            self.product_ids = [product.id for product in products]
+            self.cart_ids = [Cart.objects.create().id for _ in range(50)]
+            connection.close()
+
+            self.stdout.write(
+                f'{"profile":<44} {"reads/s":>9} {"writes/s":>9} {"read p95":>10} {"write p95":>10} {"errors":>7}'
+            )
+            for name, overrides, conn_max_age in self.get_profiles():
+                with override_settings(**overrides):
+                    self.run_profile(name, conn_max_age, options)
+        finally:
+            destroy_test_databases(old_config)
+
+    def run_profile(self, name, conn_max_age, options):
+        connections.settings[connection.alias]['CONN_MAX_AGE'] = conn_max_age
+        # Open (and configure) one connection so journal mode changes apply to the file.
+        connection.ensure_connection()
+        connection.close()
+
+        deadline = time.monotonic() + options['duration']
+        results = {'read': [], 'write': []}
+        errors = []
+
+        def worker(kind, operation):
+            timings = []
+            try:
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        operation()
+                    except OperationalError:
+                        errors.append(kind)
+                    timings.append(time.perf_counter() - started)
+                    # What the request_finished signal does after every request.
+                    close_old_connections()
+            finally:
+                connection.close()
+                results[kind].extend(timings)
+
+        threads = [threading.Thread(target=worker, args=('read', self.read)) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=('write', self.write)) for _ in range(options['writers'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        reads = summarize(results['read'], elapsed=elapsed)
+        writes = summarize(results['write'], elapsed=elapsed)
+        self.stdout.write(
+            f'{name:<44} {reads["throughput_rps"]:>9.1f} {writes["throughput_rps"]:>9.1f} '
+            f'{reads["p95_ms"]:>8.2f}ms {writes["p95_ms"]:>8.2f}ms {len(errors):>7}'
+        )
+
+    def read(self):
+        list(Product.objects.order_by('-datetime_created', '-id').values('id', 'name', 'unit_price')[:10])
+
+    def write(self):
+        CartItem.objects.add_quantity(random.choice(self.cart_ids), random.choice(self.product_ids), 1)
@@ -0,0 +1,75 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from store import fastpath
+from store.benchmarking import create_test_databases, destroy_test_databases, make_cart, seed_catalog
+from store.models import Cart, Product
+from store.renders import FastCustomRenderer
+from store.serializers import CartSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database and compare the serializer path with the read-only fast path '
+        'for product pages and cart detail, checking that both render the same bytes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--page-sizes', type=int, nargs='+', default=[10, 100])
+        parser.add_argument('--cart-lines', type=int, nargs='+', default=[3, 50])
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        old_config = create_test_databases()
+        try:
+            # The serializer path reads Cart rows, so carts must live in the database here.
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['*'], CART_STORE='store.carts.DatabaseCartStore'):
+                self.run_benchmarks(options)
+        finally:
+            destroy_test_databases(old_config)
+
+    def run_benchmarks(self, options):
+        self.stdout.write(f'Seeding {options["products"]} products...')
+        products = seed_catalog(products=options['products'])
+        request = APIRequestFactory().get('/store/products/')
+        queryset = Product.objects.prefetch_related('images').order_by('-datetime_created', '-id')
+
+        self.stdout.write(f'{"case":<22} {"serializers":>13} {"fast path":>11} {"speedup":>9}')
+        for size in options['page_sizes']:
+            self.compare(
+                f'product page of {size}', options['repeat'],
+                lambda: ProductSerializer(queryset[:size], many=True, context={'request': request}).data,
+                lambda: fastpath.serialize_products(list(fastpath.product_rows(queryset)[:size]), request),
+            )
+        for lines in options['cart_lines']:
+            cart_id = make_cart(products, lines=lines)
+            self.compare(
+                f'cart of {lines} lines', options['repeat'],
+                lambda: CartSerializer(Cart.objects.prefetch_related('items__product').get(pk=cart_id)).data,
+                lambda: fastpath.serialize_cart(cart_id),
+            )
+
+    def compare(self, name, repeat, slow, fast):
+        baseline, expected = self.time(slow, repeat)
+        optimized, content = self.time(fast, repeat)
+        if content != expected:
+            raise CommandError(f'The fast path output differs from the serializers for {name}')
+        self.stdout.write(
+            f'{name:<22} {baseline * 1000:>11.2f}ms {optimized * 1000:>9.2f}ms {baseline / optimized:>8.1f}x'
+        )
+
+    def time(self, serialize, repeat):
+        renderer = FastCustomRenderer()
+        context = {'response': Response(status=200)}
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            data = serialize()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings), renderer.render(data, 'application/json', context)
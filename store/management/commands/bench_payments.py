@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import aiohttp
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.models import CustomUser
+from store.benchmarking import create_test_databases, destroy_test_databases, seed_catalog, summarize
+from store.models import Order
+
+
+class PooledWSGIServer(WSGIServer):
+    """wsgiref server handing requests to a fixed pool of threads, like one gthread worker."""
+    request_queue_size = 1024
+
+    def __init__(self, *args, threads, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database, start the ZarinPal simulator with --gateway-latency, and run '
+        'pay+verify flows (--concurrency in flight) plus catalog requests against the sync views on a '
+        'WSGI server with --threads threads, then against the async views under uvicorn (ASGI). '
+        'Reports payment throughput and the catalog latency while the gateway is slow.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gateway-latency', default='fixed:300',
+                            help='Latency of each gateway call, as for zarinpal_simulator.')
+        parser.add_argument('--concurrency', type=int, default=100, help='Payment flows in flight.')
+        parser.add_argument('--catalog-clients', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per server.')
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--serve-wsgi', type=int, default=None, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve_wsgi']:
+            return self.serve_wsgi(options['serve_wsgi'], options['threads'])
+
+        old_config = create_test_databases()
+        processes = []
+        try:
+            self.stdout.write(f'Seeding {options["orders"]} orders...')
+            token, order_ids = self.seed(options['orders'])
+            connection.close()
+
+            env = {
+                **os.environ,
+                'DATABASE_NAME': str(connection.settings_dict['NAME']),
+                # The replicas are real databases: the servers only use the test one.
+                'DATABASE_REPLICAS': '',
+                'DATABASE_CONN_MAX_AGE': '600',
+                'DEBUG_TOOLBAR': '0',
+            }
+            gateway_port = free_port()
+            processes.append(self.start([
+                'zarinpal_simulator', '--port', str(gateway_port), '--request-latency', options['gateway_latency'],
+                '--verify-latency', options['gateway_latency'], '--verify-outcomes', '100:1',
+            ], env))
+            env['ZARINPAL_BASE_URL'] = f'http://127.0.0.1:{gateway_port}'
+
+            servers = [
+                (f'WSGI, sync views, {options["threads"]} threads', '0',
+                 self.manage_py('bench_payments', '--skip-checks', '--serve-wsgi', '{port}', '--threads', str(options['threads']))),
+                ('ASGI (uvicorn), async views', '1',
+                 [sys.executable, '-m', 'uvicorn', 'config.asgi:application', '--port', '{port}',
+                  '--log-level', 'warning', '--no-access-log', '--lifespan', 'on']),
+            ]
+            self.stdout.write(
+                f'{"server":<34} {"flows/s":>8} {"flow p50":>10} {"flow p95":>10} '
+                f'{"catalog/s":>10} {"catalog p95":>12} {"errors":>7}'
+            )
+            orders = iter(order_ids)
+            for name, async_views, command in servers:
+                port = free_port()
+                server = subprocess.Popen(
+                    [part.format(port=port) for part in command], cwd=settings.BASE_DIR,
+                    env={**env, 'ASYNC_PAYMENT_VIEWS': async_views},
+                )
+                processes.append(server)
+                base_url = f'http://127.0.0.1:{port}'
+                self.wait_until_ready(base_url)
+                self.report(name, asyncio.run(self.load(base_url, token, orders, options)))
+                server.terminate()
+                server.wait()
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+            destroy_test_databases(old_config)
+
+    def manage_py(self, *args):
+        return [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), *args]
+
+    def start(self, args, env):
+        return subprocess.Popen(self.manage_py(*args), cwd=settings.BASE_DIR, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def serve_wsgi(self, port, threads):
+        server = PooledWSGIServer(('127.0.0.1', port), QuietWSGIRequestHandler, threads=threads)
+        server.set_app(get_wsgi_application())
+        server.serve_forever()
+
+    def seed(self, orders):
+        seed_catalog(products=200, images_per_product=0, banners=0)
+        user = CustomUser.objects.create_user('bench-customer', password='bench-password')
+        Order.objects.bulk_create(
+            Order(customer=user.customer, total_price=100, items_count=1) for _ in range(orders)
+        )
+        return str(RefreshToken.for_user(user).access_token), list(Order.objects.values_list('id', flat=True))
+
+    def wait_until_ready(self, base_url, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f'{base_url}/store/products/', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise CommandError(f'{base_url} did not come up in {timeout}s')
+
+    async def load(self, base_url, token, orders, options):
+        deadline = time.monotonic() + options['duration']
+        timings = {'flow': [], 'catalog': []}
+        errors = Counter()
+        async with aiohttp.ClientSession(
+            base_url, headers={'Authorization': f'JWT {token}'}, timeout=aiohttp.ClientTimeout(total=120),
+            connector=aiohttp.TCPConnector(limit=0),
+        ) as session:
+            async def pay():
+                for order_id in orders:
+                    if time.monotonic() > deadline:
+                        break
+                    started = time.perf_counter()
+                    try:
+                        async with session.get(f'/store/orders/{order_id}/pay/', allow_redirects=False) as response:
+                            authority = response.headers['Location'].rsplit('/', 1)[-1]
+                        async with session.get('/store/orders/verify', params={'Authority': authority, 'Status': 'OK'},
+                                               raise_for_status=True) as response:
+                            await response.read()
+                    except (aiohttp.ClientError, asyncio.TimeoutError, KeyError):
+                        errors['flow'] += 1
+                    else:
+                        timings['flow'].append(time.perf_counter() - started)
+
+            async def browse():
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        async with session.get('/store/products/', raise_for_status=True) as response:
+                            await response.read()
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        errors['catalog'] += 1
+                    else:
+                        timings['catalog'].append(time.perf_counter() - started)
+
+            started = time.monotonic()
+            await asyncio.gather(*[pay() for _ in range(options['concurrency'])],
+                                 *[browse() for _ in range(options['catalog_clients'])])
+            elapsed = time.monotonic() - started
+
+        return (summarize(timings['flow'], elapsed=elapsed), summarize(timings['catalog'], elapsed=elapsed),
+                sum(errors.values()))
+
+    def report(self, name, results):
+        flows, catalog, errors = results
+        self.stdout.write(
+            f'{name:<34} {flows["throughput_rps"]:>8.1f} {flows["p50_ms"]:>8.0f}ms {flows["p95_ms"]:>8.0f}ms '
+            f'{catalog["throughput_rps"]:>10.1f} {catalog["p95_ms"]:>10.0f}ms {errors:>7}'
+        )
@@ -0,0 +1,63 @@
+import statistics
+import time
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.utils.serializer_helpers import ReturnList
+
+from store.renders import CustomRenderer, FastCustomRenderer
+
+
+def make_products(count):
+    """Product list shaped like paginated `ProductSerializer` output."""
+    now = timezone.now()
+    results = ReturnList([
+        OrderedDict([
+            ('id', index),
+            ('title', f'محصول شماره {index}'),
+            ('price', Decimal(index % 10000) / 100),
+            ('inventory', index % 50),
+            ('description', '<p>توضیحات محصول با متن نسبتا طولانی برای نزدیک شدن به داده واقعی</p>'),
+            ('cover', f'http://testserver/media/cover/{uuid.uuid4()}.jpeg'),
+            ('images', [
+                OrderedDict([('id', index * 3 + image), ('images', f'http://testserver/media/product-images/{index}-{image}.png')])
+                for image in range(3)
+            ]),
+            ('datetime_created', now),
+        ])
+        for index in range(count)
+    ], serializer=None)
+    return {'count': count, 'next': None, 'previous': None, 'results': results}
+
+
+class Command(BaseCommand):
+    help = 'Compare CustomRenderer and FastCustomRenderer on large product lists.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def time_render(self, renderer, data, repeat):
+        context = {'response': Response(status=200)}
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            content = renderer.render(data, 'application/json', context)
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings), content
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"products":>10} {"CustomRenderer":>16} {"FastCustomRenderer":>20} {"speedup":>9}')
+        for size in options['sizes']:
+            data = make_products(size)
+            baseline, expected = self.time_render(CustomRenderer(), data, options['repeat'])
+            optimized, content = self.time_render(FastCustomRenderer(), data, options['repeat'])
+            if content != expected:
+                raise CommandError(f'FastCustomRenderer output differs from CustomRenderer for {size} products')
+            self.stdout.write(
+                f'{size:>10} {baseline * 1000:>14.2f}ms {optimized * 1000:>18.2f}ms {baseline / optimized:>8.1f}x'
+            )
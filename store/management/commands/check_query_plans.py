@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.queryplans import explain, find_full_scans, get_hot_queries
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN every hot API query on the configured database and fail if any of them '
+        'reads a table with a full scan. Use -v 2 to print the plans.'
+    )
+
+    def handle(self, *args, **options):
+        failures = []
+        for name, queryset in get_hot_queries().items():
+            scans = find_full_scans(queryset)
+            if scans:
+                failures.append(f'{name}: full scan of {", ".join(scans)}')
+                self.stdout.write(self.style.ERROR(f'FULL SCAN  {name}'))
+            else:
+                self.stdout.write(f'ok         {name}')
+            if options['verbosity'] > 1 or scans:
+                self.stdout.write('    ' + explain(queryset).replace('\n', '\n    '))
+
+        if failures:
+            raise CommandError('Hot queries without a usable index:\n  ' + '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Every hot query uses an index.'))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Dispatch pending outbox events (such as order_created) to their receivers in batches, '
+        'retrying failed ones with a backoff. Run it with --forever as a worker, or from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--forever', action='store_true', help='Keep polling for new events.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when there is nothing to dispatch (with --forever).')
+        parser.add_argument('--max-batches', type=int, default=None)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        done = failed = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            batch_done, batch_failed = outbox.process_batch(options['batch_size'])
+            done += batch_done
+            failed += batch_failed
+            batches += 1
+            if batch_done + batch_failed == 0:
+                if not options['forever']:
+                    break
+                time.sleep(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Dispatched {done} events ({failed} failed attempts) in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import catalog
+
+
+class Command(BaseCommand):
+    help = 'Write every product as CSV or JSON Lines to a file (stdout by default), reading them in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='File to write, - for stdout.')
+        parser.add_argument('--format', choices=catalog.FORMATS, default=None,
+                            help='File format, from the extension by default (CSV for stdout).')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or catalog.get_format(path)
+        lines = catalog.export_lines(file_format, chunk_size=options['chunk_size'])
+        if path == '-':
+            self.write(sys.stdout.buffer, file_format, lines)
+            sys.stdout.flush()
+            return
+
+        started = time.monotonic()
+        with open(path, 'wb') as file:
+            count = self.write(file, file_format, lines)
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {count} products to {path} in {time.monotonic() - started:.2f}s'
+        ))
+
+    def write(self, file, file_format, lines):
+        count = -1 if file_format == catalog.CSV else 0
+        for line in lines:
+            file.write(line.encode() if file_format == catalog.CSV else line)
+            count += 1
+        return max(count, 0)
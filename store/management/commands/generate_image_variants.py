@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from store import images
+
+
+class Command(BaseCommand):
+    help = 'Render the resized variants of existing product covers, product images and banners.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Render again images that already have variants.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        executor = images.get_executor()
+        futures = {}
+        for model, (image_field, variants_field, _) in images.get_image_fields().items():
+            queryset = model.objects.exclude(Q(**{image_field: ''}) | Q(**{f'{image_field}__isnull': True})) \
+                                    .only('pk', image_field, variants_field)
+            for instance in queryset.iterator():
+                if options['force'] or images.needs_variants(instance):
+                    name = getattr(instance, image_field).name
+                    future = executor.submit(images.render_variants, str(settings.MEDIA_ROOT), name)
+                    futures[future] = (model, instance.pk, name)
+
+        failed = 0
+        for future in as_completed(futures):
+            model, pk, name = futures[future]
+            try:
+                images.save_variants(model, pk, future.result())
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered variants for {len(futures) - failed} images ({failed} failed) '
+            f'in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,50 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import catalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Create or update products from a CSV or JSON Lines file (- for stdin) with the columns '
+        'id, name, slug, description, unit_price and inventory. Rows with an id update that product.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, - for stdin.')
+        parser.add_argument('--format', choices=catalog.FORMATS, default=None,
+                            help='File format, from the extension by default (CSV for stdin).')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or catalog.get_format(path)
+        started = time.monotonic()
+        if path == '-':
+            result = self.import_file(sys.stdin.buffer, file_format, options['chunk_size'])
+        else:
+            try:
+                file = open(path, 'rb')
+            except OSError as error:
+                raise CommandError(f'Cannot open {path}: {error}')
+            with file:
+                result = self.import_file(file, file_format, options['chunk_size'])
+
+        for error in result.errors:
+            self.stderr.write(f'Row {error["row"]}: {error["errors"]}')
+        # The last error of an incomplete import is where reading stopped, not an invalid row.
+        listed = len(result.errors) if result.complete else len(result.errors) - 1
+        if result.invalid > listed:
+            self.stderr.write(f'... and {result.invalid - listed} more invalid rows')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result.created} and updated {result.updated} products '
+            f'({result.invalid} invalid rows) in {time.monotonic() - started:.2f}s'
+        ))
+        if not result.complete:
+            raise CommandError(f'Stopped at row {result.errors[-1]["row"]}, the rows after it were not imported.')
+
+    def import_file(self, file, file_format, chunk_size):
+        rows = catalog.read_rows(catalog.decode_lines(file, file_format), file_format)
+        return catalog.import_products(rows, chunk_size=chunk_size)
@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.carts import get_cart_store
+from store.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete database carts created more than --days ago, oldest first, in small batches. '
+        'Each batch is its own short transaction, so it is safe to run from cron during live traffic.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=None,
+                            help='Age after which a cart is abandoned (default: ABANDONED_CART_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches to let other writers in.')
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the abandoned carts.')
+
+    def handle(self, *args, **options):
+        if not get_cart_store().models:
+            self.stdout.write('Carts are kept in the cache and expire on their own; nothing to purge.')
+            return
+
+        days = options['days'] if options['days'] is not None else getattr(settings, 'ABANDONED_CART_DAYS', 30)
+        cutoff = timezone.now() - timedelta(days=days)
+        abandoned = Cart.objects.filter(created_at__lt=cutoff)
+        started = time.monotonic()
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'{abandoned.count()} carts ({CartItem.objects.filter(cart__created_at__lt=cutoff).count()} items) '
+                f'were created before {cutoff:%Y-%m-%d %H:%M}'
+            )
+            return
+
+        carts = items = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            ids = list(abandoned.order_by('created_at').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            # Deleting by primary key keeps each write transaction to one batch.
+            _, deleted = Cart.objects.filter(id__in=ids).delete()
+            carts += deleted.get(Cart._meta.label, 0)
+            items += deleted.get(CartItem._meta.label, 0)
+            batches += 1
+            if len(ids) < options['batch_size']:
+                break
+            time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {carts} carts and {items} items in {batches} batches in {time.monotonic() - started:.2f}s'
+        ))
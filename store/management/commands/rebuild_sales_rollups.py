@@ -0,0 +1,20 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from store import sales
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups from the paid orders, for every day or the days since --since.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, default=None, metavar='YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        days, products = sales.rebuild(since=options['since'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {days} days and {products} day/product rows in {time.monotonic() - started:.2f}s'
+        ))
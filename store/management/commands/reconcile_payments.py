@@ -0,0 +1,64 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store import payments, zarinpal
+from store.benchmarking import summarize
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Verify unpaid orders that have a ZarinPal authority against the gateway and mark the paid ones, '
+        'for customers who paid but never came back to the verify page. Orders are verified concurrently '
+        'and marked idempotently, so it is safe to run from cron, even overlapping runs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent gateway calls.')
+        parser.add_argument('--rate', type=float, default=10, help='Gateway calls per second (0 for no limit).')
+        parser.add_argument('--min-age', type=float, default=15,
+                            help='Minutes to leave new orders to the verify page first.')
+        parser.add_argument('--max-age', type=float, default=48,
+                            help='Hours after which the gateway has expired the authority.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orders to verify.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        orders = Order.unpaid_orders.exclude(zarinpal_authority='').filter(
+            datetime_created__lte=now - timedelta(minutes=options['min_age']),
+            datetime_created__gte=now - timedelta(hours=options['max_age']),
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{orders.count()} unpaid orders to verify')
+            return
+
+        client = zarinpal.ZarinpalClient(pool_size=options['workers'])
+        outcomes, timings = Counter(), []
+        started = time.monotonic()
+        last_id = 0
+        while True:
+            batch = [
+                (order_id, authority, int(total_price))
+                for order_id, authority, total_price in orders.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'zarinpal_authority', 'total_price')[:options['batch_size']]
+            ]
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            for order_id, outcome, seconds in payments.reconcile(batch, client, options['workers'], options['rate']):
+                outcomes[outcome] += 1
+                timings.append(seconds)
+            if len(batch) < options['batch_size']:
+                break
+
+        summary = summarize(timings, elapsed=time.monotonic() - started)
+        self.stdout.write(', '.join(f'{count} {outcome}' for outcome, count in sorted(outcomes.items())) or 'No orders')
+        self.stdout.write(self.style.SUCCESS(
+            f'Verified {summary["requests"]} orders at {summary["throughput_rps"]}/s '
+            f'(gateway p50 {summary["p50_ms"]}ms, p95 {summary["p95_ms"]}ms)'
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from store.database import replicate_sqlite
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database over every SQLite database in DATABASE_REPLICAS, once or '
+        'every --interval seconds. A local stand-in for replication, to try the replica router with '
+        'two database files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep copying every this many seconds (replication lag).')
+
+    def handle(self, *args, **options):
+        replicas = [alias for alias in settings.DATABASE_REPLICAS if connections[alias].vendor == 'sqlite']
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite' or not replicas:
+            raise CommandError('Needs a SQLite primary and SQLite replicas in DATABASE_REPLICAS.')
+
+        while True:
+            started = time.monotonic()
+            for alias in replicas:
+                replicate_sqlite(DEFAULT_DB_ALIAS, alias)
+            self.stdout.write(
+                f'{timezone.now():%H:%M:%S} copied to {", ".join(replicas)} in {time.monotonic() - started:.2f}s'
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.zarinpal_simulator import GatewaySimulator, make_server, parse_outcomes
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve a local stand-in for the ZarinPal gateway (PaymentRequest, PaymentVerification, StartPay) '
+        'with configurable latency, errors and outcomes. Point the store at it with '
+        'ZARINPAL_BASE_URL=http://127.0.0.1:<port> to test or load-test checkout offline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        latency = ' Latency in ms: fixed:50, uniform:20:80, lognormal:40:0.5 (median, sigma) or exponential:50 (mean).'
+        parser.add_argument('--request-latency', default='lognormal:80:0.4', help='PaymentRequest.' + latency)
+        parser.add_argument('--verify-latency', default='lognormal:120:0.5', help='PaymentVerification.' + latency)
+        parser.add_argument('--startpay-latency', default='fixed:0', help='StartPay.' + latency)
+        parser.add_argument('--request-outcomes', default='100:1',
+                            help='Weighted PaymentRequest statuses, e.g. 100:0.99,-3:0.01.')
+        parser.add_argument('--verify-outcomes', default='100:0.97,-21:0.02,-22:0.01',
+                            help='Weighted statuses of the first verification of a payment, e.g. 100:0.95,101:0.05.')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Share of API calls answered with --error-status instead.')
+        parser.add_argument('--error-status', type=int, default=503)
+        parser.add_argument('--cancel-rate', type=float, default=0.0,
+                            help='Share of StartPay visits where the customer cancels (Status=NOK).')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            simulator = GatewaySimulator(
+                request_latency=options['request_latency'],
+                verify_latency=options['verify_latency'],
+                startpay_latency=options['startpay_latency'],
+                request_outcomes=parse_outcomes(options['request_outcomes']),
+                verify_outcomes=parse_outcomes(options['verify_outcomes']),
+                error_rate=options['error_rate'],
+                error_status=options['error_status'],
+                cancel_rate=options['cancel_rate'],
+                seed=options['seed'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        server = make_server(simulator, options['host'], options['port'], verbose=options['verbosity'] > 1)
+        latency = ', '.join(f'{operation} {spec}' for operation, spec in simulator.latency.items())
+        self.stdout.write(
+            f'ZarinPal simulator on http://{options["host"]}:{server.server_port} ({latency}; '
+            f'errors {options["error_rate"]:.1%}). Set ZARINPAL_BASE_URL to this address.'
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,118 @@
+"""
+Prometheus metrics for the store.
+
+Each worker process records into its own registry. To aggregate across
+workers (gunicorn, uwsgi), point `PROMETHEUS_MULTIPROC_DIR` at an empty
+directory shared by all of them before they start, and wipe it on every
+deploy; `metrics_view` then merges the per-process files.
+"""
+import os
+import secrets
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+
+REQUEST_LATENCY = Histogram(
+    'store_request_duration_seconds', 'Request latency by view and action.',
+    ['view', 'action'],
+)
+REQUESTS = Counter(
+    'store_requests', 'Responses by view, action and status code.',
+    ['view', 'action', 'status'],
+)
+DB_QUERIES = Histogram(
+    'store_request_db_queries', 'Database queries per request.',
+    ['view', 'action'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+DB_TIME = Histogram(
+    'store_request_db_duration_seconds', 'Time spent in the database per request.',
+    ['view', 'action'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+GATEWAY_LATENCY = Histogram(
+    'store_gateway_duration_seconds', 'Time spent calling the payment gateway, retries included.',
+    ['operation', 'outcome'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+ORDERS_CREATED = Counter('store_orders_created', 'Orders created through the API.')
+
+
+def get_view_labels(request):
+    """
+    `(view, action)` for the resolved view: the viewset action (`list`,
+    `retrieve`, `bulk`, ...) or, for plain views, the lowercased method.
+    """
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched', request.method.lower()
+    func = match.func
+    view = getattr(getattr(func, 'cls', None), '__name__', None) or func.__name__
+    actions = getattr(func, 'actions', None)
+    if actions:
+        return view, actions.get(request.method.lower(), request.method.lower())
+    return view, request.method.lower()
+
+
+class MetricsMiddleware:
+    """
+    Record latency and status of every request, plus its database queries
+    and time when `QueryBudgetMiddleware` runs inside this one.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, elapsed):
+        view, action = get_view_labels(request)
+        REQUEST_LATENCY.labels(view, action).observe(elapsed)
+        REQUESTS.labels(view, action, str(response.status_code)).inc()
+        tracker = getattr(request, 'query_tracker', None)
+        if tracker is not None:
+            DB_QUERIES.labels(view, action).observe(tracker.count)
+            DB_TIME.labels(view, action).observe(tracker.duration)
+
+
+def get_registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_view(request):
+    """
+    Prometheus text exposition, only served with the `METRICS_TOKEN` bearer
+    token (not at all without one). The client address proves nothing behind
+    a reverse proxy on the same host.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not secrets.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        raise Http404
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cartitem',
+            options={'ordering': ['id']},
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+from store.search import normalize_text, plain_text
+
+
+def backfill_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # In Python rather than INSERT ... SELECT: rows are indexed normalized, the
+    # way SQLiteFTSSearchBackend.index writes them and search() queries them.
+    Product = apps.get_model('store', 'Product')
+    products = Product.objects.using(schema_editor.connection.alias) \
+                              .only('id', 'name', 'description').order_by('id')
+    schema_editor.execute('DELETE FROM store_product_search')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO store_product_search (rowid, name, description) VALUES (%s, %s, %s)',
+            [
+                (product.id, normalize_text(product.name), normalize_text(plain_text(product.description)))
+                for product in products.iterator(chunk_size=500)
+            ],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_index, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,8 @@
 from django.utils import timezone
-from django.db import models
+from decimal import Decimal
+from django.db import connections, models, router
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from uuid import uuid4
@@ -10,6 +13,7 @@ from django.utils.translation import gettext_lazy as _
 class BannerImage(models.Model):
     title = models.CharField(max_length=255, blank=True)
     banner = models.ImageField(upload_to='banner/')
+    banner_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.title    
@@ -23,9 +27,19 @@ class Product(models.Model):
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     inventory = models.IntegerField(validators=[MinValueValidator(0)])
     cover = models.ImageField(upload_to='cover/', blank=True)
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
     datetime_created = models.DateTimeField(default=timezone.now)
     datetime_modified = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Keyset pagination sorts on (field, id), see KeysetPagination.
+        indexes = [
+            models.Index(fields=['datetime_created', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            models.Index(fields=['unit_price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['inventory', 'id'], name='product_inventory_id_idx'),
+        ]
+
 
     def __str__(self):
         return self.name
@@ -33,6 +47,7 @@ class Product(models.Model):
 
 class ProductImages(models.Model):
     images = models.ImageField(upload_to="product-images", default="product.jpg")
+    variants = models.JSONField(default=dict, blank=True, editable=False)
     product = models.ForeignKey(Product, related_name="images", on_delete=models.SET_NULL, null=True)
     date_created = models.DateTimeField(auto_now_add=True)
 
@@ -48,7 +63,26 @@ class Customer(models.Model):
     def __str__(self):
         return f'{self.user.first_name} {self.user.last_name}'
 
-class UnpaidOrderManager(models.Manager):
+class OrderQuerySet(models.QuerySet):
+
+    def annotate_totals(self):
+        """
+        Compute item count and total price from the order items in SQL, as
+        `computed_items_count` and `computed_total_price`.
+        """
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        items_count = items.annotate(items_count=Count('id')).values('items_count')
+        total_price = items.annotate(total_price=Sum(F('unit_price') * F('quantity'))).values('total_price')
+        return self.annotate(
+            computed_items_count=Coalesce(Subquery(items_count), 0),
+            computed_total_price=Coalesce(
+                Subquery(total_price, output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+                Decimal(0),
+            ),
+        )
+
+
+class UnpaidOrderManager(models.Manager.from_queryset(OrderQuerySet)):
 
     def get_queryset(self):
         return super().get_queryset().filter(status=Order.ORDER_STATUS_UNPAID)
@@ -71,20 +105,35 @@ class Order(models.Model):
 
 
 
-    zarinpal_authority = models.CharField(max_length=255, blank=True)
+    zarinpal_authority = models.CharField(max_length=255, blank=True, db_index=True)
     zarinpal_ref_id = models.CharField(max_length=150, blank=True)
     zarinpal_data = models.TextField(blank=True)
 
-    objects = models.Manager()
+    # Kept in sync with the order items, see `update_totals`.
+    items_count = models.PositiveIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    objects = OrderQuerySet.as_manager()
     unpaid_orders = UnpaidOrderManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'datetime_created', 'id'], name='order_customer_created_idx'),
+            models.Index(fields=['datetime_created', 'id'], name='order_created_id_idx'),
+        ]
 
     def __str__(self):
         return f'Order id={self.id}'
     
     def get_total_price(self):
-        total = sum([item.get_cost() for item in self.items.all()])
-        return total
+        return self.total_price
+
+    def update_totals(self):
+        totals = Order.objects.filter(pk=self.pk).annotate_totals() \
+                              .values('computed_items_count', 'computed_total_price').get()
+        self.items_count = totals['computed_items_count']
+        self.total_price = totals['computed_total_price']
+        Order.objects.filter(pk=self.pk).update(items_count=self.items_count, total_price=self.total_price)
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name='items')
@@ -101,7 +150,57 @@ class OrderItem(models.Model):
 
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class CartItemManager(models.Manager):
+
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Insert a cart line or add `quantity` to the existing one in a single
+        `INSERT ... ON CONFLICT DO UPDATE` statement, returning the saved item,
+        or None if there is no cart `cart_id`.
+        """
+        connection = connections[router.db_for_write(self.model)]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        cart_table = qn(Cart._meta.db_table)
+        cart_id_value = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({qn("cart_id")}, {qn("product_id")}, {qn("quantity")}) '
+                f'SELECT %s, %s, %s WHERE EXISTS (SELECT 1 FROM {cart_table} WHERE {qn("id")} = %s) '
+                f'ON CONFLICT ({qn("cart_id")}, {qn("product_id")}) '
+                f'DO UPDATE SET {qn("quantity")} = {table}.{qn("quantity")} + excluded.{qn("quantity")} '
+                f'RETURNING {qn("id")}, {qn("quantity")}',
+                [cart_id_value, product_id, quantity, cart_id_value],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        item_id, total_quantity = row
+        return self.model(id=item_id, cart_id=cart_id, product_id=product_id, quantity=total_quantity)
+
+    def add_quantities(self, cart_id, quantities):
+        """
+        Like `add_quantity` for several products (`{product_id: quantity}`) of
+        an existing cart, in one statement.
+        """
+        if not quantities:
+            return
+        connection = connections[router.db_for_write(self.model)]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        cart_id_value = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({qn("cart_id")}, {qn("product_id")}, {qn("quantity")}) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(quantities))} '
+                f'ON CONFLICT ({qn("cart_id")}, {qn("product_id")}) '
+                f'DO UPDATE SET {qn("quantity")} = {table}.{qn("quantity")} + excluded.{qn("quantity")}',
+                [value for product_id, quantity in quantities.items()
+                 for value in (cart_id_value, product_id, quantity)],
+            )
 
 
 class CartItem(models.Model):
@@ -109,5 +208,80 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cart_items')
     quantity = models.PositiveSmallIntegerField()
 
+    objects = CartItemManager()
+
+    class Meta:
+        unique_together = [['cart', 'product']]
+        ordering = ['id']        
+
+class OutboxEvent(models.Model):
+    """
+    An event saved in the transaction that caused it and dispatched later by
+    `manage.py drain_outbox` (store/outbox.py).
+    """
+    STATUS_PENDING = 'p'
+    STATUS_DONE = 'd'
+    STATUS_FAILED = 'f'
+    STATUS = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=1, choices=STATUS, default=STATUS_PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # When a worker may next pick the event up: now, after a retry backoff, or
+    # once the lease of the worker that claimed it runs out.
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claim = models.CharField(max_length=32, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
     class Meta:
-        unique_together = [['cart', 'product']]        
\ No newline at end of file
+        indexes = [
+            models.Index(
+                fields=['available_at', 'id'], name='outbox_pending_idx', condition=models.Q(status='p'),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.event_type} {self.payload}'
+
+
+class DailySales(models.Model):
+    """Paid orders per day they were placed, kept up to date by store/sales.py."""
+    date = models.DateField(unique=True)
+    orders_count = models.IntegerField(default=0)
+    items_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name_plural = 'Daily sales'
+
+    def __str__(self):
+        return str(self.date)
+
+
+class DailyProductSales(models.Model):
+    """Paid order items per day and product, kept up to date by store/sales.py."""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    orders_count = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-date', '-revenue']
+        verbose_name_plural = 'Daily product sales'
+        # (date, product) serves date ranges, the index the product's history.
+        unique_together = [['date', 'product']]
+        indexes = [
+            models.Index(fields=['product', 'date'], name='product_sales_product_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} on {self.date}'
@@ -0,0 +1,114 @@
+"""
+Transactional outbox.
+
+`enqueue` saves an `OutboxEvent` in the caller's transaction, so the event
+exists if and only if the change that caused it was committed, and the
+request doesn't wait for the event's receivers. `manage.py drain_outbox`
+claims due events in batches and dispatches them with `dispatch`.
+
+Delivery is at least once: an event whose handler fails is retried with an
+exponential backoff, up to `OUTBOX_MAX_ATTEMPTS`, and a worker that dies
+mid-batch leaves its events to be picked up again after
+`OUTBOX_LEASE_SECONDS`. Receivers must therefore tolerate duplicates.
+"""
+import logging
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from store.models import Order, OutboxEvent
+from store.signals import order_created
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = 'order_created'
+
+
+class DispatchFailed(Exception):
+    pass
+
+
+def enqueue(event_type, **payload):
+    """Save an event; call it inside the transaction of the change it describes."""
+    return OutboxEvent.objects.create(event_type=event_type, payload=payload)
+
+
+def dispatch_order_created(payload):
+    # Sent by the viewset, as it was before checkout went through the outbox.
+    from store.views import OrderViewSet
+
+    order = Order.objects.get(id=payload['order_id'])
+    errors = [
+        f'{receiver.__module__}.{receiver.__qualname__}: {error!r}'
+        for receiver, error in order_created.send_robust(OrderViewSet, order=order)
+        if isinstance(error, Exception)
+    ]
+    if errors:
+        raise DispatchFailed('; '.join(errors))
+
+
+HANDLERS = {
+    ORDER_CREATED: dispatch_order_created,
+}
+
+
+def dispatch(event):
+    handler = HANDLERS.get(event.event_type)
+    if handler is None:
+        raise DispatchFailed(f'No handler for {event.event_type!r} events')
+    handler(event.payload)
+
+
+def get_max_attempts():
+    return getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+
+
+def get_retry_delay(attempts):
+    return timedelta(seconds=getattr(settings, 'OUTBOX_RETRY_BACKOFF', 2) * 2 ** (attempts - 1))
+
+
+def claim(batch_size):
+    """
+    Lease up to `batch_size` due events to this worker, oldest first. The
+    UPDATE re-checks that each event is still due, so two workers never claim
+    the same one.
+    """
+    now = timezone.now()
+    due = OutboxEvent.objects.filter(status=OutboxEvent.STATUS_PENDING, available_at__lte=now)
+    ids = list(due.order_by('available_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = uuid4().hex
+    lease = timedelta(seconds=getattr(settings, 'OUTBOX_LEASE_SECONDS', 60))
+    due.filter(id__in=ids).update(claim=token, available_at=now + lease, attempts=F('attempts') + 1)
+    return list(OutboxEvent.objects.filter(id__in=ids, claim=token).order_by('available_at', 'id'))
+
+
+def process_batch(batch_size=100):
+    """Claim and dispatch one batch. Returns the number of events dispatched and failed."""
+    done, failed = [], 0
+    for event in claim(batch_size):
+        try:
+            dispatch(event)
+        except Exception as error:
+            failed += 1
+            give_up = event.attempts >= get_max_attempts()
+            logger.warning('Outbox event %s (%s) failed on attempt %d%s: %s', event.id, event.event_type,
+                           event.attempts, ', giving up' if give_up else '', error)
+            OutboxEvent.objects.filter(id=event.id).update(
+                status=OutboxEvent.STATUS_FAILED if give_up else OutboxEvent.STATUS_PENDING,
+                available_at=timezone.now() + get_retry_delay(event.attempts),
+                last_error=str(error),
+            )
+        else:
+            done.append(event.id)
+
+    if done:
+        OutboxEvent.objects.filter(id__in=done).update(
+            status=OutboxEvent.STATUS_DONE, processed_at=timezone.now(), last_error='',
+        )
+    return len(done), failed
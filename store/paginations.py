@@ -1,4 +1,175 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination, _reverse_ordering
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class DefaultPagination(PageNumberPagination):
-    paage_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination keyed on every ordering field plus `id` as a tie-breaker.
+
+    The cursor carries the full key of the last (or first) row of the page, so
+    each page is a single indexed range query with no OFFSET, whatever its depth.
+    Ordering fields are expected to be non-nullable.
+    """
+    ordering = ('-datetime_created', '-id')
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    # `?count=0` skips the COUNT(*) query for clients that don't need a total.
+    count_query_param = 'count'
+    include_count = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.count = queryset.count() if self.get_include_count(request) else None
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is not None:
+            self.cursor = self.cursor._replace(position=self.get_position_values(queryset, self.cursor.position))
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, self.cursor.position))
+
+        # Fetch one extra row to find out whether there is a following page.
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = bool(self.page)
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = self.cursor is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_include_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return self.include_count
+        return value.lower() not in ('0', 'false', 'no', 'off')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            tie_breaker = '-id' if ordering[0].startswith('-') else 'id'
+            ordering = ordering + (tie_breaker,)
+        return ordering
+
+    def get_keyset_filter(self, ordering, position):
+        """
+        Build `(a, b, id) > (x, y, z)` as nested OR/AND terms, honouring the
+        direction of each ordering field.
+        """
+        keyset_filter = Q()
+        equal_prefix = Q()
+        for field, value in zip(ordering, position):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            attr = field.lstrip('-')
+            keyset_filter |= equal_prefix & Q(**{f'{attr}__{lookup}': value})
+            equal_prefix &= Q(**{attr: value})
+        return keyset_filter
+
+    def get_position_values(self, queryset, position):
+        """
+        Convert the cursor's position strings with the ordering fields (or
+        annotations, like `search_rank`), so a forged cursor is a 404 rather
+        than a query error.
+        """
+        values = []
+        for field, value in zip(self.ordering, position):
+            attr = field.lstrip('-')
+            if attr in queryset.query.annotations:
+                model_field = queryset.query.annotations[attr].output_field
+            else:
+                model_field = queryset.model._meta.pk if attr == 'pk' else queryset.model._meta.get_field(attr)
+            try:
+                values.append(model_field.to_python(value))
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('utf-8')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            position = tokens['p']
+            ordering = tokens['o'][0].split(',')
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # A cursor only makes sense for the ordering it was made for (e.g. not
+        # once the client changed ?ordering=).
+        if ordering != list(self.ordering) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return Cursor(offset=0, reverse=reverse, position=position)
+
+    def encode_cursor(self, cursor):
+        tokens = {'o': ','.join(self.ordering), 'p': cursor.position}
+        if cursor.reverse:
+            tokens['r'] = '1'
+
+        querystring = parse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        position = []
+        for field in ordering:
+            attr = field.lstrip('-')
+            value = instance[attr] if isinstance(instance, dict) else getattr(instance, attr)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return position
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
@@ -0,0 +1,124 @@
+"""
+Payment verification shared by the verify views and `manage.py reconcile_payments`.
+
+`mark_paid` is a compare-and-set on the unpaid status and the authority, so
+the customer's return to the verify view and any number of reconciliation
+runs can verify the same payment concurrently and the order is paid once.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from store import sales, zarinpal
+from store.models import Order
+
+
+VERIFIED = 100
+ALREADY_VERIFIED = 101
+
+OUTCOME_PAID = 'paid'
+OUTCOME_ALREADY_PAID = 'already_paid'
+OUTCOME_NOT_PAID = 'not_paid'
+OUTCOME_GATEWAY_ERROR = 'gateway_error'
+
+
+def mark_paid(order_id, authority, data):
+    """
+    Mark the unpaid order as paid with the gateway's answer and count it in the
+    sales rollups. False if it was paid already.
+    """
+    with transaction.atomic():
+        paid = bool(
+            Order.unpaid_orders.filter(pk=order_id, zarinpal_authority=authority).update(
+                status=Order.ORDER_STATUS_PAID,
+                zarinpal_ref_id=data.get('RefID', ''),
+                zarinpal_data=data,
+            )
+        )
+        if paid:
+            sales.add_orders([order_id])
+    return paid
+
+
+async def amark_paid(order_id, authority, data):
+    """`mark_paid` for async views (the async ORM has no transactions)."""
+    return await sync_to_async(mark_paid)(order_id, authority, data)
+
+
+def is_verified(data):
+    return 'errors' not in data and data.get('Status') in (VERIFIED, ALREADY_VERIFIED)
+
+
+def describe_errors(data):
+    """
+    The gateway's errors as text, "message code" for each of them: `errors` is
+    an object or a list of them (or missing, then the answer's Status is used).
+    """
+    errors = data.get('errors') or [{'code': data.get('Status')}]
+    if not isinstance(errors, list):
+        errors = [errors]
+    return ', '.join(
+        ' '.join(str(error[key]) for key in ('message', 'code') if error.get(key) is not None)
+        if isinstance(error, dict) else str(error)
+        for error in errors
+    )
+
+
+class RateLimiter:
+    """Spaces out calls from any number of threads to at most `rate` per second (no limit if falsy)."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def verify_many(orders, client=None, workers=8, rate=None):
+    """
+    Verify `orders` ((order_id, authority, amount) tuples) against the gateway
+    on `workers` threads, at most `rate` calls per second. Yields
+    (order_id, authority, data or None on a gateway error, seconds) in order.
+    The threads only talk to the gateway, never to the database.
+    """
+    client = client or zarinpal.client
+    limiter = RateLimiter(rate)
+
+    def verify(order):
+        order_id, authority, amount = order
+        limiter.wait()
+        started = time.monotonic()
+        try:
+            data = client.verify_payment(amount=amount, authority=authority).data
+        except zarinpal.ZarinpalError:
+            data = None
+        return order_id, authority, data, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(verify, orders)
+
+
+def reconcile(orders, client=None, workers=8, rate=None):
+    """Verify `orders` and mark the paid ones. Yields (order_id, outcome, seconds)."""
+    for order_id, authority, data, seconds in verify_many(orders, client, workers, rate):
+        if data is None:
+            outcome = OUTCOME_GATEWAY_ERROR
+        elif not is_verified(data):
+            outcome = OUTCOME_NOT_PAID
+        elif mark_paid(order_id, authority, data):
+            outcome = OUTCOME_PAID
+        else:
+            outcome = OUTCOME_ALREADY_PAID
+        yield order_id, outcome, seconds
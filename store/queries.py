@@ -0,0 +1,114 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)')
+
+
+def normalize_sql(sql):
+    """
+    Reduce a query to its shape, so the same statement run with different
+    parameters (the N+1 signature) compares equal.
+    """
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER_LIST.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+class QueryTracker:
+    """
+    Record every SQL statement (and its duration) run on any database
+    connection of the current thread while the tracker is active. Unlike
+    `connection.queries` it does not depend on DEBUG.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration in self.queries)
+
+    def repeated_shapes(self, threshold=2):
+        """Query shapes that ran at least `threshold` times, most frequent first."""
+        shapes = Counter(normalize_sql(sql) for sql, _ in self.queries)
+        return [(shape, count) for shape, count in shapes.most_common() if count >= threshold]
+
+
+class QueryBudgetMiddleware:
+    """
+    Count the queries and DB time of every request. Requests over their budget
+    (`QUERY_BUDGETS` by method and URL name, as in 'GET store:product-list',
+    else `QUERY_BUDGET_DEFAULT`) or repeating a query shape
+    `QUERY_REPEAT_THRESHOLD` times are logged; with
+    `QUERY_BUDGET_HEADERS` on, the numbers are also sent as response headers.
+    The tracker is left on `request.query_tracker` for outer middleware.
+
+    Only sync requests (WSGI, the test client) are tracked: under ASGI the
+    ORM runs on a thread shared by all concurrent requests, so async
+    requests pass straight through.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.default_budget = getattr(settings, 'QUERY_BUDGET_DEFAULT', 20)
+        self.budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        self.repeat_threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5)
+        self.headers = getattr(settings, 'QUERY_BUDGET_HEADERS', settings.DEBUG)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        with QueryTracker() as tracker:
+            response = self.get_response(request)
+        request.query_tracker = tracker
+
+        view_name = request.resolver_match.view_name if request.resolver_match else request.path
+        budget = self.budgets.get(f'{request.method} {view_name}', self.default_budget)
+        if tracker.count > budget:
+            logger.warning('%s %s ran %d queries (budget %d) in %.1fms',
+                           request.method, view_name, tracker.count, budget, tracker.duration * 1000)
+        for shape, count in tracker.repeated_shapes(self.repeat_threshold):
+            logger.warning('%s %s repeated a query %d times (possible N+1): %s',
+                           request.method, view_name, count, shape)
+
+        if self.headers:
+            response['X-DB-Query-Count'] = str(tracker.count)
+            response['X-DB-Query-Time'] = f'{tracker.duration * 1000:.1f}ms'
+        return response
@@ -0,0 +1,87 @@
+"""
+EXPLAIN checks for the hot queries of the API.
+
+`get_hot_queries` builds each query the way the views and filters do, and
+`find_full_scans` explains it on the current database and returns the tables
+it reads with a full scan. Run `python manage.py check_query_plans` (or the
+test suite) after changing models, views or indexes.
+"""
+import json
+from uuid import uuid4
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from store.models import CartItem, Order, OrderItem, Product, ProductImages
+from store.paginations import KeysetPagination
+
+
+PAGE = KeysetPagination.page_size + 1
+
+
+def get_hot_queries():
+    ordering = KeysetPagination.ordering
+    next_page = KeysetPagination().get_keyset_filter(ordering, [timezone.now().isoformat(), '1'])
+    return {
+        'product list': Product.objects.order_by(*ordering)[:PAGE],
+        'product list, next page': Product.objects.filter(next_page).order_by(*ordering)[:PAGE],
+        'product list by price': Product.objects.order_by('unit_price', 'id')[:PAGE],
+        'product list by price, descending': Product.objects.order_by('-unit_price', '-id')[:PAGE],
+        'product list by name': Product.objects.order_by('name', 'id')[:PAGE],
+        'product list by inventory': Product.objects.order_by('inventory', 'id')[:PAGE],
+        'product inventory range': Product.objects.filter(inventory__gt=0, inventory__lt=5).order_by(*ordering)[:PAGE],
+        'product images': ProductImages.objects.filter(product_id__in=[1, 2, 3]),
+        'cart items': CartItem.objects.filter(cart_id=uuid4()),
+        'order by authority': Order.objects.filter(zarinpal_authority='A00000000000000000000000000000000000'),
+        'customer orders': Order.objects.filter(customer__user_id=1).order_by(*ordering)[:PAGE],
+        'all orders': Order.objects.order_by(*ordering)[:PAGE],
+        'order items': OrderItem.objects.filter(order_id__in=[1, 2, 3]),
+    }
+
+
+def explain(queryset):
+    """The query plan as text, as the database prints it."""
+    connection = connections[router.db_for_read(queryset.model)]
+    if connection.vendor == 'postgresql':
+        return json.dumps(_postgresql_plan(queryset, connection), indent=2)
+    return queryset.explain()
+
+
+def find_full_scans(queryset):
+    """Names of the tables `queryset` reads with a full table scan."""
+    connection = connections[router.db_for_read(queryset.model)]
+    if connection.vendor == 'sqlite':
+        return _sqlite_full_scans(queryset.explain())
+    if connection.vendor == 'postgresql':
+        return _postgresql_full_scans(_postgresql_plan(queryset, connection))
+    raise NotImplementedError(f'Query plan checks are not implemented for {connection.vendor}')
+
+
+def _sqlite_full_scans(plan):
+    # EXPLAIN QUERY PLAN rows end with the detail: 'SCAN t', 'SCAN t USING INDEX i', 'SEARCH t USING ...'.
+    scans = []
+    for line in plan.splitlines():
+        detail = line.split(' ', 3)[-1]
+        if detail.startswith('SCAN ') and ' USING ' not in detail and 'CONSTANT ROW' not in detail:
+            scans.append(detail[len('SCAN '):].split(' ')[0])
+    return scans
+
+
+def _postgresql_plan(queryset, connection):
+    # Tables in a test database are tiny, so the planner would pick sequential
+    # scans anyway; with them disabled a Seq Scan only remains if no index fits.
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return json.loads(queryset.explain(format='json'))
+
+
+def _postgresql_full_scans(plan):
+    scans = []
+    nodes = [entry['Plan'] for entry in plan]
+    while nodes:
+        node = nodes.pop()
+        if node.get('Node Type') == 'Seq Scan':
+            scans.append(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return scans
@@ -1,4 +1,23 @@
+import orjson
+from django.http import HttpResponse
 from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def get_error_message(data):
+    try:
+        if isinstance(data, dict):
+            first_error_object = list(data.values())[0]
+            if isinstance(first_error_object, list):
+                error_message = first_error_object[0]
+            else:
+                error_message = first_error_object
+        else:
+            error_message = data["detail"]
+    except:
+        error_message =''
+    return error_message
+
 
 class CustomRenderer(JSONRenderer):
     def render(self, data, accepted_media_type=None, renderer_context=None):
@@ -13,17 +32,55 @@ class CustomRenderer(JSONRenderer):
         if not str(status_code).startswith('2'):
             response["success"] = False
             response["data"] = None
-            try:
-                if isinstance(data, dict):
-                    first_error_object = list(data.values())[0]  
-                    if isinstance(first_error_object, list):
-                        error_message = first_error_object[0]
-                    else:
-                        error_message = first_error_object
-                else:
-                    error_message = data["detail"]
-            except:
-                error_message =''
-            response["message"] = error_message
+            response["message"] = get_error_message(data)
         return super(CustomRenderer,self).render(response,accepted_media_type,renderer_context)
-        
+
+
+class FastCustomRenderer(CustomRenderer):
+    """
+    Same envelope as `CustomRenderer`, encoded with orjson. Successful
+    payloads are encoded once and spliced between pre-built envelope bytes
+    instead of being wrapped in a new dict first.
+
+    The output is byte-identical except for floats, which orjson writes in
+    its own shortest form: 1e-05 as 0.00001 and 1e+16 as 1e16, the same
+    numbers to any JSON parser. NaN and Infinity, which `CustomRenderer`
+    refuses (STRICT_JSON), are rendered as null. Serializers here produce
+    neither: prices are Decimals from the database.
+    """
+    # Types orjson has no native support for (Decimal, lazy strings, querysets...)
+    # go through DRF's encoder, so they are rendered as CustomRenderer renders them.
+    encoder_default = JSONEncoder().default
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, data):
+        content = orjson.dumps(data, default=self.encoder_default, option=self.options)
+        # Like JSONRenderer, escape the two line terminators that are valid JSON but not valid JavaScript.
+        if b'\xe2\x80\xa8' in content or b'\xe2\x80\xa9' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return content
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        status_code = renderer_context['response'].status_code
+        if not str(status_code).startswith('2'):
+            return self.dumps({
+                "success": False,
+                "code": status_code,
+                "data": None,
+                "message": get_error_message(data),
+            })
+
+        return b''.join((
+            b'{"success":true,"code":', str(int(status_code)).encode(),
+            b',"data":', self.dumps(data),
+            b',"message":null}',
+        ))
+
+
+def render_envelope(data, status_code):
+    """The API envelope as `FastCustomRenderer` renders it, for views outside DRF."""
+    return FastCustomRenderer().render(data, renderer_context={'response': HttpResponse(status=status_code)})
@@ -0,0 +1,183 @@
+"""
+Read replicas.
+
+While `ReplicaRoutingMiddleware` handles a GET/HEAD/OPTIONS request,
+`ReplicaRouter` sends its reads to one of `DATABASE_REPLICAS` (picked per
+request). Everything else uses the primary: writes, unsafe requests, and reads
+outside a request (management commands, tests, background work).
+
+Replicas lag behind the primary, so whoever has just written keeps reading
+from it. A request that writes (or uses an unsafe method) marks its user
+(from the JWT, else the session cookie) and cart as sticky for
+`DATABASE_REPLICA_STICKY_SECONDS` in the `DATABASE_STICKY_CACHE` alias, and
+requests by a sticky user or for a sticky cart read from the primary. Within
+a request, reads also go to the primary once it has written, and within
+`primary_reads()`: what is rendered there outlives the lag (e.g. the catalog
+cache entries rendered in the sticky window after an invalidation).
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from uuid import UUID
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+
+_routing = ContextVar('database_routing', default=None)
+
+
+class RoutingState:
+
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+        self.sticky_keys = set()
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def get_sticky_seconds():
+    return getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+
+
+def get_sticky_cache():
+    return caches[getattr(settings, 'DATABASE_STICKY_CACHE', 'default')]
+
+
+def sticky_key(kind, value):
+    if kind == 'cart':
+        try:
+            value = UUID(str(value)).hex
+        except ValueError:
+            pass
+    return f'db-sticky:{kind}:{value}'
+
+
+def pin(kind, value):
+    """
+    Make `kind`/`value` (e.g. a cart created by this request, which is not in
+    the URL yet) sticky along with the request's user if the request writes.
+    """
+    state = _routing.get()
+    if state is not None:
+        state.sticky_keys.add(sticky_key(kind, value))
+
+
+@contextmanager
+def primary_reads():
+    """Send the reads of the current request to the primary within the block."""
+    state = _routing.get()
+    if state is None:
+        yield
+        return
+    replica, state.replica = state.replica, None
+    try:
+        yield
+    finally:
+        state.replica = replica
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is not None and state.replica and not state.wrote:
+            return state.replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get the schema (and data) from the primary.
+        return db not in get_replicas()
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.jwt = JWTAuthentication()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        self.remember_writes(request, state)
+        return response
+
+    async def __acall__(self, request):
+        # The ORM's sync_to_async threads run in a copy of this context, so they see `state`.
+        state = RoutingState()
+        token = _routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        self.remember_writes(request, state)
+        return response
+
+    def remember_writes(self, request, state):
+        if state.sticky_keys and (state.wrote or request.method not in SAFE_METHODS):
+            get_sticky_cache().set_many(dict.fromkeys(state.sticky_keys, True), get_sticky_seconds())
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _routing.get()
+        state.sticky_keys.update(self.get_sticky_keys(request, view_kwargs))
+        replicas = get_replicas()
+        if replicas and request.method in SAFE_METHODS and not state.wrote:
+            if not state.sticky_keys or not get_sticky_cache().get_many(state.sticky_keys):
+                state.replica = random.choice(replicas)
+
+    def get_sticky_keys(self, request, view_kwargs):
+        keys = []
+        user_id = self.get_user_id(request)
+        if user_id is not None:
+            keys.append(sticky_key('user', user_id))
+        elif settings.SESSION_COOKIE_NAME in request.COOKIES:
+            keys.append(sticky_key('session', request.COOKIES[settings.SESSION_COOKIE_NAME]))
+
+        cart_id = view_kwargs.get('cart_pk')
+        if cart_id is None and request.resolver_match.url_name == 'cart-detail':
+            cart_id = view_kwargs.get('pk')
+        if cart_id is not None:
+            keys.append(sticky_key('cart', cart_id))
+        return keys
+
+    def get_user_id(self, request):
+        # Only the token's claims, so finding the user costs no query.
+        header = self.jwt.get_header(request)
+        if header is None:
+            return None
+        try:
+            raw_token = self.jwt.get_raw_token(header)
+            if raw_token is None:
+                return None
+            return self.jwt.get_validated_token(raw_token).get(jwt_settings.USER_ID_CLAIM)
+        except AuthenticationFailed:
+            return None
@@ -0,0 +1,168 @@
+"""
+Sales rollups.
+
+Reports read `DailySales` (per day) and `DailyProductSales` (per day and
+product) instead of summing order items, so they cost the same however long
+the order history gets. Both count paid orders on the local date they were
+placed.
+
+The rollups are kept up to date incrementally: `add_orders` is called in the
+transaction that marks orders paid (`payments.mark_paid`,
+`inventory.update_order_status`) and `remove_orders` in the one that takes
+them out of paid. `rebuild` recomputes them from the orders
+(`manage.py rebuild_sales_rollups`), e.g. after a bulk import.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from store.models import DailyProductSales, DailySales, Order, OrderItem
+
+
+def _upsert(model, key_fields, rows):
+    """
+    Add `rows` (dicts of field values) to the rows of `model` with the same
+    `key_fields`, inserting the missing ones, with one `INSERT ... ON CONFLICT
+    DO UPDATE` statement per row.
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    keys = ', '.join(qn(field.column) for field in fields if field.name in key_fields)
+    totals = ', '.join(
+        f'{qn(field.column)} = {table}.{qn(field.column)} + excluded.{qn(field.column)}'
+        for field in fields if field.name not in key_fields
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} ({", ".join(qn(field.column) for field in fields)}) '
+            f'VALUES ({", ".join(["%s"] * len(fields))}) '
+            f'ON CONFLICT ({keys}) DO UPDATE SET {totals}',
+            [[field.get_db_prep_save(row[field.name], connection) for field in fields] for row in rows],
+        )
+
+
+def _apply(order_ids, sign):
+    days = defaultdict(lambda: {'orders_count': 0, 'items_sold': 0, 'revenue': Decimal(0)})
+    products = defaultdict(lambda: {'orders_count': 0, 'quantity': 0, 'revenue': Decimal(0)})
+
+    for datetime_created in Order.objects.filter(id__in=order_ids).values_list('datetime_created', flat=True):
+        days[timezone.localdate(datetime_created)]['orders_count'] += sign
+    items = OrderItem.objects.filter(order_id__in=order_ids) \
+                             .values_list('order__datetime_created', 'product_id', 'quantity', 'unit_price')
+    for datetime_created, product_id, quantity, unit_price in items:
+        date = timezone.localdate(datetime_created)
+        for totals in (days[date], products[date, product_id]):
+            totals['revenue'] += sign * quantity * unit_price
+        days[date]['items_sold'] += sign * quantity
+        products[date, product_id]['orders_count'] += sign
+        products[date, product_id]['quantity'] += sign * quantity
+
+    _upsert(DailySales, ['date'], [{'date': date, **totals} for date, totals in days.items()])
+    _upsert(DailyProductSales, ['date', 'product'], [
+        {'date': date, 'product': product_id, **totals} for (date, product_id), totals in products.items()
+    ])
+    if sign < 0:
+        DailySales.objects.filter(date__in=days, orders_count__lte=0).delete()
+        DailyProductSales.objects.filter(date__in=days, orders_count__lte=0).delete()
+
+
+def add_orders(order_ids):
+    """Count the orders `order_ids`, which have just been paid, in the rollups."""
+    _apply(order_ids, 1)
+
+
+def remove_orders(order_ids):
+    """Take the orders `order_ids`, which are no longer paid, out of the rollups."""
+    _apply(order_ids, -1)
+
+
+def _insert_select(model, queryset):
+    """
+    Copy the rows of the values() `queryset`, whose columns are named after
+    fields of `model`, into `model`'s table with one `INSERT ... SELECT`.
+    """
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    query = queryset.query
+    columns = [model._meta.get_field(name).column for name in [*query.values_select, *query.annotation_select]]
+    sql, params = query.get_compiler(connection=connection).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {qn(model._meta.db_table)} ({", ".join(map(qn, columns))}) {sql}', params)
+        return cursor.rowcount
+
+
+@transaction.atomic
+def rebuild(since=None):
+    """
+    Recompute the rollups of the days from `since` on (all days if None) from
+    the paid orders. Returns the number of day and day/product rows written.
+    """
+    orders = Order.objects.filter(status=Order.ORDER_STATUS_PAID)
+    days = DailySales.objects.all()
+    products = DailyProductSales.objects.all()
+    if since is not None:
+        orders = orders.filter(datetime_created__date__gte=since)
+        days = days.filter(date__gte=since)
+        products = products.filter(date__gte=since)
+    days.delete()
+    products.delete()
+
+    product_count = _insert_select(DailyProductSales, (
+        OrderItem.objects.filter(order__in=orders)
+        .annotate(date=TruncDate('order__datetime_created'))
+        .values('date', 'product_id')
+        # Revenue before the `quantity` annotation, which would shadow the field.
+        .annotate(orders_count=Count('id'), revenue=Sum(F('unit_price') * F('quantity')), quantity=Sum('quantity'))
+        .order_by()
+    ))
+
+    item_totals = {
+        row['date']: row
+        for row in products.values('date').annotate(items_sold=Sum('quantity'), revenue=Sum('revenue')).order_by()
+    }
+    day_rows = DailySales.objects.bulk_create(
+        DailySales(
+            date=row['date'],
+            orders_count=row['orders_count'],
+            items_sold=item_totals.get(row['date'], {}).get('items_sold', 0),
+            revenue=item_totals.get(row['date'], {}).get('revenue', 0),
+        )
+        for row in orders.annotate(date=TruncDate('datetime_created')).values('date')
+                         .annotate(orders_count=Count('id')).order_by()
+    )
+    return len(day_rows), product_count
+
+
+def get_period(start=None, end=None, days=30):
+    """(start, end) dates, inclusive, defaulting to the `days` days up to today."""
+    end = end or timezone.localdate()
+    return start or end - timedelta(days=days - 1), end
+
+
+def daily_sales(start, end):
+    return DailySales.objects.filter(date__range=(start, end)).order_by('date')
+
+
+def sales_totals(start, end):
+    return DailySales.objects.filter(date__range=(start, end)).aggregate(
+        orders_count=Sum('orders_count', default=0),
+        items_sold=Sum('items_sold', default=0),
+        revenue=Sum('revenue', default=Decimal(0)),
+    )
+
+
+def top_products(start, end, limit=10, order_by='revenue'):
+    """The best-selling products of the period by `order_by` ('revenue' or 'quantity')."""
+    return DailyProductSales.objects.filter(date__range=(start, end)) \
+        .values('product_id', name=F('product__name')) \
+        .annotate(orders_count=Sum('orders_count'), quantity=Sum('quantity'), revenue=Sum('revenue')) \
+        .order_by(f'-{order_by}', 'product_id')[:limit]
@@ -0,0 +1,148 @@
+import html
+import re
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+
+from store.models import Product
+
+
+PERSIAN_CHARACTER_MAP = str.maketrans({
+    '\u064a': '\u06cc',  # Arabic yeh -> Persian yeh
+    '\u0649': '\u06cc',  # Alef maksura -> Persian yeh
+    '\u0643': '\u06a9',  # Arabic kaf -> Persian kaf
+    '\u200c': '',  # ZWNJ, so compounds match with or without it
+    '\u0640': '',  # Tatweel
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # Persian digits
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+})
+
+ARABIC_DIACRITICS = re.compile('[\u064b-\u0652\u0670]')
+WORD = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    text = ARABIC_DIACRITICS.sub('', text or '')
+    return ' '.join(text.translate(PERSIAN_CHARACTER_MAP).lower().split())
+
+
+def plain_text(rich_text):
+    return html.unescape(strip_tags(rich_text or ''))
+
+
+class BaseSearchBackend(ABC):
+
+    @abstractmethod
+    def index(self, products):
+        """Add `products` to the index, replacing their existing entries."""
+
+    @abstractmethod
+    def remove(self, product_ids):
+        """Drop the products with these ids from the index."""
+
+    @abstractmethod
+    def clear(self):
+        """Empty the index."""
+
+    @abstractmethod
+    def search(self, queryset, term):
+        """
+        Return `queryset` narrowed to products matching `term` and annotated
+        with `search_rank`, where lower values rank higher.
+        """
+
+    def rebuild(self, batch_size=500):
+        self.clear()
+        queryset = Product.objects.only('id', 'name', 'description').order_by('id')
+        batch, total = [], 0
+        for product in queryset.iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                self.index(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self.index(batch)
+            total += len(batch)
+        return total
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 index over the normalized product name and plain-text
+    description, ranked with bm25 (name weighted above description).
+    """
+    table = 'store_product_search'
+    name_weight = 10.0
+    description_weight = 1.0
+
+    @property
+    def connection(self):
+        return connections[router.db_for_write(Product)]
+
+    def index(self, products):
+        rows = [
+            (product.pk, normalize_text(product.name), normalize_text(plain_text(product.description)))
+            for product in products
+        ]
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)', rows)
+
+    def remove(self, product_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def get_match_query(self, term):
+        # Every word must match; the last one may still be being typed.
+        return ' '.join(f'"{word}"*' for word in WORD.findall(normalize_text(term)))
+
+    def search(self, queryset, term):
+        match = self.get_match_query(term)
+        if not match:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+        table = queryset.model._meta.db_table
+        rank = RawSQL(
+            f'SELECT bm25({self.table}, %s, %s) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND {self.table}.rowid = "{table}"."id"',
+            (self.name_weight, self.description_weight, match),
+            output_field=FloatField(),
+        )
+        matches = RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', (match,))
+        return queryset.filter(id__in=matches).annotate(search_rank=rank)
+
+
+class NullSearchBackend(BaseSearchBackend):
+    """
+    Unindexed fallback for databases without a native full-text backend:
+    matches every word against the product name.
+    """
+
+    def index(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, queryset, term):
+        for word in WORD.findall(normalize_text(term)):
+            queryset = queryset.filter(name__icontains=word)
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def get_search_backend():
+    backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'store.search.SQLiteFTSSearchBackend')
+    return import_string(backend_path)()
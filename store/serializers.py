@@ -1,43 +1,85 @@
 from decimal import Decimal
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator
 from django.utils.text import slugify
 from django.db import transaction
-from store.models import BannerImage, Cart, CartItem, Customer, Order, OrderItem, Product, ProductImages
+from store import carts, inventory, outbox, sales
+from store.metrics import ORDERS_CREATED
+from store.models import BannerImage, Cart, CartItem, Customer, DailySales, Order, OrderItem, Product, ProductImages
 
 
 
+class ImageVariantsField(serializers.Field):
+    """
+    URLs of the resized variants of an image field, e.g.
+    `{'thumbnail': {'webp': url, 'jpeg': url}, ...}`, or `{}` until they are rendered.
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return getattr(instance, self.image_field).name, super().get_attribute(instance)
+
+    def to_representation(self, value):
+        name, variants = value
+        return image_variant_urls(name, variants, self.context.get('request'))
+
+
+def image_variant_urls(name, variants, request=None, file_url=None):
+    if not name or not variants or variants.get('source') != name:
+        return {}
+    if file_url is None:
+        def file_url(path):
+            return request.build_absolute_uri(default_storage.url(path)) if request else default_storage.url(path)
+    return {
+        variant: {extension: file_url(path) for extension, path in paths.items()}
+        for variant, paths in variants.items() if variant != 'source'
+    }
+
+
 class BannerImageSerializer(serializers.ModelSerializer):
+    banner_variants = ImageVariantsField('banner')
+
     class Meta:
         model = BannerImage
-        fields = ['id','title', 'banner']
+        fields = ['id','title', 'banner', 'banner_variants']
 
 
 class ProductImagesSerializer(serializers.ModelSerializer):
+    variants = ImageVariantsField('images')
+
     class Meta:
         model = ProductImages
-        fields = ['id', 'images']
+        fields = ['id', 'images', 'variants']
+
+
+class ProductTitleValidationMixin:
+    """The product title rules, shared by the product API and the catalog import."""
 
-class ProductSerializer(serializers.ModelSerializer):
+    def validate(self, data):
+        if 'name' in data and len(data['name']) < 6:
+            raise serializers.ValidationError('product title should be at least 6 characters')
+        return super().validate(data)
+
+
+class ProductSerializer(ProductTitleValidationMixin, serializers.ModelSerializer):
     title = serializers.CharField(max_length=255, source='name')
     price = serializers.DecimalField(max_digits=255, decimal_places=2, source='unit_price')
     images = ProductImagesSerializer(many=True, read_only=True)
+    cover_variants = ImageVariantsField('cover')
    
     
     class Meta:
         model = Product
-        fields = ['id', 'title', 'price', 'inventory', 'description', 'cover', 'images']
+        fields = ['id', 'title', 'price', 'inventory', 'description', 'cover', 'cover_variants', 'images']
 
   
 
-
-
-    #extra validation for is_valid method
-    def validate(self, data):
-        if  len(data['name']) < 6:
-            raise serializers.ValidationError('product title should be at least 6 characters')
-        return data
-
     def create(self, validated_data):
         product = Product(**validated_data)
         product.slug = slugify(product.name)
@@ -46,6 +88,19 @@ class ProductSerializer(serializers.ModelSerializer):
     
 
 
+class ProductImportSerializer(ProductTitleValidationMixin, serializers.ModelSerializer):
+    """One row of a bulk catalog import (store/catalog.py): a new product, or an update if it has an id."""
+    id = serializers.IntegerField(required=False)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'slug', 'description', 'unit_price', 'inventory']
+        extra_kwargs = {
+            'slug': {'required': False, 'allow_blank': True},
+            'description': {'required': False, 'allow_blank': True},
+        }
+
+
 class CartProductSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -58,6 +113,12 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['quantity']
 
+    def update(self, instance, validated_data):
+        cart_item = carts.get_cart_store().update(instance.cart_id, instance.id, validated_data['quantity'])
+        if cart_item is None:
+            raise NotFound()
+        return cart_item
+
 
 
 class AddCartItemSerializer(serializers.ModelSerializer):
@@ -72,18 +133,51 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         product = validated_data.get('product')
         quantity = validated_data.get('quantity')
 
-        try:
-            cart_item =CartItem.objects.get(cart_id=cart_id, product_id=product.id)
-            cart_item.quantity += quantity
-            cart_item.save()
-
-        except CartItem.DoesNotExist:
-            cart_item = CartItem.objects.create(cart_id=cart_id, **validated_data)
+        cart_item = carts.get_cart_store().add(cart_id, product.id, quantity)
+        if cart_item is None:
+            raise NotFound('There is no cart with this cart id')
+        cart_item.product = product
 
         self.instance = cart_item
         return cart_item         
 
 
+class CartItemOperationSerializer(serializers.Serializer):
+    OPERATION_SET = carts.OPERATION_SET
+    OPERATION_ADD = carts.OPERATION_ADD
+    OPERATION_REMOVE = carts.OPERATION_REMOVE
+
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, max_value=32767, default=0)
+    op = serializers.ChoiceField(choices=[OPERATION_SET, OPERATION_ADD, OPERATION_REMOVE], default=OPERATION_SET)
+
+
+class BulkCartItemSerializer(serializers.Serializer):
+    """
+    Apply a list of set/add/remove operations to one cart through the cart
+    store: products are checked with one IN query, and the database store
+    writes the lines that are set or removed with one bulk insert, one bulk
+    update and one delete, then adds to the others with one upsert.
+    """
+    items = CartItemOperationSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        product_ids = {item['product'] for item in items}
+        existing_ids = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        missing_ids = product_ids - existing_ids
+        if missing_ids:
+            raise serializers.ValidationError(
+                f'There is no product with id {", ".join(str(pk) for pk in sorted(missing_ids))}'
+            )
+        return items
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_pk']
+        if not carts.get_cart_store().apply(cart_id, self.validated_data['items']):
+            raise NotFound('There is no cart with this cart id')
+        return cart_id
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     product = CartProductSerializer()
     item_total = serializers.SerializerMethodField()
@@ -148,7 +242,7 @@ class OrderSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Order
-        fields = ['id', 'customer', 'status', 'datetime_created', 'items' ]
+        fields = ['id', 'customer', 'status', 'datetime_created', 'items_count', 'total_price', 'items' ]
 
 
 
@@ -159,7 +253,7 @@ class OrderForAdminSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Order
-        fields = ['id', 'customer', 'status', 'datetime_created', 'items' ]
+        fields = ['id', 'customer', 'status', 'datetime_created', 'items_count', 'total_price', 'items' ]
 
 
 class OrderUpdateSerializer(serializers.ModelSerializer):
@@ -167,45 +261,117 @@ class OrderUpdateSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['status']         
 
+    def update(self, instance, validated_data):
+        status = validated_data.get('status', instance.status)
+        items = dict(instance.items.values_list('product_id', 'quantity'))
+        try:
+            return inventory.update_order_status(instance, status)
+        except inventory.InsufficientInventory:
+            raise serializers.ValidationError({'status': inventory.describe_shortages(items)})
+        except inventory.StaleOrderStatus:
+            raise serializers.ValidationError({'status': 'The order status was changed by someone else, please retry'})
+
 
 class OrderCreateSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
           
+         cart_items = carts.get_cart_store().items(cart_id)
 
-         if not Cart.objects.filter(id=cart_id).exists():
+         if cart_items is None:
             raise serializers.ValidationError('There is no cart with this cart id')
 
-         if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+         if len(cart_items) == 0:
              raise serializers.ValidationError('Your cart is empty, please add some products')
          return cart_id
     
     def save(self, **kwargs):
-        with transaction.atomic():
-            cart_id = self.validated_data['cart_id']
-            user_id = self.context['user_id']
-            customer = Customer.objects.get(user_id=user_id)
+        cart_id = self.validated_data['cart_id']
+        user_id = self.context['user_id']
+        cart_store = carts.get_cart_store()
+        cart_items = carts.with_products(cart_store.items(cart_id) or [])
+        if not cart_items:
+            raise serializers.ValidationError({'cart_id': 'Your cart is empty, please add some products'})
+        quantities = {}
+        checked_out = False
+        customer = Customer.objects.get(user_id=user_id)
 
-            order = Order()
-            order.customer = customer
-            order.save()
+        try:
+            # Writes first: on SQLite a transaction that has read cannot take the
+            # write lock while another checkout holds it ("database is locked").
+            with transaction.atomic():
+                order = Order()
+                order.customer = customer
+
+                order_items = [
+                    OrderItem(
+                        order=order,
+                        product=cart_item.product,
+                        unit_price=cart_item.product.unit_price,
+                        quantity=cart_item.quantity,
+                    ) for cart_item in cart_items
+                ]
+                quantities = {item.product.id: item.quantity for item in order_items}
+
+                order.items_count = len(order_items)
+                order.total_price = sum(item.get_cost() for item in order_items)
+                order.save()
+
+                inventory.reserve(quantities)
+                OrderItem.objects.bulk_create(order_items)   
+
+                cart_store.checkout(cart_id)
+                checked_out = True
+                # The order_created receivers run in `manage.py drain_outbox`;
+                # the metric is counted here, in the process /metrics scrapes.
+                outbox.enqueue(outbox.ORDER_CREATED, order_id=order.id)
+                transaction.on_commit(ORDERS_CREATED.inc)
+
+                return order
+
+        except inventory.InsufficientInventory:
+            shortages = inventory.describe_shortages(quantities)
+            raise serializers.ValidationError({'items': shortages or 'Some products in your cart just ran out of stock'})
+        except carts.CartNotFound:
+            raise serializers.ValidationError({'cart_id': 'There is no cart with this cart id'})
+        except Exception:
+            # Rolled back after the cart was claimed: let a retry claim it again.
+            if checked_out:
+                cart_store.release_checkout(cart_id)
+            raise
+
+
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    """The period of a sales report, the last 30 days by default."""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    order_by = serializers.ChoiceField(choices=['revenue', 'quantity'], default='revenue')
 
-            cart_items = CartItem.objects.select_related('product').filter(cart_id=cart_id)
+    def validate(self, data):
+        data['start'], data['end'] = sales.get_period(data.get('start'), data.get('end'))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError({'start': 'The period must start before it ends'})
+        return data
 
-            order_items = [
-                OrderItem(
-                    order=order,
-                    product=cart_item.product,
-                    unit_price=cart_item.product.unit_price,
-                    quantity=cart_item.quantity,
-                ) for cart_item in cart_items
-            ]
 
+class DailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = ['date', 'orders_count', 'items_sold', 'revenue']
 
-            OrderItem.objects.bulk_create(order_items)   
 
-            Cart.objects.get(id=cart_id).delete()
+class SalesTotalsSerializer(serializers.Serializer):
+    orders_count = serializers.IntegerField()
+    items_sold = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
 
-            return order
 
+class TopProductSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    name = serializers.CharField()
+    orders_count = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
@@ -1,9 +1,55 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.conf import settings
-from store.models import Customer
+from store import database, images
+from store.cache import catalog_cache
+from store.models import BannerImage, Customer, OrderItem, Product, ProductImages
+from store.search import get_search_backend
+
+@receiver(connection_created)
+def configure_database_connection(sender, connection, **kwargs):
+    database.configure_connection(connection)
+
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_profile_for_newly_created_user(sender, instance, created, **kwargs):
     if created:
-        Customer.objects.create(user=instance)
\ No newline at end of file
+        Customer.objects.create(user=instance)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImages)
+def invalidate_product_catalog_cache(sender, **kwargs):
+    # Once committed: a request rendering before that would cache the old
+    # rows under the new generation.
+    transaction.on_commit(lambda: catalog_cache.invalidate('product'))
+
+
+@receiver([post_save, post_delete], sender=BannerImage)
+def invalidate_banner_catalog_cache(sender, **kwargs):
+    transaction.on_commit(lambda: catalog_cache.invalidate('banner'))
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, **kwargs):
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def update_order_totals(sender, instance, **kwargs):
+    instance.order.update_totals()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImages)
+@receiver(post_save, sender=BannerImage)
+def generate_image_variants(sender, instance, **kwargs):
+    if images.needs_variants(instance):
+        images.generate_variants(instance)
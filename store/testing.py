@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS
+from django.test import override_settings
+
+from store.database import replicate_sqlite
+from store.queries import QueryTracker
+
+
+class QueryBudgetTestMixin:
+    """
+    Assertions for `TestCase`s that keep an eye on query counts: a hard budget
+    per block or route, and no query shape repeated `repeat_threshold` times
+    (one query per row, the N+1 signature).
+    """
+    repeat_threshold = 3
+
+    @contextmanager
+    def assertQueryBudget(self, budget, repeat_threshold=None):
+        repeat_threshold = repeat_threshold or self.repeat_threshold
+        with QueryTracker() as tracker:
+            yield tracker
+
+        queries = '\n'.join(f'  {sql}' for sql, _ in tracker.queries)
+        self.assertLessEqual(
+            tracker.count, budget,
+            f'{tracker.count} queries ran, the budget is {budget}:\n{queries}',
+        )
+        repeated = tracker.repeated_shapes(repeat_threshold)
+        self.assertFalse(
+            repeated,
+            'Repeated query shapes (possible N+1):\n' + '\n'.join(f'  {count}x {shape}' for shape, count in repeated),
+        )
+
+    def assertRouteQueryBudget(self, url, budget, method='get', data=None, repeat_threshold=None, **extra):
+        """Request `url` with `self.client` within the budget and return the response."""
+        with self.assertQueryBudget(budget, repeat_threshold):
+            response = getattr(self.client, method)(url, data, format='json', **extra)
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+
+class SQLiteReplicaTestMixin:
+    """
+    Route the safe requests of a `TransactionTestCase` to the `replica` test
+    database (a second SQLite file), which only changes when the test calls
+    `replicate()`. List it in `databases`.
+    """
+    replica_alias = 'replica'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.enterClassContext(override_settings(DATABASE_REPLICAS=[cls.replica_alias]))
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        self.replicate()
+
+    def replicate(self):
+        replicate_sqlite(DEFAULT_DB_ALIAS, self.replica_alias)
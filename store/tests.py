@@ -1,3 +1,1670 @@
-from django.test import TestCase
+import asyncio
+import csv
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from urllib.parse import parse_qsl, urlsplit
+from unittest import skipUnless
+from unittest.mock import AsyncMock, patch
+from uuid import uuid4
 
-# Create your tests here.
+import orjson
+import requests
+from asgiref.sync import sync_to_async
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from prometheus_client import REGISTRY
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.models import CustomUser
+from store.asgi import LifespanApplication
+from store.cache import catalog_cache
+from store.fastpath import serialize_products
+from store import carts, catalog, images, inventory, outbox, payments, sales, views, zarinpal
+from store.models import (
+    Cart, CartItem, DailyProductSales, DailySales, Order, OrderItem, OutboxEvent, Product, ProductImages,
+)
+from store.queries import QueryTracker, normalize_sql
+from store.queryplans import find_full_scans, get_hot_queries
+from store.renders import CustomRenderer, FastCustomRenderer
+from store.routers import ReplicaRouter, get_sticky_cache
+from store.serializers import OrderCreateSerializer
+from store.search import get_search_backend, normalize_text
+from store.signals import order_created
+from store.testing import QueryBudgetTestMixin, SQLiteReplicaTestMixin
+from store.zarinpal_simulator import GatewaySimulator, Latency, make_server
+
+
+def create_product(**fields):
+    """The product the tests buy, with `fields` overriding its defaults."""
+    return Product.objects.create(**{
+        'name': 'Test product', 'slug': 'test-product', 'description': '', 'unit_price': Decimal('10.00'),
+        'inventory': 10, **fields,
+    })
+
+
+class CartItemUpsertTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.cart = Cart.objects.create()
+        self.product = create_product()
+        self.url = f'/store/carts/{self.cart.id}/items/'
+
+    def test_add_creates_then_increments_the_same_line(self):
+        first = self.client.post(self.url, {'product': self.product.id, 'quantity': 2}, format='json')
+        second = self.client.post(self.url, {'product': self.product.id, 'quantity': 3}, format='json')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(first.json()['data']['id'], second.json()['data']['id'])
+        self.assertEqual(second.json()['data'], {'id': first.json()['data']['id'], 'product': self.product.id, 'quantity': 5})
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 5)
+
+    def test_add_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            CartItem.objects.add_quantity(self.cart.id, self.product.id, 1)
+
+
+class CartItemUpsertConcurrencyTests(TransactionTestCase):
+    workers = 8
+    adds_per_worker = 25
+
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.product = create_product()
+
+    def add_items(self, _):
+        try:
+            for _ in range(self.adds_per_worker):
+                CartItem.objects.add_quantity(self.cart.id, self.product.id, 1)
+        finally:
+            connection.close()
+
+    def test_concurrent_adds_to_one_line_never_conflict(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self.add_items, range(self.workers)))
+
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, self.workers * self.adds_per_worker)
+
+    def apply_adds(self, _):
+        try:
+            for _ in range(self.adds_per_worker):
+                carts.DatabaseCartStore().apply(
+                    self.cart.id, [{'product': self.product.id, 'quantity': 1, 'op': carts.OPERATION_ADD}],
+                )
+        finally:
+            connection.close()
+
+    def test_concurrent_bulk_adds_add_up(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.apply_adds if index % 2 else self.add_items, index)
+                       for index in range(self.workers)]
+        for future in futures:
+            future.result()
+
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, self.workers * self.adds_per_worker)
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            create_product(name=f'Test product {index}', slug=f'test-product-{index}', unit_price=Decimal(index % 4))
+            for index in range(17)
+        ]
+        # Half of them created at the same instant: ties broken by id.
+        Product.objects.filter(id__in=[product.id for product in cls.products[::2]]) \
+                       .update(datetime_created=timezone.now() - timedelta(days=1))
+
+    def walk(self, url, link='next'):
+        ids, pages = [], 0
+        while url:
+            data = self.client.get(url).json()['data']
+            ids += [product['id'] for product in data['results']]
+            pages += 1
+            url = data[link]
+        return ids, pages, data
+
+    def expected(self, *ordering):
+        return list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+
+    def test_pages_follow_the_ordering_with_ties_broken_by_id(self):
+        ids, pages, _ = self.walk('/store/products/?page_size=5')
+        self.assertEqual(ids, self.expected('-datetime_created', '-id'))
+        self.assertEqual(pages, 4)
+
+        ids, pages, last = self.walk('/store/products/?page_size=5&ordering=unit_price')
+        self.assertEqual(ids, self.expected('unit_price', 'id'))
+        self.assertEqual(pages, 4)
+
+        # Back from the last page with the previous links: the same pages, last to first.
+        ids, _, _ = self.walk(last['previous'], link='previous')
+        forward = self.expected('unit_price', 'id')
+        self.assertEqual(ids, forward[10:15] + forward[5:10] + forward[:5])
+
+    def test_count_can_be_skipped(self):
+        data = self.client.get('/store/products/?page_size=5').json()['data']
+        self.assertEqual(data['count'], 17)
+        data = self.client.get('/store/products/?page_size=5&count=0').json()['data']
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 5)
+
+    def test_invalid_cursors_are_not_found(self):
+        next_link = self.client.get('/store/products/?page_size=5').json()['data']['next']
+        cursor = dict(parse_qsl(urlsplit(next_link).query))['cursor']
+        forged = [
+            'not base64!',
+            b64encode(b'p=abc&p=1').decode(),
+            b64encode(b'o=-datetime_created,-id&p=abc&p=1').decode(),
+            b64encode(b'o=-datetime_created,-id&p=2024-01-01T00:00:00&p=x').decode(),
+        ]
+        for value in forged:
+            with self.subTest(cursor=value):
+                self.assertEqual(self.client.get('/store/products/', {'cursor': value}).status_code, 404)
+
+        self.assertEqual(self.client.get('/store/products/', {'cursor': cursor, 'page_size': 5}).status_code, 200)
+        response = self.client.get('/store/products/', {'cursor': cursor, 'ordering': 'unit_price'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product()
+
+    def setUp(self):
+        caches['catalog'].clear()
+
+    def get_product(self):
+        response = self.client.get(f'/store/products/{self.product.id}/')
+        return response['X-Catalog-Cache'], response.json()['data']['title']
+
+    def test_responses_are_cached_until_a_product_change_commits(self):
+        self.assertEqual(self.get_product(), ('miss', 'Test product'))
+        self.assertEqual(self.get_product(), ('hit', 'Test product'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(id=self.product.id).update(name='Renamed')
+            Product.objects.get(id=self.product.id).save()
+            self.assertEqual(self.get_product(), ('hit', 'Test product'))
+        self.assertEqual(self.get_product(), ('miss', 'Renamed'))
+        self.assertEqual(self.get_product(), ('hit', 'Renamed'))
+
+    def test_concurrent_misses_render_once(self):
+        renders = []
+
+        def render():
+            renders.append(1)
+            time.sleep(0.2)
+            return 200, b'rendered', 'application/json'
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: catalog_cache.get_or_render('key', render), range(4)))
+
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(sorted(hit for _, hit in results), [False, True, True, True])
+        self.assertEqual({rendered for rendered, _ in results}, {(200, b'rendered', 'application/json')})
+
+    def test_a_miss_waits_for_the_worker_holding_the_lock(self):
+        caches['catalog'].add('key:lock', 1)
+        timer = threading.Timer(0.1, caches['catalog'].set, ['key', (200, b'other worker', 'application/json')])
+        timer.start()
+        self.addCleanup(timer.join)
+
+        rendered, hit = catalog_cache.get_or_render('key', lambda: self.fail('rendered while locked'))
+        self.assertEqual((rendered, hit), ((200, b'other worker', 'application/json'), True))
+
+class ImageVariantTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+
+    def upload(self, name, size=(800, 400), mode='RGBA'):
+        os.makedirs(os.path.join(self.media_root, os.path.dirname(name)), exist_ok=True)
+        Image.new(mode, size, (200, 0, 0, 128) if mode == 'RGBA' else (200, 0, 0)).save(os.path.join(self.media_root, name))
+        return name
+
+    def test_render_variants_resizes_every_variant(self):
+        variants = images.render_variants(self.media_root, self.upload('cover/photo.png'))
+
+        self.assertEqual(variants['source'], 'cover/photo.png')
+        self.assertEqual(set(variants) - {'source'}, set(images.VARIANT_SIZES))
+        for variant, (width, height) in images.VARIANT_SIZES.items():
+            for extension, files in variants[variant].items():
+                with Image.open(os.path.join(self.media_root, files)) as image:
+                    self.assertLessEqual(image.size, (width, height))
+                    self.assertEqual(image.size[0], min(800, width))
+                    self.assertEqual(image.mode, 'RGB' if extension == 'jpeg' else 'RGBA')
+
+    def test_images_with_the_same_stem_keep_their_own_variants(self):
+        jpeg = images.render_variants(self.media_root, self.upload('cover/photo.jpg', mode='RGB'))
+        png = images.render_variants(self.media_root, self.upload('cover/photo.png'))
+
+        jpeg_files = {name for variant in images.VARIANT_SIZES for name in jpeg[variant].values()}
+        png_files = {name for variant in images.VARIANT_SIZES for name in png[variant].values()}
+        self.assertFalse(jpeg_files & png_files)
+        self.assertTrue(all(os.path.exists(os.path.join(self.media_root, name)) for name in jpeg_files | png_files))
+
+    def test_save_variants_replaces_the_previous_variants(self):
+        product = create_product(cover=self.upload('cover/old.png'))
+        images.save_variants(Product, product.id, images.render_variants(self.media_root, 'cover/old.png'))
+        old_directory = os.path.join(self.media_root, 'cover', 'variants', 'old.png')
+        self.assertTrue(os.path.isdir(old_directory))
+
+        Product.objects.filter(id=product.id).update(cover=self.upload('cover/new.png'))
+        stale = images.render_variants(self.media_root, self.upload('cover/other.png'))
+        images.save_variants(Product, product.id, stale)
+        self.assertEqual(Product.objects.get(id=product.id).cover_variants['source'], 'cover/old.png')
+
+        generation = catalog_cache.get_generation('product')
+        images.save_variants(Product, product.id, images.render_variants(self.media_root, 'cover/new.png'))
+        self.assertEqual(Product.objects.get(id=product.id).cover_variants['source'], 'cover/new.png')
+        self.assertNotEqual(catalog_cache.get_generation('product'), generation)
+        self.assertFalse(os.path.exists(old_directory))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'cover', 'new.png')))
+
+    def test_saving_a_new_image_queues_its_variants_on_commit(self):
+        submit = self.enterContext(patch.object(images, 'submit'))
+        with self.captureOnCommitCallbacks(execute=True):
+            product = create_product(cover=self.upload('cover/photo.png'))
+            submit.assert_not_called()
+        self.assertEqual([call.args[0] for call in submit.call_args_list], ['cover/photo.png'])
+
+        Product.objects.filter(id=product.id).update(cover_variants={'source': 'cover/photo.png'})
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(id=product.id).save()
+        self.assertEqual(submit.call_count, 1)
+
+    def test_done_callbacks_close_their_thread_connections(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.enterContext(patch.object(images, '_executor', executor))
+        self.upload('cover/photo.png')
+        connections_used = []
+
+        def on_done(variants):
+            connections['default'].ensure_connection()
+            connections_used.append(connections['default'])
+
+        images.submit('cover/photo.png', on_done)
+        executor.shutdown(wait=True)
+
+        self.assertEqual(len(connections_used), 1)
+        self.assertIsNone(connections_used[0].connection)
+
+class InventoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product(inventory=5)
+        cls.other = create_product(name='Other product', slug='other-product', inventory=1)
+        cls.admin = CustomUser.objects.create_superuser('admin', password='secret-password')
+        cls.order = Order.objects.create(customer=cls.admin.customer)
+        OrderItem.objects.create(order=cls.order, product=cls.product, quantity=2, unit_price=Decimal('10.00'))
+        OrderItem.objects.create(order=cls.order, product=cls.other, quantity=1, unit_price=Decimal('10.00'))
+
+    def inventories(self):
+        return list(Product.objects.order_by('id').values_list('inventory', flat=True))
+
+    def test_reserve_takes_all_or_nothing(self):
+        inventory.reserve({self.product.id: 2, self.other.id: 1})
+        self.assertEqual(self.inventories(), [3, 0])
+
+        with self.assertRaises(inventory.InsufficientInventory), transaction.atomic():
+            inventory.reserve({self.product.id: 1, self.other.id: 1})
+        self.assertEqual(self.inventories(), [3, 0])
+        self.assertEqual(inventory.describe_shortages({self.product.id: 1, self.other.id: 1}),
+                         {str(self.other.id): 'Only 0 of "Other product" left in stock'})
+
+        inventory.release({self.product.id: 2, self.other.id: 1})
+        self.assertEqual(self.inventories(), [5, 1])
+
+    def test_stock_changes_invalidate_the_product_cache_on_commit(self):
+        generation = catalog_cache.get_generation('product')
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve({self.product.id: 1})
+            self.assertEqual(catalog_cache.get_generation('product'), generation)
+        self.assertNotEqual(catalog_cache.get_generation('product'), generation)
+
+        generation = catalog_cache.get_generation('product')
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.release({self.product.id: 1})
+        self.assertNotEqual(catalog_cache.get_generation('product'), generation)
+
+    def test_cancel_and_reopen_move_the_stock(self):
+        inventory.update_order_status(self.order, Order.ORDER_STATUS_CANCELED)
+        self.assertEqual(self.inventories(), [7, 2])
+        with self.assertRaises(inventory.StaleOrderStatus):
+            inventory.update_order_status(Order(pk=self.order.pk, status=Order.ORDER_STATUS_UNPAID),
+                                          Order.ORDER_STATUS_CANCELED)
+        self.assertEqual(self.inventories(), [7, 2])
+
+        inventory.update_order_status(self.order, Order.ORDER_STATUS_UNPAID)
+        self.assertEqual(self.inventories(), [5, 1])
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, Order.ORDER_STATUS_UNPAID)
+
+    def test_admin_reports_a_failed_status_change_and_saves_nothing(self):
+        inventory.update_order_status(self.order, Order.ORDER_STATUS_CANCELED)
+        Product.objects.filter(id=self.other.id).update(inventory=0)
+        self.client.force_login(self.admin)
+        url = reverse('admin:store_order_changelist')
+
+        response = self.client.post(url, {
+            'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '1',
+            'form-0-id': str(self.order.id), 'form-0-status': Order.ORDER_STATUS_UNPAID, '_save': 'Save',
+        }, follow=True)
+
+        messages = [str(message) for message in response.context['messages']]
+        self.assertEqual(len(messages), 1)
+        self.assertIn('Could not change the order status', messages[0])
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, Order.ORDER_STATUS_CANCELED)
+        self.assertEqual(self.inventories(), [7, 0])
+
+
+class InventoryConcurrencyTests(TransactionTestCase):
+    workers = 8
+
+    def setUp(self):
+        self.product = create_product(inventory=3)
+
+    def checkout(self, index):
+        try:
+            user = CustomUser.objects.create_user(f'customer-{index}', password='secret-password')
+            cart = Cart.objects.create()
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            serializer = OrderCreateSerializer(data={'cart_id': cart.id}, context={'user_id': user.id})
+            serializer.is_valid(raise_exception=True)
+            try:
+                return serializer.save()
+            except ValidationError as error:
+                return error.detail
+        finally:
+            connection.close()
+
+    def test_concurrent_checkouts_never_oversell_the_last_units(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.checkout, range(self.workers)))
+
+        orders = [result for result in results if isinstance(result, Order)]
+        self.assertEqual(len(orders), 3)
+        self.assertEqual(
+            [result for result in results if not isinstance(result, Order)],
+            [{'items': {str(self.product.id): 'Only 0 of "Test product" left in stock'}}] * (self.workers - 3),
+        )
+        self.assertEqual(Product.objects.get(id=self.product.id).inventory, 0)
+        self.assertEqual(OrderItem.objects.count(), 3)
+
+    def test_concurrent_cancels_release_the_stock_once(self):
+        user = CustomUser.objects.create_user('customer', password='secret-password')
+        order = Order.objects.create(customer=user.customer)
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, unit_price=Decimal('10.00'))
+
+        def cancel(_):
+            try:
+                inventory.update_order_status(Order.objects.get(pk=order.pk), Order.ORDER_STATUS_CANCELED)
+                return True
+            except inventory.StaleOrderStatus:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            canceled = list(executor.map(cancel, range(self.workers)))
+
+        self.assertEqual(Order.objects.get(pk=order.pk).status, Order.ORDER_STATUS_CANCELED)
+        self.assertIn(True, canceled)
+        self.assertEqual(Product.objects.get(id=self.product.id).inventory, 5)
+
+class OrderTotalsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('customer', password='secret-password')
+        cls.products = [
+            create_product(name=f'Test product {index}', slug=f'test-product-{index}', unit_price=Decimal(price))
+            for index, price in enumerate(['2.50', '10.00', '40.00'])
+        ]
+
+    def create_order(self, *quantities, **fields):
+        order = Order.objects.create(customer=self.user.customer, **fields)
+        for product, quantity in zip(self.products, quantities):
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, unit_price=product.unit_price)
+        return order
+
+    def totals(self, order):
+        order.refresh_from_db()
+        return order.items_count, order.total_price
+
+    def test_items_keep_the_totals_in_sync(self):
+        order = self.create_order(2, 1)
+        self.assertEqual(self.totals(order), (2, Decimal('15.00')))
+
+        item = order.items.get(product=self.products[0])
+        item.quantity = 4
+        item.save()
+        self.assertEqual(self.totals(order), (2, Decimal('20.00')))
+
+        item.delete()
+        self.assertEqual(self.totals(order), (1, Decimal('10.00')))
+        order.items.get().delete()
+        self.assertEqual(self.totals(order), (0, Decimal('0.00')))
+
+    def test_backfill_fixes_only_stale_orders(self):
+        orders = [self.create_order(1), self.create_order(1, 2, 3), self.create_order()]
+        Order.objects.filter(id__in=[orders[0].id, orders[1].id]).update(items_count=0, total_price=0)
+
+        out = StringIO()
+        call_command('backfill_order_totals', batch_size=1, stdout=out)
+
+        self.assertIn('Updated 2 orders', out.getvalue())
+        self.assertEqual([self.totals(order) for order in orders],
+                         [(1, Decimal('2.50')), (3, Decimal('142.50')), (0, Decimal('0.00'))])
+        self.assertEqual(Order.objects.annotate_totals().get(id=orders[1].id).computed_total_price, Decimal('142.50'))
+
+    def test_orders_can_be_filtered_and_ordered_by_their_totals(self):
+        small, large, empty = self.create_order(1), self.create_order(1, 2, 3), self.create_order()
+        paid = self.create_order(1, 1, status=Order.ORDER_STATUS_PAID)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        def ids(**params):
+            return [order['id'] for order in self.client.get('/store/orders/', params).json()['data']['results']]
+
+        self.assertEqual(ids(total_price__gt='5', ordering='total_price'), [paid.id, large.id])
+        self.assertEqual(ids(total_price__lt='5', ordering='total_price'), [empty.id, small.id])
+        self.assertEqual(ids(items_count__gt='1', status=Order.ORDER_STATUS_UNPAID), [large.id])
+        self.assertEqual(ids(items_count__lt='2', ordering='-items_count', status=Order.ORDER_STATUS_UNPAID),
+                         [small.id, empty.id])
+        self.assertEqual(ids(status=Order.ORDER_STATUS_PAID), [paid.id])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'The search index is an SQLite FTS5 table.')
+class SearchTests(TestCase):
+
+    def search(self, term, **params):
+        # The cache is only invalidated on commit, which a TestCase never does.
+        caches['catalog'].clear()
+        response = self.client.get('/store/products/', {'search': term, **params})
+        return [product['title'] for product in response.json()['data']['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        create_product(name='Grinder stand', slug='stand', description='<p>Holds a <b>coffee</b> grinder</p>')
+        create_product(name='Coffee grinder', slug='grinder', description='Burr grinder')
+        create_product(name='Milk jug', slug='jug', description='For milk')
+
+        self.assertEqual(self.search('coffee'), ['Coffee grinder', 'Grinder stand'])
+        self.assertEqual(self.search('coffee', ordering='-name'), ['Grinder stand', 'Coffee grinder'])
+        # Every word must match, the last one as a prefix; markup is not indexed.
+        self.assertEqual(self.search('grinder bu'), ['Coffee grinder'])
+        self.assertEqual(self.search('gr'), ['Coffee grinder', 'Grinder stand'])
+        self.assertEqual(self.search('p'), [])
+
+    def test_persian_and_arabic_spellings_match(self):
+        # Arabic kaf and yeh, a ZWNJ (\u200c) compound, Arabic-Indic and Persian digits, diacritics.
+        self.assertEqual(normalize_text('كتاب\u200cهاي ١٢۳'), 'کتابهای 123')
+        self.assertEqual(normalize_text('مُحَمّد'), 'محمد')
+        create_product(name='کتاب\u200cهای ۲۰۲۴', slug='books')
+
+        for term in ['كتابهاي', 'کتاب\u200cهای', 'كِتاب', '2024', '٢٠٢٤']:
+            with self.subTest(term=term):
+                self.assertEqual(len(self.search(term)), 1)
+
+    def test_saves_and_deletes_keep_the_index_in_sync(self):
+        product = create_product(name='Espresso machine', slug='espresso')
+        self.assertEqual(self.search('espresso'), ['Espresso machine'])
+
+        product.name = 'Filter machine'
+        product.save()
+        self.assertEqual(self.search('espresso'), [])
+        self.assertEqual(self.search('filter'), ['Filter machine'])
+
+        product.delete()
+        self.assertEqual(self.search('machine'), [])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM store_product_search')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_rebuild_catches_up_with_bulk_updates(self):
+        for index in range(3):
+            create_product(name=f'Kettle {index}', slug=f'kettle-{index}')
+        # Queryset updates bypass the signals that index products.
+        Product.objects.update(name='Teapot')
+        self.assertEqual(self.search('teapot'), [])
+
+        out = StringIO()
+        call_command('rebuild_search_index', batch_size=2, stdout=out)
+
+        self.assertIn('Indexed 3 products', out.getvalue())
+        self.assertEqual(self.search('teapot'), ['Teapot'] * 3)
+        self.assertEqual(self.search('kettle'), [])
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            create_product(name=f'Test product {index}', slug=f'test-product-{index}')
+            for index in range(12)
+        ]
+        ProductImages.objects.bulk_create([
+            ProductImages(product=product, images=f'product-images/{product.id}-{image}.png')
+            for product in cls.products for image in range(2)
+        ])
+
+        cls.cart = Cart.objects.create()
+        CartItem.objects.bulk_create([CartItem(cart=cls.cart, product=product, quantity=1) for product in cls.products[:6]])
+
+        cls.user = CustomUser.objects.create_user('customer', password='secret-password')
+        for _ in range(4):
+            order = Order.objects.create(customer=cls.user.customer)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, unit_price=product.unit_price)
+                for product in cls.products[:3]
+            ])
+
+    def setUp(self):
+        self.client = APIClient()
+        catalog_cache.invalidate('product')
+
+    def test_product_list_prefetches_images(self):
+        response = self.assertRouteQueryBudget('/store/products/', 3)
+        self.assertEqual(len(response.json()['data']['results'][0]['images']), 2)
+
+    def test_product_detail(self):
+        self.assertRouteQueryBudget(f'/store/products/{self.products[0].id}/', 2)
+
+    def test_cart_retrieve(self):
+        self.assertRouteQueryBudget(f'/store/carts/{self.cart.id}/', 2)
+
+    def test_order_list(self):
+        self.client.force_authenticate(self.user)
+        self.assertRouteQueryBudget('/store/orders/', 3)
+
+    def test_repeated_query_shapes_are_reported(self):
+        with self.assertRaisesMessage(AssertionError, 'possible N+1'):
+            with self.assertQueryBudget(50):
+                for product in Product.objects.all():
+                    list(product.images.all())
+
+    def test_budgets_are_per_method(self):
+        url = f'/store/carts/{self.cart.id}/'
+        with override_settings(QUERY_BUDGETS={'DELETE store:cart-detail': 0}):
+            with self.assertNoLogs('store.queries', 'WARNING'):
+                APIClient().get(url)
+        with override_settings(QUERY_BUDGETS={'GET store:cart-detail': 0}):
+            with self.assertLogs('store.queries', 'WARNING') as logs:
+                APIClient().get(url)
+        self.assertIn('GET store:cart-detail ran 2 queries (budget 0)', logs.output[0])
+
+    @override_settings(QUERY_BUDGET_HEADERS=True)
+    def test_middleware_reports_query_headers(self):
+        response = APIClient().get('/store/products/')
+        self.assertEqual(response['X-DB-Query-Count'], '3')
+        self.assertIn('X-DB-Query-Time', response)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE id = 1 AND name = 'a'"),
+            normalize_sql("SELECT * FROM t WHERE id = 22 AND name = 'b''c'"),
+        )
+        self.assertEqual(
+            normalize_sql('SELECT * FROM t WHERE id IN (%s, %s)'),
+            normalize_sql('SELECT * FROM t WHERE id IN (%s)'),
+        )
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        catalog_cache.invalidate('product')
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_are_labelled_by_view_and_action(self):
+        labels = {'view': 'ProductViewSet', 'action': 'list'}
+        requests_before = self.sample('store_requests_total', status='200', **labels)
+        queries_before = self.sample('store_request_db_queries_count', **labels)
+
+        self.client.get('/store/products/')
+
+        self.assertEqual(self.sample('store_requests_total', status='200', **labels), requests_before + 1)
+        self.assertEqual(self.sample('store_request_db_queries_count', **labels), queries_before + 1)
+        self.assertGreater(self.sample('store_request_duration_seconds_count', **labels), 0)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_metrics_endpoint_needs_the_token(self):
+        self.client.get('/store/products/')
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'store_request_duration_seconds_bucket{action="list",le="0.005",view="ProductViewSet"}',
+                      response.content)
+
+        # Behind a local reverse proxy every request comes from 127.0.0.1.
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+
+
+class FastPathTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(
+                name=f'محصول {index}', slug=f'product-{index}', description='<p>توضیحات</p>',
+                unit_price=Decimal('1234.5') / (index + 1), inventory=index,
+                cover=f'cover/{index}.jpeg' if index % 2 else '',
+                cover_variants={'source': f'cover/{index}.jpeg', 'thumbnail': {'webp': f'cover/variants/{index}/thumbnail.webp'}},
+            )
+            for index in range(15)
+        ]
+        ProductImages.objects.bulk_create([
+            ProductImages(product=product, images=f'product-images/{product.id} {image}.png',
+                          variants={'source': f'product-images/{product.id} {image}.png',
+                                    'medium': {'jpeg': f'product-images/variants/{product.id}/medium.jpeg'}})
+            for product in cls.products[::2] for image in range(2)
+        ])
+        cls.cart = Cart.objects.create()
+        for product in reversed(cls.products[:4]):
+            CartItem.objects.create(cart=cls.cart, product=product, quantity=product.id)
+        cls.empty_cart = Cart.objects.create()
+
+    def setUp(self):
+        self.client = APIClient(HTTP_ACCEPT='application/json')
+
+    def assertSameResponse(self, url, data=None):
+        with self.settings(READ_FAST_PATH=False):
+            catalog_cache.invalidate('product')
+            expected = self.client.get(url, data)
+        catalog_cache.invalidate('product')
+        response = self.client.get(url, data)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    def test_product_list_is_byte_identical(self):
+        response = self.assertSameResponse('/store/products/')
+        self.assertEqual(len(response.json()['data']['results']), 10)
+        next_url = response.json()['data']['next']
+        self.assertSameResponse(next_url)
+        self.assertSameResponse('/store/products/', {'ordering': '-unit_price', 'page_size': 4})
+        response = self.assertSameResponse('/store/products/', {'search': 'محصول', 'inventory__gt': 3})
+        self.assertEqual(response.json()['data']['count'], 11)
+
+    def test_cart_retrieve_is_byte_identical(self):
+        response = self.assertSameResponse(f'/store/carts/{self.cart.id}/')
+        self.assertEqual(len(response.json()['data']['items']), 4)
+        self.assertSameResponse(f'/store/carts/{self.empty_cart.id}/')
+        self.assertSameResponse('/store/carts/00000000-0000-0000-0000-000000000000/')
+
+    def test_empty_page(self):
+        self.assertEqual(serialize_products([]), [])
+
+
+class RendererTests(TestCase):
+
+    def render(self, renderer_class, data, status_code=200):
+        return renderer_class().render(data, 'application/json', {'response': Response(status=status_code)})
+
+    def assertSameContent(self, data, status_code=200):
+        expected = self.render(CustomRenderer, data, status_code)
+        self.assertEqual(self.render(FastCustomRenderer, data, status_code), expected)
+        return expected
+
+    def test_output_is_byte_identical(self):
+        self.assertSameContent({
+            'price': Decimal('12.50'),
+            'created': datetime(2024, 3, 1, 8, 30, 15, 123456, tzinfo=timezone.get_fixed_timezone(0)),
+            'tehran': datetime(2024, 3, 1, 12, 0, tzinfo=timezone.get_fixed_timezone(210)),
+            'naive': datetime(2024, 3, 1, 8, 30),
+            'day': date(2024, 3, 1),
+            'id': uuid4(),
+            'title': gettext_lazy('Product'),
+            'text': 'محصول   "quoted"',
+            'nested': [{'ids': (1, 2), 'empty': {}, 'flags': [True, False, None]}, []],
+            'floats': [0.5, 2.0, -0.0, 123456789.123],
+            1: 'int key',
+        })
+        self.assertSameContent([Decimal('0.1'), {'detail': 'list'}])
+        self.assertSameContent({'title': ['This field is required.']}, status_code=400)
+        self.assertSameContent({'detail': 'Not found.'}, status_code=404)
+
+    def test_floats_differ_only_in_notation(self):
+        data = {'small': 1e-05, 'large': 1e16}
+        expected, content = self.render(CustomRenderer, data), self.render(FastCustomRenderer, data)
+
+        self.assertIn(b'"small":1e-05,"large":1e+16', expected)
+        self.assertIn(b'"small":0.00001,"large":1e16', content)
+        self.assertEqual(orjson.loads(content), orjson.loads(expected))
+
+    def test_non_finite_floats_are_rendered_as_null(self):
+        for value in [float('nan'), float('inf'), Decimal('NaN')]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    self.render(CustomRenderer, {'value': value})
+                self.assertEqual(orjson.loads(self.render(FastCustomRenderer, {'value': value}))['data'],
+                                 {'value': None})
+
+
+class CartStoreTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            create_product(name=f'Test product {index}', slug=f'test-product-{index}', unit_price=Decimal('10.50'))
+            for index in range(3)
+        ]
+        cls.user = CustomUser.objects.create_user('customer', password='secret-password')
+
+    def setUp(self):
+        caches['carts'].clear()
+        self.client = APIClient()
+        self.cart_id = self.client.post('/store/carts/').json()['data']['id']
+        self.url = f'/store/carts/{self.cart_id}/'
+
+    def test_cart_operations(self):
+        first = self.client.post(f'{self.url}items/', {'product': self.products[0].id, 'quantity': 2}, format='json')
+        second = self.client.post(f'{self.url}items/', {'product': self.products[0].id, 'quantity': 3}, format='json')
+        self.assertEqual(second.json()['data'], {'id': first.json()['data']['id'], 'product': self.products[0].id, 'quantity': 5})
+
+        item_id = self.client.post(f'{self.url}items/', {'product': self.products[1].id, 'quantity': 1},
+                                   format='json').json()['data']['id']
+        response = self.client.patch(f'{self.url}items/{item_id}/', {'quantity': 4}, format='json')
+        self.assertEqual(response.json()['data'], {'quantity': 4})
+
+        response = self.client.get(f'{self.url}items/')
+        self.assertEqual([item['quantity'] for item in response.json()['data']['results']], [5, 4])
+
+        self.assertEqual(self.client.delete(f'{self.url}items/{item_id}/').status_code, 204)
+        self.assertEqual(self.client.get(f'{self.url}items/{item_id}/').status_code, 404)
+
+        cart = self.client.get(self.url).json()['data']
+        self.assertEqual(cart['id'], self.cart_id)
+        self.assertEqual(cart['total_price'], 52.5)
+
+    def test_bulk(self):
+        response = self.client.post(f'{self.url}items/bulk/', [
+            {'product': self.products[0].id, 'quantity': 2},
+            {'product': self.products[1].id, 'quantity': 1, 'op': 'add'},
+            {'product': self.products[1].id, 'quantity': 1, 'op': 'add'},
+            {'product': self.products[2].id, 'quantity': 1},
+            {'product': self.products[2].id, 'op': 'remove'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['product']['id'], item['quantity']) for item in response.json()['data']['items']],
+                         [(self.products[0].id, 2), (self.products[1].id, 2)])
+
+    def bulk(self, operations):
+        return self.client.post(f'{self.url}items/bulk/', operations, format='json')
+
+    def quantities(self):
+        return {item.product_id: item.quantity for item in carts.get_cart_store().items(self.cart_id)}
+
+    def test_bulk_operations_apply_in_order_to_the_existing_lines(self):
+        first, second, third = (product.id for product in self.products)
+        self.bulk([{'product': first, 'quantity': 5}, {'product': second, 'quantity': 1}])
+
+        response = self.client.post(f'{self.url}items/bulk/', {'items': [
+            {'product': first, 'quantity': 2, 'op': 'add'},
+            {'product': second, 'quantity': 0},
+            {'product': third, 'op': 'remove'},
+            {'product': third, 'quantity': 3, 'op': 'add'},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {first: 7, third: 3})
+        self.assertEqual(response.json()['data']['total_price'], 105.0)
+
+        self.bulk([{'product': first, 'op': 'remove'}, {'product': third, 'quantity': 1}])
+        self.assertEqual(self.quantities(), {third: 1})
+
+    def test_invalid_bulk_requests_change_nothing(self):
+        self.bulk([{'product': self.products[0].id, 'quantity': 2}])
+        valid = {'product': self.products[1].id, 'quantity': 1}
+
+        for operations in [
+            [],
+            [valid, {'product': 999999, 'quantity': 1}],
+            [valid, {'product': self.products[2].id, 'quantity': -1}],
+            [valid, {'product': self.products[2].id, 'quantity': 40000}],
+            [valid, {'product': self.products[2].id, 'quantity': 1, 'op': 'multiply'}],
+            [valid, {'quantity': 1}],
+        ]:
+            with self.subTest(operations=operations):
+                self.assertEqual(self.bulk(operations).status_code, 400)
+                self.assertEqual(self.quantities(), {self.products[0].id: 2})
+
+        response = self.bulk([valid, {'product': 999999, 'quantity': 1}])
+        self.assertIn('There is no product with id 999999', str(response.json()['message']))
+        url = '/store/carts/00000000-0000-0000-0000-000000000000/items/bulk/'
+        self.assertEqual(self.client.post(url, [valid], format='json').status_code, 404)
+
+    def test_a_failed_bulk_write_is_rolled_back(self):
+        if not carts.get_cart_store().models:
+            self.skipTest('Only the database store writes the lines one statement at a time.')
+        self.bulk([{'product': self.products[0].id, 'quantity': 2}])
+
+        operations = [{'product': self.products[0].id, 'quantity': 3, 'op': 'set'},
+                      {'product': self.products[1].id, 'quantity': 1, 'op': 'set'}]
+        with patch.object(CartItem.objects, 'bulk_update', side_effect=DatabaseError('disk I/O error')):
+            with self.assertRaises(DatabaseError):
+                carts.get_cart_store().apply(self.cart_id, operations)
+
+        self.assertEqual(self.quantities(), {self.products[0].id: 2})
+
+    def test_invalid_item_ids_are_not_found(self):
+        self.client.post(f'{self.url}items/', {'product': self.products[0].id, 'quantity': 2}, format='json')
+        self.assertEqual(self.client.delete(f'{self.url}items/abc/').status_code, 404)
+        self.assertEqual(self.client.patch(f'{self.url}items/abc/', {'quantity': 1}, format='json').status_code, 404)
+
+        cart_store = carts.get_cart_store()
+        self.assertIsNone(cart_store.update(self.cart_id, 'abc', 1))
+        self.assertFalse(cart_store.remove(self.cart_id, 'abc'))
+        self.assertEqual([item.quantity for item in cart_store.items(self.cart_id)], [2])
+
+    def test_unknown_cart(self):
+        url = '/store/carts/00000000-0000-0000-0000-000000000000/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.post(f'{url}items/', {'product': self.products[0].id, 'quantity': 1},
+                                          format='json').status_code, 404)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def test_checkout_materializes_the_order_and_drops_the_cart(self):
+        self.client.post(f'{self.url}items/', {'product': self.products[0].id, 'quantity': 2}, format='json')
+        self.client.force_authenticate(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/store/orders/', {'cart_id': self.cart_id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get()
+        self.assertEqual((order.items_count, order.total_price), (1, Decimal('21.00')))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(Product.objects.get(id=self.products[0].id).inventory, 8)
+
+    def test_a_failed_checkout_can_be_retried(self):
+        self.client.post(f'{self.url}items/', {'product': self.products[0].id, 'quantity': 2}, format='json')
+        self.client.force_authenticate(self.user)
+
+        with patch.object(outbox, 'enqueue', side_effect=DatabaseError('disk I/O error')):
+            with self.assertRaises(DatabaseError):
+                self.client.post('/store/orders/', {'cart_id': self.cart_id}, format='json')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(id=self.products[0].id).inventory, 10)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/store/orders/', {'cart_id': self.cart_id}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@override_settings(CART_STORE='store.carts.CacheCartStore')
+class CacheCartStoreTests(CartStoreTests):
+
+    def test_cart_operations_never_write_cart_rows(self):
+        self.client.post(f'{self.url}items/', {'product': self.products[0].id, 'quantity': 2}, format='json')
+        self.client.post(f'{self.url}items/bulk/', [{'product': self.products[1].id, 'quantity': 1}], format='json')
+
+        self.assertEqual(len(self.client.get(self.url).json()['data']['items']), 2)
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+
+class PurgeAbandonedCartsTests(TestCase):
+
+    def setUp(self):
+        product = create_product()
+        self.old_carts = [Cart.objects.create() for _ in range(5)]
+        self.new_cart = Cart.objects.create()
+        for cart in self.old_carts + [self.new_cart]:
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+        Cart.objects.filter(id__in=[cart.id for cart in self.old_carts]) \
+                    .update(created_at=timezone.now() - timedelta(days=40))
+
+    def test_purges_old_carts_in_batches(self):
+        out = StringIO()
+        call_command('purge_abandoned_carts', days=30, batch_size=2, pause=0, stdout=out)
+
+        self.assertIn('Deleted 5 carts and 5 items in 3 batches', out.getvalue())
+        self.assertEqual(list(Cart.objects.values_list('id', flat=True)), [self.new_cart.id])
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    def test_dry_run_and_max_batches(self):
+        out = StringIO()
+        call_command('purge_abandoned_carts', dry_run=True, stdout=out)
+        self.assertIn('5 carts (5 items)', out.getvalue())
+
+        call_command('purge_abandoned_carts', batch_size=2, max_batches=1, pause=0, stdout=StringIO())
+        self.assertEqual(Cart.objects.count(), 4)
+
+
+class QueryPlanTests(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in get_hot_queries().items():
+            with self.subTest(name):
+                self.assertEqual(find_full_scans(queryset), [])
+
+    def test_full_scans_are_detected(self):
+        self.assertEqual(find_full_scans(Order.objects.filter(zarinpal_ref_id='1')), ['store_order'])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('Every hot query uses an index.', out.getvalue())
+
+
+class DatabaseProfileTests(TestCase):
+
+    def test_sqlite_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            for name, expected in [('journal_mode', 'wal'), ('synchronous', 1), ('busy_timeout', 5000)]:
+                cursor.execute(f'PRAGMA {name}')
+                self.assertEqual(cursor.fetchone()[0], expected)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'The stand-in replication copies SQLite files.')
+class ReplicaRoutingTests(SQLiteReplicaTestMixin, TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        get_sticky_cache().clear()
+        self.client = APIClient()
+        self.product = create_product()
+
+    def test_connection_setup_is_not_counted_against_requests(self):
+        cart = Cart.objects.create()
+        self.replicate()
+        connections['replica'].close()
+        with QueryTracker() as tracker:
+            self.assertEqual(self.client.get(f'/store/carts/{cart.id}/').status_code, 200)
+        self.assertTrue(all(not sql.startswith('PRAGMA') for sql, _ in tracker.queries))
+        with connections['replica'].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    def test_only_requests_read_from_the_replica(self):
+        self.assertEqual(ReplicaRouter().db_for_read(Product), 'default')
+        self.assertEqual(ReplicaRouter().db_for_write(Product), 'default')
+
+        cart = Cart.objects.create()
+        self.assertEqual(self.client.get(f'/store/carts/{cart.id}/').status_code, 404)
+        self.replicate()
+        self.assertEqual(self.client.get(f'/store/carts/{cart.id}/').status_code, 200)
+
+    def test_carts_stick_to_the_primary_after_a_write(self):
+        cart_id = self.client.post('/store/carts/').json()['data']['id']
+        self.assertEqual(self.client.get(f'/store/carts/{cart_id}/').status_code, 200)
+        self.client.post(f'/store/carts/{cart_id}/items/', {'product': self.product.id, 'quantity': 2}, format='json')
+
+        response = self.client.get(f'/store/carts/{cart_id}/items/')
+        self.assertEqual([item['quantity'] for item in response.json()['data']['results']], [2])
+
+        # Once the window is over, reads go back to the (stale) replica.
+        get_sticky_cache().clear()
+        self.assertEqual(self.client.get(f'/store/carts/{cart_id}/').status_code, 404)
+
+    def test_users_stick_to_the_primary_after_a_write(self):
+        user = CustomUser.objects.create_user('customer', password='secret-password')
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        self.replicate()
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {RefreshToken.for_user(user).access_token}')
+
+        self.assertEqual(self.client.post('/store/orders/', {'cart_id': str(cart.id)}, format='json').status_code, 200)
+        self.assertEqual(self.client.get('/store/orders/').json()['data']['count'], 1)
+
+        get_sticky_cache().clear()
+        self.assertEqual(self.client.get('/store/orders/').json()['data']['count'], 0)
+
+    def test_catalog_cache_entries_are_rendered_from_the_primary(self):
+        caches['catalog'].clear()
+        admin = CustomUser.objects.create_user('admin', password='secret-password', is_staff=True)
+        self.replicate()
+        self.client.force_authenticate(admin)
+        response = self.client.patch(f'/store/products/{self.product.id}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        # Another client, not sticky, while the replica still has the old name.
+        other = APIClient()
+        self.assertEqual(Product.objects.using('replica').get(id=self.product.id).name, 'Test product')
+        response = other.get(f'/store/products/{self.product.id}/')
+        self.assertEqual((response['X-Catalog-Cache'], response.json()['data']['title']), ('miss', 'Renamed'))
+        response = other.get(f'/store/products/{self.product.id}/')
+        self.assertEqual((response['X-Catalog-Cache'], response.json()['data']['title']), ('hit', 'Renamed'))
+
+    def test_catalog_cache_misses_read_the_replica_outside_the_sticky_window(self):
+        caches['catalog'].clear()
+        self.replicate()
+        # A primary-only change the replica has not received yet.
+        Product.objects.filter(id=self.product.id).update(name='Renamed')
+
+        def get_title():
+            response = self.client.get(f'/store/products/{self.product.id}/')
+            return response['X-Catalog-Cache'], response.json()['data']['title']
+
+        with override_settings(DATABASE_REPLICA_STICKY_SECONDS=0):
+            catalog_cache.invalidate('product')
+            self.assertEqual(get_title(), ('miss', 'Test product'))
+
+        catalog_cache.invalidate('product')
+        self.assertTrue(catalog_cache.recently_invalidated('product'))
+        self.assertEqual(get_title(), ('miss', 'Renamed'))
+
+
+class OutboxTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('customer', password='secret-password')
+        cls.product = create_product()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.received = []
+        order_created.connect(self.receive, dispatch_uid='outbox-test')
+        self.addCleanup(order_created.disconnect, dispatch_uid='outbox-test')
+
+    def receive(self, sender, order, **kwargs):
+        self.assertIs(sender, views.OrderViewSet)
+        self.received.append(order.id)
+
+    def create_order(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        response = self.client.post('/store/orders/', {'cart_id': str(cart.id)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']['id']
+
+    def test_checkout_only_saves_the_event(self):
+        order_id = self.create_order()
+
+        self.assertEqual(self.received, [])
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.event_type, event.payload, event.status),
+                         (outbox.ORDER_CREATED, {'order_id': order_id}, OutboxEvent.STATUS_PENDING))
+
+        out = StringIO()
+        call_command('drain_outbox', stdout=out)
+        self.assertEqual(self.received, [order_id])
+        self.assertIn('Dispatched 1 events', out.getvalue())
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.STATUS_DONE, 1))
+        self.assertEqual(outbox.process_batch(), (0, 0))
+
+    def test_orders_are_counted_when_the_checkout_commits(self):
+        before = REGISTRY.get_sample_value('store_orders_created_total') or 0
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.create_order()
+        self.assertEqual(REGISTRY.get_sample_value('store_orders_created_total') or 0, before)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(REGISTRY.get_sample_value('store_orders_created_total'), before + 1)
+
+        # Not a second time when the worker dispatches the event.
+        outbox.process_batch()
+        self.assertEqual(REGISTRY.get_sample_value('store_orders_created_total'), before + 1)
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_BACKOFF=0)
+    def test_failed_events_are_retried_then_given_up(self):
+        def fail(sender, **kwargs):
+            raise RuntimeError('downstream is down')
+
+        order_created.connect(fail, dispatch_uid='outbox-test-failure')
+        self.addCleanup(order_created.disconnect, dispatch_uid='outbox-test-failure')
+        order_id = self.create_order()
+
+        with self.assertLogs('store.outbox', 'WARNING'):
+            self.assertEqual(outbox.process_batch(), (0, 1))
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.STATUS_PENDING, 1))
+        self.assertIn('downstream is down', event.last_error)
+
+        with self.assertLogs('store.outbox', 'WARNING'):
+            self.assertEqual(outbox.process_batch(), (0, 1))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.STATUS_FAILED, 2))
+        self.assertEqual(self.received, [order_id, order_id])
+        self.assertEqual(outbox.process_batch(), (0, 0))
+
+    def test_claimed_events_are_not_claimed_twice(self):
+        self.create_order()
+        self.create_order()
+
+        self.assertEqual(len(outbox.claim(batch_size=1)), 1)
+        self.assertEqual(len(outbox.claim(batch_size=10)), 1)
+        self.assertEqual(outbox.claim(batch_size=10), [])
+
+
+class StubGateway:
+    """Answers verifications from `answers` ({authority: data or exception}) like `ZarinpalClient`."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def verify_payment(self, amount, authority):
+        self.calls.append((amount, authority))
+        answer = self.answers[authority]
+        if isinstance(answer, Exception):
+            raise answer
+        return zarinpal.GatewayResponse(answer, 0.0)
+
+
+class PaymentReconciliationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = CustomUser.objects.create_user('customer', password='secret-password').customer
+        cls.orders = {
+            authority: Order.objects.create(customer=customer, zarinpal_authority=authority, total_price=Decimal('25.00'))
+            for authority in ['A-paid', 'A-verified', 'A-canceled', 'A-down']
+        }
+        Order.objects.create(customer=customer, total_price=Decimal('5.00'))
+        Order.objects.update(datetime_created=timezone.now() - timedelta(hours=1))
+
+    def test_reconcile(self):
+        gateway = StubGateway({
+            'A-paid': {'Status': 100, 'RefID': 1234},
+            'A-verified': {'Status': 101, 'RefID': 5678},
+            'A-canceled': {'Status': -21, 'errors': {'code': -21, 'message': 'canceled'}},
+            'A-down': zarinpal.ZarinpalError('timeout'),
+        })
+        rows = [(order.id, authority, 25) for authority, order in self.orders.items()]
+
+        outcomes = {order_id: outcome for order_id, outcome, _ in payments.reconcile(rows, gateway, workers=4)}
+
+        self.assertEqual(outcomes, {
+            self.orders['A-paid'].id: payments.OUTCOME_PAID,
+            self.orders['A-verified'].id: payments.OUTCOME_PAID,
+            self.orders['A-canceled'].id: payments.OUTCOME_NOT_PAID,
+            self.orders['A-down'].id: payments.OUTCOME_GATEWAY_ERROR,
+        })
+        self.assertEqual(sorted(gateway.calls), sorted((25, authority) for authority in self.orders))
+        paid = Order.objects.get(id=self.orders['A-paid'].id)
+        self.assertEqual((paid.status, paid.zarinpal_ref_id), (Order.ORDER_STATUS_PAID, '1234'))
+        self.assertEqual(Order.unpaid_orders.exclude(zarinpal_authority='').count(), 2)
+
+        # A second run (or the verify page) finds the orders already paid.
+        self.assertEqual([outcome for _, outcome, _ in payments.reconcile(rows[:1], gateway)],
+                         [payments.OUTCOME_ALREADY_PAID])
+
+    def test_rate_limit(self):
+        limiter = payments.RateLimiter(rate=100)
+        started = time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    def test_command_only_picks_orders_in_the_age_window(self):
+        Order.objects.filter(id=self.orders['A-down'].id).update(datetime_created=timezone.now())
+        out = StringIO()
+        call_command('reconcile_payments', '--dry-run', stdout=out)
+        self.assertIn('3 unpaid orders to verify', out.getvalue())
+
+
+class ZarinpalSimulatorTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.simulator = GatewaySimulator(seed=0)
+        cls.server = make_server(cls.simulator, port=0)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+        cls.enterClassContext(override_settings(ZARINPAL_BASE_URL=f'http://127.0.0.1:{cls.server.server_port}'))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('customer', password='secret-password')
+        cls.order = Order.objects.create(customer=cls.user.customer, total_price=Decimal('25.00'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.addCleanup(setattr, self.simulator, 'verify_outcomes', self.simulator.verify_outcomes)
+
+    def pay(self):
+        """Request the payment and follow StartPay back to the verify page, like the customer."""
+        response = self.client.get(f'/store/orders/{self.order.id}/pay/')
+        self.assertEqual(response.status_code, 302)
+        start_pay = requests.get(response['Location'], allow_redirects=False)
+        return self.client.get('/store/orders/verify?' + urlsplit(start_pay.headers['Location']).query)
+
+    def test_pay_and_verify(self):
+        response = self.pay()
+
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(id=self.order.id)
+        self.assertEqual(order.status, Order.ORDER_STATUS_PAID)
+        self.assertTrue(order.zarinpal_ref_id)
+
+        response = self.client.get(f'/store/orders/verify?Authority={order.zarinpal_authority}&Status=OK')
+        self.assertIn('already been registered', response.json()['data']['success'])
+
+    def test_failed_payment(self):
+        self.simulator.verify_outcomes = {-22: 1.0}
+
+        response = self.pay()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(id=self.order.id).status, Order.ORDER_STATUS_UNPAID)
+
+    def test_reconciliation_against_the_simulator(self):
+        authority = zarinpal.client.request_payment(amount=25, callback_url='http://testserver/').data['Authority']
+        Order.objects.filter(id=self.order.id).update(zarinpal_authority=authority)
+
+        out = StringIO()
+        call_command('reconcile_payments', '--min-age', '0', stdout=out)
+
+        self.assertIn('1 paid', out.getvalue())
+        self.assertEqual(Order.objects.get(id=self.order.id).status, Order.ORDER_STATUS_PAID)
+
+    async def async_get(self, view, path, data=None, token=True, **kwargs):
+        headers = {'Authorization': f'JWT {RefreshToken.for_user(self.user).access_token}'} if token else {}
+        request = AsyncRequestFactory().get(path, data, headers=headers)
+        request.session = SessionStore()
+        return await view.as_view()(request, **kwargs)
+
+    async def test_async_pay_and_verify(self):
+        response = await self.async_get(views.AsyncOrderPayView, '/store/orders/1/pay/', order_id=self.order.id)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('gateway;dur=', response['Server-Timing'])
+
+        start_pay = await sync_to_async(requests.get)(response['Location'], allow_redirects=False)
+        callback = dict(parse_qsl(urlsplit(start_pay.headers['Location']).query))
+        response = await self.async_get(views.AsyncOrderVerifyView, '/store/orders/verify', callback)
+        await zarinpal.async_client.aclose()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(orjson.loads(response.content)['data'],
+                         {'success': 'Your payment has been successfully completed!'})
+        order = await Order.objects.aget(id=self.order.id)
+        self.assertEqual(order.status, Order.ORDER_STATUS_PAID)
+
+    async def test_async_views_need_a_token(self):
+        response = await self.async_get(views.AsyncOrderPayView, '/store/orders/1/pay/', token=False,
+                                        order_id=self.order.id)
+        self.assertEqual(response.status_code, 401)
+        # The same envelope DRF answers with.
+        self.assertEqual(orjson.loads(response.content), orjson.loads((await self.async_client.get('/store/orders/')).content))
+
+        response = await self.async_get(views.AsyncOrderVerifyView, '/store/orders/verify', {'Authority': 'A-none'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_verify_reports_gateway_errors(self):
+        await Order.objects.filter(id=self.order.id).aupdate(zarinpal_authority='A-1')
+        answer = zarinpal.GatewayResponse({'Status': -9, 'errors': [{'code': -9}, {'code': -54}]}, 0.0)
+        with patch.object(zarinpal.async_client, 'verify_payment', AsyncMock(return_value=answer)):
+            response = await self.async_get(views.AsyncOrderVerifyView, '/store/orders/verify',
+                                            {'Authority': 'A-1', 'Status': 'OK'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(orjson.loads(response.content)['message'], 'The transaction was unsuccessful! -9, -54')
+
+    async def test_lifespan_shutdown_closes_the_gateway_session(self):
+        session = zarinpal.async_client.session
+        events, sent = asyncio.Queue(), []
+        for event in ('lifespan.startup', 'lifespan.shutdown'):
+            events.put_nowait({'type': event})
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await LifespanApplication(None)({'type': 'lifespan'}, events.get, send)
+
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(session.closed)
+        self.assertIsNot(zarinpal.async_client.session, session)
+        await zarinpal.async_client.aclose()
+
+    async def test_async_middleware(self):
+        response = await self.async_client.get('/store/products/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_errors_and_latency(self):
+        simulator = GatewaySimulator(error_rate=1.0, error_status=502)
+        self.assertEqual(simulator.handle('POST', zarinpal.ZP_API_REQUEST, b'{}')[0], 502)
+        self.assertEqual(simulator.handle('GET', '/elsewhere')[0], 404)
+
+        self.assertEqual(Latency('fixed:50').sample(simulator.rng), 0.05)
+        self.assertTrue(0.02 <= Latency('uniform:20:80').sample(simulator.rng) <= 0.08)
+        with self.assertRaises(ValueError):
+            Latency('gaussian:50')
+
+
+class ScriptedGateway(GatewaySimulator):
+    """The simulator, answering the next calls with the HTTP statuses of `script` first."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.script = []
+        self.calls = []
+
+    def handle(self, method, path, body=b''):
+        self.calls.append(path)
+        if self.script:
+            return self.script.pop(0), {'Content-Type': 'text/html'}, b'<h1>Bad gateway</h1>'
+        return super().handle(method, path, body)
+
+
+class ZarinpalClientTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gateway = ScriptedGateway(verify_latency='fixed:0')
+        cls.server = make_server(cls.gateway, port=0)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+        cls.enterClassContext(override_settings(ZARINPAL_BASE_URL=f'http://127.0.0.1:{cls.server.server_port}'))
+
+    def setUp(self):
+        self.client = zarinpal.ZarinpalClient(verify_retries=2, backoff=0, read_timeout=0.2)
+        self.authority = self.client.request_payment(amount=25, callback_url='http://testserver/').data['Authority']
+        self.gateway.calls.clear()
+        self.addCleanup(setattr, self.gateway, 'latency', dict(self.gateway.latency))
+
+    def test_verification_is_retried_on_server_errors(self):
+        self.gateway.script = [503, 502]
+        response = self.client.verify_payment(amount=25, authority=self.authority)
+        self.assertEqual(response.data['Status'], 100)
+        self.assertEqual(self.gateway.calls, [zarinpal.ZP_API_VERIFY] * 3)
+
+    def test_verification_gives_up_after_its_retries(self):
+        self.gateway.script = [503] * 3
+        with self.assertRaises(zarinpal.ZarinpalError):
+            self.client.verify_payment(amount=25, authority=self.authority)
+        self.assertEqual(len(self.gateway.calls), 3)
+
+    def test_payment_requests_are_not_retried(self):
+        self.gateway.script = [503]
+        with self.assertRaises(zarinpal.ZarinpalError):
+            self.client.request_payment(amount=25, callback_url='http://testserver/')
+        self.assertEqual(len(self.gateway.calls), 1)
+
+    def test_timeouts_and_connection_errors(self):
+        self.gateway.latency['verify'] = Latency('fixed:500')
+        started = time.monotonic()
+        with self.assertRaises(zarinpal.ZarinpalError):
+            self.client.verify_payment(amount=25, authority=self.authority)
+        self.assertEqual(len(self.gateway.calls), 3)
+        self.assertLess(time.monotonic() - started, 1.5)
+
+        with socket.socket() as closed:
+            closed.bind(('127.0.0.1', 0))
+            port = closed.getsockname()[1]
+        with override_settings(ZARINPAL_BASE_URL=f'http://127.0.0.1:{port}'), \
+             self.assertRaises(zarinpal.ZarinpalError):
+            self.client.verify_payment(amount=25, authority=self.authority)
+
+    def test_gateway_errors_are_described(self):
+        self.assertEqual(payments.describe_errors({'errors': {'code': -21, 'message': 'Canceled'}}), 'Canceled -21')
+        self.assertEqual(payments.describe_errors({'errors': [{'code': -9}, {'code': -11, 'message': 'Not found'}]}),
+                         '-9, Not found -11')
+        self.assertEqual(payments.describe_errors({'Status': -22}), '-22')
+
+    def test_verify_view_reports_gateway_errors(self):
+        user = CustomUser.objects.create_user('customer', password='secret-password')
+        Order.objects.create(customer=user.customer, total_price=Decimal('25.00'), zarinpal_authority='A-1')
+        client = APIClient()
+        client.force_authenticate(user)
+        for errors, message in [({'code': -9, 'message': 'Validation error'}, 'Validation error -9'),
+                                ([{'code': -9}, {'code': -54}], '-9, -54')]:
+            with self.subTest(errors=errors), patch.object(zarinpal.client, 'verify_payment',
+                                                           return_value=zarinpal.GatewayResponse({'Status': -9, 'errors': errors}, 0.0)):
+                response = client.get('/store/orders/verify', {'Authority': 'A-1', 'Status': 'OK'})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['message'], f'The transaction was unsuccessful! {message}')
+
+class SalesRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = CustomUser.objects.create_user('customer', password='secret-password').customer
+        cls.admin = CustomUser.objects.create_user('admin', password='secret-password', is_staff=True)
+        cls.products = [
+            create_product(name=f'Product {index}', slug=f'product-{index}', inventory=100) for index in range(3)
+        ]
+
+    def create_order(self, *items, days_ago=0):
+        order = Order.objects.create(customer=self.customer, zarinpal_authority=f'A-{Order.objects.count()}')
+        for product, quantity, unit_price in items:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, unit_price=Decimal(unit_price))
+        Order.objects.filter(id=order.id).update(datetime_created=timezone.now() - timedelta(days=days_ago))
+        order.refresh_from_db()
+        return order
+
+    def rollups(self):
+        return (
+            list(DailySales.objects.order_by('date').values_list('date', 'orders_count', 'items_sold', 'revenue')),
+            list(DailyProductSales.objects.order_by('date', 'product_id')
+                 .values_list('date', 'product_id', 'orders_count', 'quantity', 'revenue')),
+        )
+
+    def test_paid_orders_are_rolled_up_as_they_change_status(self):
+        first, second, third = self.products
+        today = timezone.localdate()
+        order = self.create_order((first, 2, '10.00'), (second, 1, '4.50'))
+        other = self.create_order((first, 1, '10.00'))
+        self.create_order((third, 5, '1.00'))
+
+        self.assertTrue(payments.mark_paid(order.id, order.zarinpal_authority, {'Status': 100, 'RefID': 1}))
+        self.assertFalse(payments.mark_paid(order.id, order.zarinpal_authority, {'Status': 100, 'RefID': 1}))
+        inventory.update_order_status(other, Order.ORDER_STATUS_PAID)
+
+        self.assertEqual(self.rollups(), (
+            [(today, 2, 4, Decimal('34.50'))],
+            [(today, first.id, 2, 3, Decimal('30.00')), (today, second.id, 1, 1, Decimal('4.50'))],
+        ))
+
+        inventory.update_order_status(Order.objects.get(id=order.id), Order.ORDER_STATUS_CANCELED)
+        self.assertEqual(self.rollups(), (
+            [(today, 1, 1, Decimal('10.00'))],
+            [(today, first.id, 1, 1, Decimal('10.00'))],
+        ))
+
+    def test_rebuild_matches_the_incremental_rollups(self):
+        first, second, third = self.products
+        for days_ago in range(3):
+            order = self.create_order((first, days_ago + 1, '10.00'), (third, 1, '2.25'), days_ago=days_ago)
+            payments.mark_paid(order.id, order.zarinpal_authority, {'Status': 100})
+        paid_then_canceled = self.create_order((second, 1, '3.00'))
+        inventory.update_order_status(paid_then_canceled, Order.ORDER_STATUS_PAID)
+        inventory.update_order_status(paid_then_canceled, Order.ORDER_STATUS_CANCELED)
+        self.create_order((second, 7, '3.00'))
+        incremental = self.rollups()
+
+        out = StringIO()
+        call_command('rebuild_sales_rollups', stdout=out)
+        self.assertIn('Rebuilt 3 days and 6 day/product rows', out.getvalue())
+        self.assertEqual(self.rollups(), incremental)
+
+        DailySales.objects.update(orders_count=0)
+        self.assertEqual(sales.rebuild(since=timezone.localdate() - timedelta(days=1)), (2, 4))
+        self.assertEqual(self.rollups()[0][1:], incremental[0][1:])
+
+    def test_report_endpoints_read_only_the_rollups(self):
+        first, second, _ = self.products
+        for product, quantity in [(first, 1), (second, 3), (first, 1)]:
+            order = self.create_order((product, quantity, '10.00'), days_ago=1)
+            payments.mark_paid(order.id, order.zarinpal_authority, {'Status': 100})
+        client = APIClient()
+        client.force_authenticate(self.admin)
+
+        with CaptureQueriesContext(connection) as queries:
+            report = client.get('/store/reports/sales/')
+            top = client.get('/store/reports/sales/top-products/', {'order_by': 'quantity', 'limit': 1})
+        self.assertFalse([query['sql'] for query in queries if 'store_order' in query['sql']])
+
+        self.assertEqual(report.status_code, 200)
+        data = report.json()['data']
+        self.assertEqual(data['totals'], {'orders_count': 3, 'items_sold': 5, 'revenue': 50.0})
+        self.assertEqual(len(data['days']), 1)
+        self.assertEqual(top.json()['data']['products'], [
+            {'product_id': second.id, 'name': second.name, 'orders_count': 1, 'quantity': 3, 'revenue': 30.0},
+        ])
+
+        today = timezone.localdate()
+        response = client.get('/store/reports/sales/', {'start': today.isoformat(), 'end': today.isoformat()})
+        self.assertEqual(response.json()['data']['totals']['orders_count'], 0)
+        response = client.get('/store/reports/sales/', {'start': today.isoformat(), 'end': '2000-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+        client.force_authenticate(CustomUser.objects.get(username='customer'))
+        self.assertEqual(client.get('/store/reports/sales/').status_code, 403)
+
+
+class CatalogImportExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', password='secret-password', is_staff=True)
+        cls.product = Product.objects.create(name='Old name', slug='old-name', description='Kept',
+                                             unit_price=Decimal('10.00'), inventory=5)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_import_creates_updates_and_reports_invalid_rows(self):
+        lines = [
+            '\ufeffid,name,unit_price,inventory',
+            f'{self.product.id},New name,12.50,7',
+            ',Espresso machine,99.90,3',
+            ',Café Grinder,15,1',
+            ',Bad price,not-a-number,1',
+            '999999,Missing,1,1',
+            ',Mug,5,1',
+        ]
+        lines = [f'{line}\r\n'.encode() for line in lines]
+        result = catalog.import_products(
+            catalog.read_rows(catalog.decode_lines(lines, catalog.CSV), catalog.CSV), chunk_size=2,
+        )
+
+        self.assertEqual((result.created, result.updated, result.invalid), (2, 1, 3))
+        self.assertEqual([error['row'] for error in result.errors], [4, 5, 6])
+        self.assertIn('unit_price', result.errors[0]['errors'])
+        self.assertEqual(result.errors[2]['errors']['non_field_errors'],
+                         ['product title should be at least 6 characters'])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.slug, self.product.description, self.product.unit_price,
+                          self.product.inventory), ('New name', 'old-name', 'Kept', Decimal('12.50'), 7))
+        self.assertEqual(set(Product.objects.exclude(id=self.product.id).values_list('slug', flat=True)),
+                         {'espresso-machine', 'cafe-grinder'})
+        found = get_search_backend().search(Product.objects.all(), 'Espresso')
+        self.assertEqual([product.name for product in found], ['Espresso machine'])
+
+    def test_export_then_import_round_trips(self):
+        Product.objects.create(name='Comma, "quoted"', slug='comma', description='Two\nlines',
+                               unit_price=Decimal('3.25'), inventory=0)
+        for file_format in catalog.FORMATS:
+            with self.subTest(file_format=file_format):
+                response = self.client.get(f'/store/products/export/{file_format}/')
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.streaming)
+                self.assertEqual(response['Content-Type'], catalog.CONTENT_TYPES[file_format])
+                content = b''.join(response.streaming_content)
+                before = list(Product.objects.order_by('id').values_list(*catalog.FIELDS))
+
+                response = self.client.post(f'/store/products/import/{file_format}/', content,
+                                            content_type=catalog.CONTENT_TYPES[file_format])
+                self.assertEqual(response.json()['data'],
+                                 {'created': 0, 'updated': 2, 'invalid': 0, 'complete': True, 'errors': []})
+                self.assertEqual(list(Product.objects.order_by('id').values_list(*catalog.FIELDS)), before)
+
+    def test_unparsable_json_lines_are_invalid_rows(self):
+        content = b'\n'.join([
+            orjson.dumps({'name': 'Grinder', 'unit_price': '40', 'inventory': 2}),
+            b'{"name": "Broken",',
+            b'[1, 2]',
+            orjson.dumps({'id': self.product.id, 'inventory': 0}),
+        ])
+        response = self.client.post('/store/products/import/jsonl/', content, content_type='application/jsonl')
+
+        data = response.json()['data']
+        self.assertEqual((response.status_code, data['created'], data['updated'], data['invalid'], data['complete']),
+                         (200, 1, 1, 2, True))
+        self.assertEqual([error['row'] for error in data['errors']], [2, 3])
+        self.assertIn('Invalid JSON', data['errors'][0]['errors']['non_field_errors'][0])
+
+    def test_unreadable_files_keep_the_rows_before_and_report_where_they_stopped(self):
+        content = 'name,unit_price,inventory\nGrinder,40,2\nKettle,12,1\n'.encode() + b'Bad \xff,1,1\nLast,1,1\n'
+        response = self.client.post('/store/products/import/csv/', content, content_type='text/csv')
+
+        data = response.json()['data']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['created'], data['invalid'], data['complete']), (2, 0, False))
+        self.assertEqual(data['errors'][0]['row'], 3)
+        self.assertIn('Cannot read the file', data['errors'][0]['errors']['non_field_errors'][0])
+        self.assertEqual(set(Product.objects.values_list('name', flat=True)), {'Old name', 'Grinder', 'Kettle'})
+
+        with tempfile.NamedTemporaryFile(suffix='.csv') as file:
+            file.write(content.replace(b'Grinder', b'Coffee mill').replace(b'Kettle', b'Teapot'))
+            file.flush()
+            out, err = StringIO(), StringIO()
+            with self.assertRaisesMessage(CommandError, 'Stopped at row 3'):
+                call_command('import_products', file.name, chunk_size=1, stdout=out, stderr=err)
+        self.assertIn('Created 2 and updated 0 products (0 invalid rows)', out.getvalue())
+        self.assertIn('Row 3:', err.getvalue())
+        self.assertEqual(Product.objects.filter(name__in=['Coffee mill', 'Teapot']).count(), 2)
+
+    def test_commands_import_and_export_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'products.jsonl')
+            with open(source, 'wb') as file:
+                file.write(orjson.dumps({'name': 'Grinder', 'unit_price': '40', 'inventory': 2}) + b'\n\n')
+                file.write(orjson.dumps({'id': self.product.id, 'inventory': 0}) + b'\n')
+            out = StringIO()
+            call_command('import_products', source, stdout=out, stderr=StringIO())
+            self.assertIn('Created 1 and updated 1 products (0 invalid rows)', out.getvalue())
+            self.assertEqual(Product.objects.get(slug='grinder').unit_price, Decimal('40'))
+
+            target = os.path.join(directory, 'products.csv')
+            call_command('export_products', target, stdout=out)
+            self.assertIn('Exported 2 products', out.getvalue())
+            with open(target, newline='', encoding='utf-8') as file:
+                rows = list(csv.DictReader(file))
+        self.assertEqual([(row['name'], row['inventory']) for row in rows], [('Old name', '0'), ('Grinder', '2')])
+
+    def test_endpoints_are_for_admins_only(self):
+        self.client.force_authenticate(CustomUser.objects.create_user('customer', password='secret-password'))
+        self.assertEqual(self.client.get('/store/products/export/csv/').status_code, 403)
+        response = self.client.post('/store/products/import/csv/', b'name,unit_price,inventory\nX,1,1\n',
+                                    content_type='text/csv')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Product.objects.filter(name='X').exists())
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework_nested import routers
 from . import views
@@ -13,6 +14,7 @@ router.register('products', views.ProductViewSet, basename='product') # product-
 router.register('carts', views.CartViewSet, basename='cart')
 router.register('customers', views.CustomerViewSet, basename='customer')
 router.register('orders', views.OrderViewSet, basename='order')
+router.register('reports/sales', views.SalesReportViewSet, basename='sales-report')
 
 
 
@@ -21,6 +23,12 @@ cart_items_router.register('items', views.CartItemViewSet, basename='cart-items'
 
 # urlpatterns = router.urls + cart_items_router.urls
 
+# Under ASGI the async pay/verify views wait on the gateway without holding a thread.
+if settings.ASYNC_PAYMENT_VIEWS:
+    pay_view, verify_view = views.AsyncOrderPayView, views.AsyncOrderVerifyView
+else:
+    pay_view, verify_view = views.OrderPayView, views.OrderVerifyView
+
 
 urlpatterns = [
 
@@ -29,6 +37,6 @@ urlpatterns = [
                 +
                 cart_items_router.urls
                )),
-    path('orders/<int:order_id>/pay/', views.OrderPayView.as_view(), name='order-pay'),
-    path('orders/verify', views.OrderVerifyView.as_view(), name='order_verify')
+    path('orders/<int:order_id>/pay/', pay_view.as_view(), name='order-pay'),
+    path('orders/verify', verify_view.as_view(), name='order_verify')
 ]
\ No newline at end of file
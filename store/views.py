@@ -1,6 +1,10 @@
-import requests
-import json 
-from django.shortcuts import get_object_or_404, redirect
+import logging
+from uuid import UUID
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect
+from django.views import View
 from django.db.models import Prefetch
 from django.urls import reverse
 
@@ -14,46 +18,81 @@ from rest_framework.viewsets import ModelViewSet
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny 
 #ReadOnlyModelViewSet   instead of     ModelViewSet | for only read and get objects without deleting and updating
 from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from store import zarinpal
+from store import carts, catalog, fastpath, payments, routers, sales, zarinpal
+from store.cache import CatalogCacheMixin
 from store.models import BannerImage, Cart, CartItem, Customer, Order, OrderItem, Product
-from store.paginations import DefaultPagination
+from store.paginations import DefaultPagination, KeysetPagination
 from store.permissions import CustomDjangoModelPermissions, IsAdminOrReadOnly
-from store.serializers import AddCartItemSerializer, BannerImageSerializer, CartItemSerializer, CartSerializer, CustomerSerializer, OrderCreateSerializer, OrderForAdminSerializer, OrderItemSerializer, OrderSerializer, OrderUpdateSerializer, ProductSerializer, UpdateCartItemSerializer
-from .filters import ProductFilter
-from .signals import order_created
+from store.renders import render_envelope
+from store.serializers import AddCartItemSerializer, BannerImageSerializer, BulkCartItemSerializer, CartItemSerializer, CartSerializer, CustomerSerializer, OrderCreateSerializer, OrderForAdminSerializer, OrderItemSerializer, OrderSerializer, OrderUpdateSerializer, ProductSerializer, UpdateCartItemSerializer
+from store.serializers import DailySalesSerializer, SalesReportQuerySerializer, SalesTotalsSerializer, TopProductSerializer
+from .filters import OrderFilter, ProductFilter, ProductSearchFilter, RankedOrderingFilter
 from rest_framework.views import APIView
 from config import settings
 
 
+logger = logging.getLogger(__name__)
+
+
 
 #class-based view
 #productlist and product detail both together including post put patch delete-------------------------------------------------
 
-class BannerImageViewSet(ModelViewSet):
+class BannerImageViewSet(CatalogCacheMixin, ModelViewSet):
+     catalog_cache_namespace = 'banner'
      serializer_class = BannerImageSerializer
      permission_classes  = [IsAdminOrReadOnly]
      queryset = BannerImage.objects.all()
 
      
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(CatalogCacheMixin, ModelViewSet):
 
+     catalog_cache_namespace = 'product'
      serializer_class = ProductSerializer
-     filter_backends = [SearchFilter, DjangoFilterBackend, OrderingFilter]
+     filter_backends = [ProductSearchFilter, DjangoFilterBackend, RankedOrderingFilter]
      ordering_fields = ['name', 'unit_price', 'inventory']
-     search_fields = ['name']
     
      filterset_class = ProductFilter
+     pagination_class = KeysetPagination
      permission_classes = [IsAdminOrReadOnly]
-     queryset = Product.objects.all()
+     queryset = Product.objects.prefetch_related('images').all()
       
      def get_serializer_context(self):
           return {'request': self.request}
+
+     def list(self, request, *args, **kwargs):
+          if not fastpath.enabled():
+               return super().list(request, *args, **kwargs)
+          return self._cached(self._fast_list, request, *args, **kwargs)
+
+     def _fast_list(self, request, *args, **kwargs):
+          rows = fastpath.product_rows(self.filter_queryset(self.get_queryset()))
+          page = self.paginate_queryset(rows)
+          if page is None:
+               return Response(fastpath.serialize_products(list(rows), request))
+          return self.get_paginated_response(fastpath.serialize_products(page, request))
      
+     @action(detail=False, methods=['GET'], url_path=r'export/(?P<file_format>csv|jsonl)', url_name='export',
+             permission_classes=[IsAdminUser])
+     def export(self, request, file_format):
+          response = StreamingHttpResponse(catalog.export_lines(file_format), content_type=catalog.CONTENT_TYPES[file_format])
+          response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+          return response
+
+     @action(detail=False, methods=['POST'], url_path=r'import/(?P<file_format>csv|jsonl)', url_name='import',
+             permission_classes=[IsAdminUser])
+     def import_products(self, request, file_format):
+          # The raw body, read line by line as it is imported instead of through request.data.
+          rows = catalog.read_rows(catalog.decode_lines(request.stream or [], file_format), file_format)
+          return Response(catalog.import_products(rows).as_dict())
+
      def destroy(self, request, pk):
           product = get_object_or_404(Product.objects.all(), pk=pk)
           if product.order_items.count() > 0:
@@ -68,9 +107,15 @@ class CartItemViewSet(ModelViewSet):
      http_method_names = ['get', 'post', 'patch', 'delete']
 
      
-     def get_queryset(self):
-          cart_pk = self.kwargs['cart_pk']
-          return CartItem.objects.select_related('product').filter(cart_id=cart_pk).all()
+     def get_cart_items(self):
+          items = carts.get_cart_store().items(self.kwargs['cart_pk'])
+          return carts.with_products(items or [])
+
+     def get_object(self):
+          for cart_item in self.get_cart_items():
+               if str(cart_item.id) == str(self.kwargs['pk']):
+                    return cart_item
+          raise Http404
 
 
      def get_serializer_class(self):
@@ -83,6 +128,29 @@ class CartItemViewSet(ModelViewSet):
      def get_serializer_context(self):
           return{'cart_pk': self.kwargs['cart_pk']}
 
+     def list(self, request, *args, **kwargs):
+          cart_items = self.get_cart_items()
+          page = self.paginate_queryset(cart_items)
+          if page is None:
+               return Response(self.get_serializer(cart_items, many=True).data)
+          return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+     def destroy(self, request, *args, **kwargs):
+          if not carts.get_cart_store().remove(self.kwargs['cart_pk'], self.kwargs['pk']):
+               raise Http404
+          return Response(status=status.HTTP_204_NO_CONTENT)
+
+     @action(detail=False, methods=['POST'])
+     def bulk(self, request, cart_pk):
+          cart_store = carts.get_cart_store()
+          if not cart_store.exists(cart_pk):
+               raise Http404
+          data = {'items': request.data} if isinstance(request.data, list) else request.data
+          serializer = BulkCartItemSerializer(data=data, context=self.get_serializer_context())
+          serializer.is_valid(raise_exception=True)
+          cart_id = serializer.save()
+          return Response(fastpath.serialize_cart(cart_id, carts.with_products(cart_store.items(cart_id) or [])))
+
 
 class CartViewSet(CreateModelMixin,
                    RetrieveModelMixin,
@@ -92,6 +160,29 @@ class CartViewSet(CreateModelMixin,
      queryset = Cart.objects.prefetch_related('items__product').all()
      lookup_value_regex = '[0-9a-fA-F]{8}\-?[0-9a-fA-F]{4}\-?[0-9a-fA-F]{4}\-?[0-9a-fA-F]{4}\-?[0-9a-fA-F]{12}'
 
+     def create(self, request, *args, **kwargs):
+          cart_id = carts.get_cart_store().create()
+          routers.pin('cart', cart_id)
+          return Response(fastpath.serialize_cart(cart_id, []), status=status.HTTP_201_CREATED)
+
+     def retrieve(self, request, *args, **kwargs):
+          cart_store = carts.get_cart_store()
+          if cart_store.models:
+               if not fastpath.enabled():
+                    return super().retrieve(request, *args, **kwargs)
+               cart_id = get_object_or_404(Cart.objects.values_list('id', flat=True), pk=kwargs['pk'])
+               return Response(fastpath.serialize_cart(cart_id))
+
+          cart_items = cart_store.items(kwargs['pk'])
+          if cart_items is None:
+               raise Http404
+          return Response(fastpath.serialize_cart(UUID(kwargs['pk']), carts.with_products(cart_items)))
+
+     def destroy(self, request, *args, **kwargs):
+          if not carts.get_cart_store().delete(kwargs['pk']):
+               raise Http404
+          return Response(status=status.HTTP_204_NO_CONTENT)
+
 class CustomerViewSet(ModelViewSet):
      serializer_class = CustomerSerializer   
      queryset = Customer.objects.all()
@@ -116,6 +207,10 @@ class CustomerViewSet(ModelViewSet):
 class OrderViewSet(ModelViewSet):
 
      http_method_names = ['get', 'post', 'delete', 'patch', 'options','head']
+     filter_backends = [DjangoFilterBackend, OrderingFilter]
+     filterset_class = OrderFilter
+     ordering_fields = ['datetime_created', 'total_price', 'items_count']
+     pagination_class = KeysetPagination
      
      def get_permissions(self):
           if self.request.method in ['PATCH', 'DELETE']:
@@ -162,8 +257,6 @@ class OrderViewSet(ModelViewSet):
           create_order_serializer.is_valid(raise_exception=True)
           created_order = create_order_serializer.save()
 
-          order_created.send_robust(self.__class__, order=created_order)
-
           serializer= OrderSerializer(created_order)
           return Response(serializer.data)
 
@@ -186,8 +279,47 @@ class OrderViewSet(ModelViewSet):
      
 
 
+class SalesReportViewSet(GenericViewSet):
+     """
+     Revenue and top sellers of a period (?start=&end=, the last 30 days by
+     default), read from the sales rollups only.
+     """
+     permission_classes = [IsAdminUser]
+
+     def get_query(self):
+          serializer = SalesReportQuerySerializer(data=self.request.query_params)
+          serializer.is_valid(raise_exception=True)
+          return serializer.validated_data
+
+     def list(self, request):
+          query = self.get_query()
+          start, end = query['start'], query['end']
+          return Response({
+               'start': start,
+               'end': end,
+               'totals': SalesTotalsSerializer(sales.sales_totals(start, end)).data,
+               'days': DailySalesSerializer(sales.daily_sales(start, end), many=True).data,
+          })
+
+     @action(detail=False, methods=['GET'], url_path='top-products')
+     def top_products(self, request):
+          query = self.get_query()
+          products = sales.top_products(query['start'], query['end'], query['limit'], query['order_by'])
+          return Response({
+               'start': query['start'],
+               'end': query['end'],
+               'products': TopProductSerializer(products, many=True).data,
+          })
+
+
+
 #zarinpall
 
+def gateway_timing(response, gateway_response):
+    response['Server-Timing'] = f'gateway;dur={gateway_response.elapsed * 1000:.1f}'
+    return response
+
+
 class OrderPayView(APIView):
     http_method_names = ['get', 'option', 'head']
     permission_classes = [IsAuthenticated]
@@ -206,34 +338,28 @@ class OrderPayView(APIView):
             'order_id': int(order_id),
         }
 
-        req_data = {
-            "MerchantID": settings.ZARINPALL_MERCHANT_ID,
-            "Amount": int(order.get_total_price()),
-            "Description": 'Mystore',
-            "Phone": '',
-            "CallbackURL": request.build_absolute_uri(reverse('store:order_verify')),
-        }
-
-        request_header = {
-            "accept": "application/json",
-            "content-type": "application/json"
-        }
-        res = requests.post(zarinpal.ZP_API_REQUEST, data=json.dumps(req_data), headers=request_header)
-        print(res)
-        # print(res.json()['data'])
+        try:
+            gateway_response = zarinpal.client.request_payment(
+                amount=int(order.get_total_price()),
+                callback_url=request.build_absolute_uri(reverse('store:order_verify')),
+            )
+        except zarinpal.ZarinpalError:
+            return Response({'error': 'Error from zarinpal'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-        data = res.json()
-        print(data)
-        authority = data['Authority']
+        data = gateway_response.data
+        authority = data.get('Authority', '')
         order.zarinpal_authority = authority
         order.save()
 
         if 'errors' not in data or len(data['errors']) == 0:
-            return redirect(zarinpal.ZP_API_STARTPAY.format(sandbox=zarinpal.sandbox, authority=authority))
+            return gateway_timing(redirect(zarinpal.client.start_pay_url(authority)), gateway_response)
         else:
-            print(data['errors'])
+            logger.warning('zarinpal payment request for order %s failed: %s', order.id, data['errors'])
             # Need to ckeak for order.return_products_to_cart
-            return Response({'error': 'Error from zarinpal'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            return gateway_timing(
+                Response({'error': 'Error from zarinpal'}, status=status.HTTP_503_SERVICE_UNAVAILABLE),
+                gateway_response,
+            )
 
 
 class OrderVerifyView(APIView):
@@ -247,46 +373,131 @@ class OrderVerifyView(APIView):
         order = get_object_or_404(Order, zarinpal_authority=payment_authority)
 
         if payment_status == 'OK':
-            request_header = {
-                "accept": "application/json",
-                "content-type": "application/json",
-            }
-
-            req_data = {
-                'MerchantID': settings.ZARINPALL_MERCHANT_ID,
-                'Amount': int(order.get_total_price()),
-                'Authority': payment_authority,
-            }
-
-            res = requests.post(
-                    zarinpal.ZP_API_VERIFY,
-                    data=json.dumps(req_data),
-                    headers=request_header,
-
+            try:
+                gateway_response = zarinpal.client.verify_payment(
+                    amount=int(order.get_total_price()),
+                    authority=payment_authority,
                 )
-            if 'errors' not in res.json():
-                data = res.json()
-                payment_code = data['Status']
-
-                if payment_code == 100:
-                    order.status = 'p'
-                    order.zarinpal_ref_id = data['RefID']
-                    order.zarinpal_data = data
-                    order.save()
-                    return Response({'success': 'Your payment has been successfully completed!'}, status=status.HTTP_200_OK)
-                    # Need to ckeak for order.return_products_to_cart
-                elif payment_code == 101:
-                    return Response({'success': 'Your payment has been successfully completed.'
-                                    ' Of course, this transaction has already been registered!'}, status=status.HTTP_200_OK)
-
-                else:
-                    # Need to ckeak for order.return_products_to_cart
-                    error_code = res.json().get('errors', {}).get('code')
-                    # error_message = res.json()['errors']['message']
-                    error_message = res.json().get('errors', {}).get('message')
-                    return Response({'error': f'The transaction was unsuccessful! {error_message} {error_code} '}, status=status.HTTP_400_BAD_REQUEST)
+            except zarinpal.ZarinpalError:
+                return Response({'error': 'Error from zarinpal'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            data = gateway_response.data
+            payment_code = data.get('Status')
+
+            if 'errors' not in data and payment_code == 100:
+                payments.mark_paid(order.id, payment_authority, data)
+                response = Response({'success': 'Your payment has been successfully completed!'}, status=status.HTTP_200_OK)
+                # Need to ckeak for order.return_products_to_cart
+            elif 'errors' not in data and payment_code == 101:
+                response = Response({'success': 'Your payment has been successfully completed.'
+                                ' Of course, this transaction has already been registered!'}, status=status.HTTP_200_OK)
+
+            else:
+                # Need to ckeak for order.return_products_to_cart
+                response = Response({'error': f'The transaction was unsuccessful! {payments.describe_errors(data)}'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+            return gateway_timing(response, gateway_response)
 
         else:
 
             # Need to ckeak for order.return_products_to_cart
             return Response({'error': 'The transaction was unsuccessful or canceled by user !'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class AsyncPaymentView(View):
+    """
+    Base of the async pay/verify views, routed instead of the DRF ones when
+    ASYNC_PAYMENT_VIEWS is on (under ASGI). Same JWT authentication and
+    response envelope, but the gateway is awaited with
+    `zarinpal.async_client`, so a payment waiting on it holds no thread.
+    """
+    http_method_names = ['get', 'options', 'head']
+    authentication = JWTAuthentication()
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            authenticated = await sync_to_async(self.authentication.authenticate)(request)
+        except AuthenticationFailed as error:
+            return self.unauthorized(request, error.detail)
+        if authenticated is None:
+            return self.unauthorized(request, NotAuthenticated.default_detail)
+        request.user = authenticated[0]
+
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except Http404 as error:
+            return self.respond({'detail': str(error)}, status.HTTP_404_NOT_FOUND)
+
+    def respond(self, data, status_code=status.HTTP_200_OK):
+        return HttpResponse(render_envelope(data, status_code), status=status_code, content_type='application/json')
+
+    def unauthorized(self, request, detail):
+        response = self.respond(detail if isinstance(detail, dict) else {'detail': detail}, status.HTTP_401_UNAUTHORIZED)
+        response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+        return response
+
+
+class AsyncOrderPayView(AsyncPaymentView):
+
+    async def get(self, request, order_id):
+        order = await aget_object_or_404(Order, id=order_id)
+
+        if order.status == Order.ORDER_STATUS_PAID:
+            return self.respond('This order has been paid!')
+
+        await sync_to_async(self.remember_order)(request, order)
+
+        try:
+            gateway_response = await zarinpal.async_client.request_payment(
+                amount=int(order.get_total_price()),
+                callback_url=request.build_absolute_uri(reverse('store:order_verify')),
+            )
+        except zarinpal.ZarinpalError:
+            return self.respond({'error': 'Error from zarinpal'}, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        data = gateway_response.data
+        order.zarinpal_authority = data.get('Authority', '')
+        await order.asave(update_fields=['zarinpal_authority'])
+
+        if 'errors' not in data or len(data['errors']) == 0:
+            return gateway_timing(redirect(zarinpal.async_client.start_pay_url(order.zarinpal_authority)), gateway_response)
+        logger.warning('zarinpal payment request for order %s failed: %s', order.id, data['errors'])
+        return gateway_timing(
+            self.respond({'error': 'Error from zarinpal'}, status.HTTP_503_SERVICE_UNAVAILABLE), gateway_response,
+        )
+
+    def remember_order(self, request, order):
+        request.session['order_pay'] = {'order_id': order.id}
+        request.session['order_id'] = {'order_id': order.id}
+
+
+class AsyncOrderVerifyView(AsyncPaymentView):
+
+    async def get(self, request):
+        payment_authority = request.GET.get('Authority')
+        order = await aget_object_or_404(Order, zarinpal_authority=payment_authority)
+
+        if request.GET.get('Status') != 'OK':
+            return self.respond({'error': 'The transaction was unsuccessful or canceled by user !'},
+                                status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        try:
+            gateway_response = await zarinpal.async_client.verify_payment(
+                amount=int(order.get_total_price()),
+                authority=payment_authority,
+            )
+        except zarinpal.ZarinpalError:
+            return self.respond({'error': 'Error from zarinpal'}, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        data = gateway_response.data
+        payment_code = data.get('Status')
+        if 'errors' not in data and payment_code == 100:
+            await payments.amark_paid(order.id, payment_authority, data)
+            response = self.respond({'success': 'Your payment has been successfully completed!'})
+        elif 'errors' not in data and payment_code == 101:
+            response = self.respond({'success': 'Your payment has been successfully completed.'
+                                     ' Of course, this transaction has already been registered!'})
+        else:
+            response = self.respond({'error': f'The transaction was unsuccessful! {payments.describe_errors(data)}'},
+                                    status.HTTP_400_BAD_REQUEST)
+        return gateway_timing(response, gateway_response)
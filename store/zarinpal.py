@@ -1,11 +1,182 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import namedtuple
+
+import aiohttp
+import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from store.metrics import GATEWAY_LATENCY
+
+ZP_HOSTS = {
+    True: 'https://sandbox.zarinpal.com',
+    False: 'https://www.zarinpal.com',
+}
+ZP_API_REQUEST = '/pg/rest/WebGate/PaymentRequest.json'
+ZP_API_VERIFY = '/pg/rest/WebGate/PaymentVerification.json'
+ZP_API_STARTPAY = '/pg/StartPay/{authority}'
+CallbackURL = 'http://127.0.0.1:8000/orders/verify'
+
+
+def get_base_url():
+    """The gateway host: ZARINPAL_BASE_URL (e.g. the local simulator) if set, else the (sandbox) gateway."""
+    return getattr(settings, 'ZARINPAL_BASE_URL', '') or ZP_HOSTS[settings.SANDBOX]
+
+
+logger = logging.getLogger(__name__)
+
+GatewayResponse = namedtuple('GatewayResponse', ['data', 'elapsed'])
+
+
+class ZarinpalError(Exception):
+    pass
+
+
+class ZarinpalClient:
+    """
+    Zarinpal REST client sharing one pooled keep-alive session per process.
+
+    Every call is bounded by connect/read timeouts. Only verification is
+    retried: it is idempotent on the gateway side, while a retried payment
+    request could open a second authority for the same order.
+    """
+    headers = {
+        "accept": "application/json",
+        "content-type": "application/json",
+    }
+
+    def __init__(self, connect_timeout=None, read_timeout=None, verify_retries=None, backoff=None, pool_size=None):
+        self.timeout = (
+            connect_timeout or getattr(settings, 'ZARINPAL_CONNECT_TIMEOUT', 3.05),
+            read_timeout or getattr(settings, 'ZARINPAL_READ_TIMEOUT', 10),
+        )
+        self.verify_retries = verify_retries if verify_retries is not None else getattr(settings, 'ZARINPAL_VERIFY_RETRIES', 2)
+        self.backoff = backoff if backoff is not None else getattr(settings, 'ZARINPAL_RETRY_BACKOFF', 0.5)
+        self.pool_size = pool_size or getattr(settings, 'ZARINPAL_POOL_SIZE', 10)
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    def request_payment(self, amount, callback_url, description='Mystore', phone=''):
+        return self._post(get_base_url() + ZP_API_REQUEST, {
+            "MerchantID": settings.ZARINPALL_MERCHANT_ID,
+            "Amount": amount,
+            "Description": description,
+            "Phone": phone,
+            "CallbackURL": callback_url,
+        }, operation='request', retries=0)
+
+    def verify_payment(self, amount, authority):
+        return self._post(get_base_url() + ZP_API_VERIFY, {
+            'MerchantID': settings.ZARINPALL_MERCHANT_ID,
+            'Amount': amount,
+            'Authority': authority,
+        }, operation='verify', retries=self.verify_retries)
+
+    def start_pay_url(self, authority):
+        return get_base_url() + ZP_API_STARTPAY.format(authority=authority)
+
+    def _post(self, url, payload, operation, retries):
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                res = self.session.post(url, json=payload, timeout=self.timeout)
+                if res.status_code >= 500 and attempt <= retries:
+                    raise requests.HTTPError(f'{res.status_code} from gateway', response=res)
+                data = res.json()
+                break
+            except (requests.RequestException, ValueError) as error:
+                if attempt > retries or not self._is_retryable(error):
+                    self._failed(url, operation, attempt, started, error)
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+        return self._succeeded(url, operation, attempt, started, res.status_code, data)
+
+    def _is_retryable(self, error):
+        return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.HTTPError))
+
+    def _failed(self, url, operation, attempt, started, error):
+        elapsed = time.monotonic() - started
+        GATEWAY_LATENCY.labels(operation, 'error').observe(elapsed)
+        logger.warning('zarinpal %s failed after %d attempt(s) in %.0fms: %s', url, attempt, elapsed * 1000, error)
+        raise ZarinpalError(str(error)) from error
+
+    def _succeeded(self, url, operation, attempt, started, status_code, data):
+        elapsed = time.monotonic() - started
+        GATEWAY_LATENCY.labels(operation, 'ok').observe(elapsed)
+        logger.info('zarinpal %s status=%s attempts=%d %.0fms', url, status_code, attempt, elapsed * 1000)
+        return GatewayResponse(data, elapsed)
+
+
+class AsyncZarinpalClient(ZarinpalClient):
+    """
+    The same client over aiohttp for the async views: `request_payment` and
+    `verify_payment` return coroutines, and waiting on the gateway holds no
+    thread. Every event loop gets its own pooled session of up to
+    `max_connections` connections, which `aclose` closes (the server's on
+    ASGI lifespan shutdown, see store/asgi.py).
+    """
+
+    def __init__(self, max_connections=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_connections = max_connections or getattr(settings, 'ZARINPAL_ASYNC_MAX_CONNECTIONS', 500)
+        self._sessions = weakref.WeakKeyDictionary()
+
+    @property
+    def session(self):
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None:
+            session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(connect=self.timeout[0], sock_read=self.timeout[1]),
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+            )
+            self._sessions[loop] = session
+        return session
+
+    async def aclose(self):
+        """Close the running event loop's session, e.g. before a test's loop ends."""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def _post(self, url, payload, operation, retries):
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self.session.post(url, json=payload) as res:
+                    if res.status >= 500 and attempt <= retries:
+                        raise aiohttp.ClientResponseError(res.request_info, res.history, status=res.status,
+                                                          message=f'{res.status} from gateway')
+                    data = await res.json(content_type=None)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as error:
+                if attempt > retries or not self._is_retryable(error):
+                    self._failed(url, operation, attempt, started, error)
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+        return self._succeeded(url, operation, attempt, started, res.status, data)
+
+    def _is_retryable(self, error):
+        return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError, aiohttp.ClientResponseError))
 
-if settings.SANDBOX:
-    sandbox = 'sandbox'
-else:
-    sandbox = 'www'
 
-ZP_API_REQUEST = f"https://{sandbox}.zarinpal.com/pg/rest/WebGate/PaymentRequest.json"
-ZP_API_VERIFY = f"https://{sandbox}.zarinpal.com/pg/rest/WebGate/PaymentVerification.json"
-ZP_API_STARTPAY = "https://{sandbox}.zarinpal.com/pg/StartPay/{authority}"
-CallbackURL = 'http://127.0.0.1:8000/orders/verify'
\ No newline at end of file
+client = ZarinpalClient()
+async_client = AsyncZarinpalClient()
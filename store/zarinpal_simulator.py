@@ -0,0 +1,221 @@
+"""
+Local stand-in for the ZarinPal gateway, for functional and load tests.
+
+`GatewaySimulator` answers PaymentRequest, PaymentVerification and StartPay
+with configurable latency, HTTP failures and outcomes. Serve it with
+`manage.py zarinpal_simulator` and point the store at it with
+ZARINPAL_BASE_URL (see `zarinpal.get_base_url`).
+
+Like the gateway, it remembers the authorities it hands out: verifying an
+unknown authority or another amount fails, the first verification of an
+authority answers with an outcome drawn from `verify_outcomes`, and later
+verifications of a paid one answer 101. StartPay stands in for the customer:
+it redirects to the callback URL with Status=OK, or NOK for `cancel_rate` of
+the payments.
+"""
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+from store import zarinpal
+
+
+VERIFIED = 100
+ALREADY_VERIFIED = 101
+
+MESSAGES = {
+    -1: 'Incomplete information',
+    -3: 'Amount out of range',
+    -11: 'Request not found',
+    -21: 'No financial operation found for this transaction',
+    -22: 'Unsuccessful transaction',
+    -33: 'Amount does not match the paid amount',
+}
+
+
+class Latency:
+    """
+    A latency distribution in milliseconds: 'fixed:50', 'uniform:20:80',
+    'lognormal:40:0.5' (median and sigma, for a long tail) or 'exponential:50'
+    (mean).
+    """
+    arguments = {'fixed': 1, 'uniform': 2, 'lognormal': 2, 'exponential': 1}
+
+    def __init__(self, spec):
+        kind, *args = spec.split(':')
+        if self.arguments.get(kind) != len(args):
+            raise ValueError(f'Invalid latency {spec!r}, expected one of {", ".join(self.arguments)} with its arguments')
+        self.spec = spec
+        self.kind = kind
+        self.args = [float(arg) for arg in args]
+
+    def sample(self, rng):
+        """One latency in seconds."""
+        if self.kind == 'fixed':
+            milliseconds = self.args[0]
+        elif self.kind == 'uniform':
+            milliseconds = rng.uniform(*self.args)
+        elif self.kind == 'lognormal':
+            median, sigma = self.args
+            milliseconds = rng.lognormvariate(math.log(median), sigma) if median > 0 else 0
+        else:
+            milliseconds = rng.expovariate(1 / self.args[0]) if self.args[0] > 0 else 0
+        return max(milliseconds, 0) / 1000
+
+    def __str__(self):
+        return self.spec
+
+
+def parse_outcomes(spec):
+    """'100:0.95,-21:0.05' -> {100: 0.95, -21: 0.05}, status codes with their weights."""
+    outcomes = {}
+    for item in filter(None, spec.split(',')):
+        code, weight = item.split(':')
+        outcomes[int(code)] = float(weight)
+    if not outcomes:
+        raise ValueError(f'Invalid outcomes {spec!r}')
+    return outcomes
+
+
+class GatewaySimulator:
+
+    def __init__(self, request_latency='fixed:0', verify_latency='fixed:0', startpay_latency='fixed:0',
+                 request_outcomes=None, verify_outcomes=None, error_rate=0.0, error_status=503,
+                 cancel_rate=0.0, seed=None):
+        self.latency = {
+            'request': Latency(request_latency),
+            'verify': Latency(verify_latency),
+            'startpay': Latency(startpay_latency),
+        }
+        self.request_outcomes = request_outcomes or {VERIFIED: 1.0}
+        self.verify_outcomes = verify_outcomes or {VERIFIED: 1.0}
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.cancel_rate = cancel_rate
+        self.rng = random.Random(seed)
+        self.payments = {}
+        self.lock = threading.Lock()
+        self.next_ref_id = 100000
+
+    def handle(self, method, path, body=b''):
+        """Answer one HTTP request: (status, headers, body)."""
+        path = path.split('?', 1)[0]
+        start_pay = zarinpal.ZP_API_STARTPAY.split('{', 1)[0]
+        if method == 'POST' and path == zarinpal.ZP_API_REQUEST:
+            operation, answer = 'request', self.payment_request
+        elif method == 'POST' and path == zarinpal.ZP_API_VERIFY:
+            operation, answer = 'verify', self.payment_verification
+        elif method == 'GET' and path.startswith(start_pay):
+            return self.start_pay(path[len(start_pay):])
+        else:
+            return 404, {}, b''
+
+        time.sleep(self.latency[operation].sample(self.rng))
+        if self.rng.random() < self.error_rate:
+            return self.json(self.error_status, {'errors': {'code': -1, 'message': 'Gateway error'}})
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return self.json(400, self.error(-1))
+        return self.json(200, answer(payload))
+
+    def payment_request(self, payload):
+        if not payload.get('MerchantID') or not payload.get('CallbackURL') or not payload.get('Amount'):
+            return self.error(-1)
+        status = self.draw(self.request_outcomes)
+        if status != VERIFIED:
+            return self.error(status)
+
+        authority = 'A' + ''.join(self.rng.choice('0123456789') for _ in range(35))
+        with self.lock:
+            self.payments[authority] = {
+                'amount': int(payload['Amount']),
+                'callback_url': payload['CallbackURL'],
+                'ref_id': None,
+            }
+        return {'Status': VERIFIED, 'Authority': authority}
+
+    def payment_verification(self, payload):
+        with self.lock:
+            payment = self.payments.get(payload.get('Authority'))
+            if payment is None:
+                return self.error(-11)
+            if int(payload.get('Amount') or 0) != payment['amount']:
+                return self.error(-33)
+            if payment['ref_id'] is not None:
+                return {'Status': ALREADY_VERIFIED, 'RefID': payment['ref_id']}
+
+            status = self.draw(self.verify_outcomes)
+            if status not in (VERIFIED, ALREADY_VERIFIED):
+                return self.error(status)
+            self.next_ref_id += 1
+            payment['ref_id'] = self.next_ref_id
+            return {'Status': status, 'RefID': payment['ref_id']}
+
+    def start_pay(self, authority):
+        time.sleep(self.latency['startpay'].sample(self.rng))
+        with self.lock:
+            payment = self.payments.get(authority)
+        if payment is None:
+            return 404, {}, b''
+        status = 'NOK' if self.rng.random() < self.cancel_rate else 'OK'
+        location = f'{payment["callback_url"]}?{urlencode({"Authority": authority, "Status": status})}'
+        return 302, {'Location': location}, b''
+
+    def draw(self, outcomes):
+        return self.rng.choices(list(outcomes), weights=list(outcomes.values()))[0]
+
+    def error(self, code):
+        return {'Status': code, 'errors': {'code': code, 'message': MESSAGES.get(code, 'Error')}}
+
+    def json(self, status, data):
+        return status, {'Content-Type': 'application/json'}, json.dumps(data).encode()
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.answer()
+
+    def answer(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        status, headers, content = self.server.simulator.handle(self.command, self.path, body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once.
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up before the (deliberately slow) answer.
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def make_server(simulator, host='127.0.0.1', port=8001, verbose=False):
+    """A threaded HTTP server for `simulator`; port 0 picks a free port (see `server.server_port`)."""
+    server = SimulatorServer((host, port), SimulatorRequestHandler)
+    server.simulator = simulator
+    server.verbose = verbose
+    return server